@@ -1,15 +1,20 @@
 import os
-from dotenv import load_dotenv
-from openai import OpenAI
+import time
 import logging
+from startup import load_environment
+from tracing import span
+from metrics import counter, histogram
 
 # Load environment variables
-load_dotenv()
+load_environment()
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+LLM_CALLS = counter("jukebox_llm_calls_total", "LLM calls by task, model and outcome", ("task", "model", "outcome"))
+LLM_SECONDS = histogram("jukebox_llm_call_seconds", "LLM call latency by task", ("task",))
+
 class LLMClient:
     def __init__(self):
         """
@@ -19,8 +24,10 @@ class LLMClient:
         if not self.api_key:
             raise ValueError("OPENROUTER_API_KEY not found in environment variables")
         
+        # openai is slow to import, so it is only loaded once a client is needed
+        from openai import OpenAI
         self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
+            base_url=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
             api_key=self.api_key,
         )
         
@@ -30,34 +37,41 @@ class LLMClient:
             "X-Title": os.getenv("SITE_NAME", ""),      # Optional
         }
 
-    def call_llm(self, prompt, model="mistralai/mistral-small-3.2-24b-instruct:free", **kwargs):
+    def call_llm(self, prompt, model="mistralai/mistral-small-3.2-24b-instruct:free", task="other", **kwargs):
         """
         One-liner method to call the LLM with a prompt.
         
         Args:
             prompt (str): The input prompt for the LLM
             model (str): The model to use (default: qwen/qwen3-coder)
+            task (str): What the call is for, e.g. "joke", used to label its metrics
             **kwargs: Additional arguments to pass to the API
             
         Returns:
             str: The response from the LLM
         """
-        try:
-            completion = self.client.chat.completions.create(
-                extra_headers=self.headers,
-                model=model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                **kwargs
-            )
-            return completion.choices[0].message.content
-        except Exception as e:
-            logger.error(f"Error calling LLM: {e}")
-            raise
+        start = time.perf_counter()
+        with span("call_llm", model=model, task=task):
+            try:
+                completion = self.client.chat.completions.create(
+                    extra_headers=self.headers,
+                    model=model,
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": prompt
+                        }
+                    ],
+                    **kwargs
+                )
+                LLM_CALLS.labels(task, model, "ok").inc()
+                return completion.choices[0].message.content
+            except Exception as e:
+                LLM_CALLS.labels(task, model, "error").inc()
+                logger.error(f"Error calling LLM: {e}")
+                raise
+            finally:
+                LLM_SECONDS.labels(task).observe(time.perf_counter() - start)
 
     def ask_question(self, question, model="qwen/qwen3-coder:free"):
         """
@@ -1,21 +1,60 @@
-import os
-import pyaudio
+import time
 import wave
-from dotenv import load_dotenv
+from startup import load_environment
+from speech_client import get_speech_client
+from tracing import span, traced
+from metrics import counter, histogram
 from io import BytesIO
-import requests
-from elevenlabs.client import ElevenLabs
 
-load_dotenv()
+load_environment()
 
-elevenlabs = ElevenLabs(
-    api_key=os.getenv("ELEVENLABS_API_KEY"),
-)
+STT_CALLS = counter("jukebox_stt_calls_total", "Transcription requests by outcome", ("outcome",))
+STT_BYTES = counter("jukebox_stt_uploaded_bytes_total", "Audio bytes uploaded for transcription")
+STT_SECONDS = histogram("jukebox_stt_seconds", "Transcription request latency")
 
+# Where record_audio() gets its audio from; None is the default input device
+_microphone = None
+
+def set_microphone(microphone):
+    """
+    Replace the microphone record_audio() and check_microphone() use, e.g. with
+    recordings read from files.
+    
+    Args:
+        microphone: Object with a name and record(filename, record_seconds) returning
+            the path of the WAV file written, or None for the default input device
+    """
+    global _microphone
+    _microphone = microphone
+
+def check_microphone():
+    """
+    Check that a microphone is available, without recording.
+    
+    Returns:
+        str: Name of the default input device
+        
+    Raises:
+        OSError: If there is no input device
+    """
+    if _microphone is not None:
+        return _microphone.name
+    import pyaudio
+    p = pyaudio.PyAudio()
+    try:
+        return p.get_default_input_device_info()["name"]
+    finally:
+        p.terminate()
+
+@traced("record_audio")
 def record_audio(filename="recorded_audio.wav", record_seconds=5):
     """
     Record audio from microphone and save to WAV file
     """
+    if _microphone is not None:
+        return _microphone.record(filename, record_seconds)
+    import pyaudio
+    
     # Audio parameters
     chunk = 1024
     sample_format = pyaudio.paInt16
@@ -56,24 +95,38 @@ def record_audio(filename="recorded_audio.wav", record_seconds=5):
     
     return filename
 
+def transcribe_audio_bytes(audio_bytes):
+    """
+    Transcribe an in-memory recording using ElevenLabs API
+    """
+    STT_BYTES.inc(len(audio_bytes))
+    start = time.perf_counter()
+    # Send to ElevenLabs for transcription
+    with span("transcribe_audio_with_elevenlabs", bytes=len(audio_bytes)):
+        try:
+            transcription = get_speech_client().speech_to_text.convert(
+                file=BytesIO(audio_bytes),
+                model_id="scribe_v1",  # Model to use, for now only "scribe_v1" is supported
+                tag_audio_events=True,  # Tag audio events like laughter, applause, etc.
+                language_code="eng",  # Language of the audio file
+                diarize=True,  # Whether to annotate who is speaking
+            )
+        except Exception:
+            STT_CALLS.labels("error").inc()
+            raise
+        finally:
+            STT_SECONDS.observe(time.perf_counter() - start)
+    
+    STT_CALLS.labels("ok").inc()
+    return transcription
+
 def transcribe_audio_with_elevenlabs(audio_filename):
     """
     Transcribe audio using ElevenLabs API
     """
     # Read the audio file
     with open(audio_filename, "rb") as audio_file:
-        audio_data = BytesIO(audio_file.read())
-    
-    # Send to ElevenLabs for transcription
-    transcription = elevenlabs.speech_to_text.convert(
-        file=audio_data,
-        model_id="scribe_v1",  # Model to use, for now only "scribe_v1" is supported
-        tag_audio_events=True,  # Tag audio events like laughter, applause, etc.
-        language_code="eng",  # Language of the audio file
-        diarize=True,  # Whether to annotate who is speaking
-    )
-    
-    return transcription
+        return transcribe_audio_bytes(audio_file.read())
 
 if __name__ == "__main__":
     # Record audio from microphone (5 seconds)
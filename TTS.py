@@ -1,16 +1,66 @@
-from dotenv import load_dotenv
-from elevenlabs.client import ElevenLabs
-from elevenlabs import play
-import os
+from startup import load_environment
+import time
+import numpy as np
+from audio_engine import get_audio_engine, SPEECH_CHANNEL
+from speech_client import get_speech_client
+from tracing import span
+from metrics import counter, histogram
 
-load_dotenv()
+load_environment()
 
-# Initialize ElevenLabs client
-elevenlabs = ElevenLabs(
-  api_key=os.getenv("ELEVENLABS_API_KEY"),
-)
+TTS_CHARACTERS = counter("jukebox_tts_characters_total", "Characters sent for speech synthesis", ("use",))
+TTS_CALLS = counter("jukebox_tts_calls_total", "Speech synthesis requests by outcome", ("outcome",))
+TTS_SECONDS = histogram("jukebox_tts_seconds", "Speech synthesis latency, until all audio is received")
 
-def speak_text(text, voice_id="JBFqnCBsd6RMkjVDRZzb", model_id="eleven_multilingual_v2"):
+# Raw 16-bit mono PCM from ElevenLabs, so nothing has to be decoded before playback
+TTS_OUTPUT_FORMAT = "pcm_24000"
+TTS_SAMPLE_RATE = 24000
+
+def synthesize_speech(text, voice_id="JBFqnCBsd6RMkjVDRZzb", model_id="eleven_multilingual_v2"):
+    """
+    Convert text to speech without playing it, e.g. to prepare speech ahead of time.
+    
+    Args:
+        text (str): The text to convert to speech
+        voice_id (str): The voice ID to use (default: JBFqnCBsd6RMkjVDRZzb)
+        model_id (str): The model ID to use (default: eleven_multilingual_v2)
+        
+    Returns:
+        np.ndarray: Mono int16 PCM samples at TTS_SAMPLE_RATE
+    """
+    TTS_CHARACTERS.labels("speech").inc(len(text))
+    start = time.perf_counter()
+    with span("synthesize_speech", characters=len(text)):
+        try:
+            audio = get_speech_client().text_to_speech.convert(
+                text=text,
+                voice_id=voice_id,
+                model_id=model_id,
+                output_format=TTS_OUTPUT_FORMAT,
+            )
+            samples = np.frombuffer(b"".join(audio), dtype=np.int16)
+        except Exception:
+            TTS_CALLS.labels("error").inc()
+            raise
+        finally:
+            TTS_SECONDS.observe(time.perf_counter() - start)
+    TTS_CALLS.labels("ok").inc()
+    return samples
+
+def play_speech(samples, block=True):
+    """
+    Play synthesized speech on the speech channel.
+    
+    Args:
+        samples (np.ndarray): Samples returned by synthesize_speech()
+        block (bool): Whether to wait until the speech finishes playing (default: True)
+        
+    Returns:
+        PlaybackHandle: Completion handle for the speech
+    """
+    return get_audio_engine().play_pcm(samples, TTS_SAMPLE_RATE, channel=SPEECH_CHANNEL, block=block)
+
+def speak_text(text, voice_id="JBFqnCBsd6RMkjVDRZzb", model_id="eleven_multilingual_v2", block=True):
     """
     Convert text to speech and play it using ElevenLabs API.
     
@@ -18,17 +68,17 @@ def speak_text(text, voice_id="JBFqnCBsd6RMkjVDRZzb", model_id="eleven_multiling
         text (str): The text to convert to speech
         voice_id (str): The voice ID to use (default: JBFqnCBsd6RMkjVDRZzb)
         model_id (str): The model ID to use (default: eleven_multilingual_v2)
+        block (bool): Whether to wait until the speech finishes playing (default: True)
+        
+    Returns:
+        PlaybackHandle: Completion handle for the speech, or None if TTS failed
     """
     try:
-        audio = elevenlabs.text_to_speech.convert(
-            text=text,
-            voice_id=voice_id,
-            model_id=model_id,
-            output_format="mp3_44100_128",
-        )
-        play(audio)
+        with span("speak_text", block=block):
+            return play_speech(synthesize_speech(text, voice_id, model_id), block=block)
     except Exception as e:
         print(f"Error in TTS: {e}")
+        return None
 
 if __name__ == "__main__":
     # Example usage
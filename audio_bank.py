@@ -0,0 +1,234 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+import soundfile as sf
+from metrics import CACHE_REQUESTS
+
+
+class AudioClip:
+    """
+    A decoded audio clip held in memory as 16-bit PCM.
+    """
+
+    def __init__(self, clip_id, samples, sample_rate):
+        """
+        Initialize the AudioClip.
+
+        Args:
+            clip_id (str): Identifier of the clip (usually the static message ID)
+            samples (np.ndarray): int16 PCM samples shaped (frames, channels)
+            sample_rate (int): Sample rate of the samples in Hz
+        """
+        self.clip_id = clip_id
+        self.samples = samples
+        self.sample_rate = sample_rate
+
+    @property
+    def channels(self):
+        """
+        Get the number of audio channels in the clip.
+
+        Returns:
+            int: Number of channels
+        """
+        return self.samples.shape[1]
+
+    @property
+    def duration(self):
+        """
+        Get the length of the clip.
+
+        Returns:
+            float: Duration of the clip in seconds
+        """
+        return self.samples.shape[0] / float(self.sample_rate)
+
+    @property
+    def nbytes(self):
+        """
+        Get the memory used by the PCM samples.
+
+        Returns:
+            int: Size of the PCM buffer in bytes
+        """
+        return self.samples.nbytes
+
+
+class AudioBank:
+    """
+    A cache of decoded static audio clips.
+    Clips are decoded from disk once and then served straight from memory.
+    When max_clips is set the cache is bounded and evicts the least recently used clip.
+    """
+
+    def __init__(self, audio_dir="static_audio", extension=".mp3", max_clips=None):
+        """
+        Initialize the AudioBank.
+
+        Args:
+            audio_dir (str): Directory containing the encoded audio files
+            extension (str): File extension of the encoded audio files
+            max_clips (int, optional): Maximum number of decoded clips to keep, None for unbounded
+        """
+        self.audio_dir = audio_dir
+        self.extension = extension
+        self.max_clips = max_clips
+        self._clips = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path_for(self, clip_id):
+        """
+        Build the path of the encoded file for a clip.
+
+        Args:
+            clip_id (str): Identifier of the clip
+
+        Returns:
+            str: Path to the encoded audio file
+        """
+        return os.path.join(self.audio_dir, f"{clip_id}{self.extension}")
+
+    def _decode(self, clip_id):
+        """
+        Decode a clip from disk into int16 PCM.
+
+        Args:
+            clip_id (str): Identifier of the clip
+
+        Returns:
+            AudioClip: The decoded clip or None if the file is missing or cannot be decoded
+        """
+        file_path = self._path_for(clip_id)
+        if not os.path.exists(file_path):
+            return None
+        try:
+            samples, sample_rate = sf.read(file_path, dtype="int16", always_2d=True)
+            return AudioClip(clip_id, np.ascontiguousarray(samples), sample_rate)
+        except Exception as e:
+            print(f"Error decoding audio clip '{clip_id}': {e}")
+            return None
+
+    def _store(self, clip):
+        """
+        Insert a clip into the cache, evicting the oldest clips if the cache is full.
+
+        Args:
+            clip (AudioClip): The clip to store
+        """
+        with self._lock:
+            self._clips[clip.clip_id] = clip
+            self._clips.move_to_end(clip.clip_id)
+            if self.max_clips is not None:
+                while len(self._clips) > self.max_clips:
+                    self._clips.popitem(last=False)
+
+    def get(self, clip_id):
+        """
+        Get a decoded clip, decoding it on first use.
+
+        Args:
+            clip_id (str): Identifier of the clip
+
+        Returns:
+            AudioClip: The decoded clip or None if it is not available
+        """
+        with self._lock:
+            clip = self._clips.get(clip_id)
+            if clip is not None:
+                self._clips.move_to_end(clip_id)
+                CACHE_REQUESTS.labels("static_audio", "hit").inc()
+                return clip
+
+        CACHE_REQUESTS.labels("static_audio", "miss").inc()
+        clip = self._decode(clip_id)
+        if clip is not None:
+            self._store(clip)
+        return clip
+
+    def invalidate(self, clip_id):
+        """
+        Drop a clip from the cache so the next lookup decodes it again.
+
+        Args:
+            clip_id (str): Identifier of the clip
+        """
+        with self._lock:
+            self._clips.pop(clip_id, None)
+
+    def available_ids(self):
+        """
+        List the clip IDs present on disk.
+
+        Returns:
+            list: Sorted clip IDs found in the audio directory
+        """
+        if not os.path.isdir(self.audio_dir):
+            return []
+        return sorted(
+            os.path.splitext(name)[0]
+            for name in os.listdir(self.audio_dir)
+            if name.endswith(self.extension)
+        )
+
+    def preload(self):
+        """
+        Decode every clip in the audio directory and report the cost.
+
+        Returns:
+            dict: Preload statistics with clip count, elapsed seconds and memory in bytes
+        """
+        start = time.perf_counter()
+        for clip_id in self.available_ids():
+            if self.max_clips is not None and len(self._clips) >= self.max_clips:
+                break
+            clip = self._decode(clip_id)
+            if clip is not None:
+                self._store(clip)
+        elapsed = time.perf_counter() - start
+
+        stats = {
+            "clips": len(self._clips),
+            "seconds": elapsed,
+            "bytes": self.memory_usage(),
+        }
+        print(f"Preloaded {stats['clips']} static audio clips in {elapsed * 1000:.0f} ms "
+              f"({stats['bytes'] / (1024 * 1024):.1f} MiB of PCM)")
+        return stats
+
+    def memory_usage(self):
+        """
+        Get the memory used by all cached clips.
+
+        Returns:
+            int: Total size of the cached PCM buffers in bytes
+        """
+        with self._lock:
+            return sum(clip.nbytes for clip in self._clips.values())
+
+
+# Shared banks keyed by audio directory so every StaticMessages instance reuses the same clips
+_banks = {}
+_banks_lock = threading.Lock()
+
+
+def get_audio_bank(audio_dir="static_audio"):
+    """
+    Get the process-wide AudioBank for a directory.
+    The cache is bounded by STATIC_AUDIO_CACHE_SIZE when that variable is set.
+
+    Args:
+        audio_dir (str): Directory containing the static audio files
+
+    Returns:
+        AudioBank: The shared bank for the directory
+    """
+    key = os.path.abspath(audio_dir)
+    with _banks_lock:
+        bank = _banks.get(key)
+        if bank is None:
+            max_clips = os.getenv("STATIC_AUDIO_CACHE_SIZE")
+            bank = AudioBank(audio_dir, max_clips=int(max_clips) if max_clips else None)
+            _banks[key] = bank
+        return bank
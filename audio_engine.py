@@ -0,0 +1,472 @@
+import time
+import threading
+from collections import deque
+import numpy as np
+import pygame
+
+# Channel names used by the rest of the jukebox
+PROMPT_CHANNEL = "prompt"
+SPEECH_CHANNEL = "speech"
+MUSIC_CHANNEL = "music"
+
+# How often to re-check a channel whose end time is unknown or overdue
+_RECHECK_SECONDS = 0.02
+_UNKNOWN_LENGTH_RECHECK_SECONDS = 0.1
+
+
+class PlaybackHandle:
+    """
+    A completion handle for one clip or song started on the AudioEngine.
+    Callers can block on wait() or register callbacks instead of guessing durations.
+    """
+
+    def __init__(self, channel, duration=None, sound=None):
+        """
+        Initialize the PlaybackHandle.
+
+        Args:
+            channel (str): Name of the channel the audio plays on
+            duration (float, optional): Expected length in seconds, None if unknown
+            sound (pygame.mixer.Sound, optional): The sound being played
+        """
+        self.channel = channel
+        self.duration = duration
+        self.sound = sound
+        self.started_at = time.monotonic()
+        self.ended_at = None
+        self.interrupted = False
+        self._mono = None
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def expected_end(self):
+        """
+        Get the monotonic time at which playback should finish.
+
+        Returns:
+            float: Expected end time, or None if the duration is unknown
+        """
+        if self.duration is None:
+            return None
+        return self.started_at + self.duration
+
+    def done(self):
+        """
+        Check whether playback has finished.
+
+        Returns:
+            bool: True if the audio finished or was interrupted, False otherwise
+        """
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Block until playback finishes.
+
+        Args:
+            timeout (float, optional): Maximum number of seconds to wait
+
+        Returns:
+            bool: True if playback finished, False if the timeout expired first
+        """
+        return self._done.wait(timeout)
+
+    def add_done_callback(self, callback):
+        """
+        Register a callback to run when playback finishes.
+        The callback runs immediately if playback has already finished.
+
+        Args:
+            callback (callable): Function called with this handle as its only argument
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def mono_samples(self, channels):
+        """
+        Get the sound as mono float samples in [-1, 1] at the mixer rate, e.g. as an echo reference.
+        The samples are computed on first use and cached.
+
+        Args:
+            channels (int): Number of channels of the mixer the sound was made for
+
+        Returns:
+            np.ndarray: float32 samples, empty if the handle has no sound
+        """
+        if self._mono is None:
+            if self.sound is None:
+                self._mono = np.zeros(0, dtype=np.float32)
+            else:
+                raw = np.frombuffer(self.sound.get_raw(), dtype=np.int16).reshape(-1, channels)
+                self._mono = (raw.mean(axis=1) / 32768.0).astype(np.float32)
+        return self._mono
+
+    def _finish(self, interrupted=False):
+        """
+        Mark playback as finished and run the registered callbacks.
+
+        Args:
+            interrupted (bool): Whether playback was stopped or replaced before it ended
+        """
+        with self._lock:
+            if self._done.is_set():
+                return
+            self.interrupted = interrupted
+            self.ended_at = time.monotonic()
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                print(f"Error in playback callback: {e}")
+
+
+class AudioEngine:
+    """
+    A single in-process audio output built on the pygame mixer.
+    Prompts, speech and music each play on their own reserved mixer channel,
+    so all audio shares one device and one completion thread.
+    """
+
+    def __init__(self, frequency=44100, buffer_size=512, channels=2):
+        """
+        Initialize the AudioEngine configuration. The mixer is opened by start().
+
+        Args:
+            frequency (int): Output sample rate in Hz
+            buffer_size (int): Mixer buffer size in samples (smaller means lower latency)
+            channels (int): Number of output channels
+        """
+        self.frequency = frequency
+        self.buffer_size = buffer_size
+        self.channels = channels
+        self._channels = {}
+        self._lock = threading.Lock()
+        # Per channel: the handle playing now, followed by the handle queued behind it
+        self._active = {}
+        self._active_changed = threading.Condition()
+        self._watcher = None
+        # Recently started handles, so reference() can reconstruct what just played
+        self._recent = deque(maxlen=16)
+
+    def start(self):
+        """
+        Open the mixer (if needed) and reserve channels for prompts, speech and music.
+        """
+        with self._lock:
+            if self._channels:
+                return
+            if not pygame.mixer.get_init():
+                pygame.mixer.pre_init(self.frequency, -16, self.channels, self.buffer_size)
+                pygame.mixer.init()
+
+            # Use the format the device actually gave us
+            self.frequency, _, self.channels = pygame.mixer.get_init()
+
+            # Reserve the first channels so Sound.play() never steals them
+            pygame.mixer.set_reserved(3)
+            self._channels = {
+                PROMPT_CHANNEL: pygame.mixer.Channel(0),
+                SPEECH_CHANNEL: pygame.mixer.Channel(1),
+                MUSIC_CHANNEL: pygame.mixer.Channel(2),
+            }
+            self._watcher = threading.Thread(target=self._watch_completions, daemon=True)
+            self._watcher.start()
+            print(f"Audio engine started: {self.frequency} Hz, {self.channels} channel(s), "
+                  f"{self.buffer_size} sample buffer")
+
+    def _to_mixer_format(self, samples, sample_rate):
+        """
+        Convert PCM samples to the mixer's sample rate and channel layout.
+
+        Args:
+            samples (np.ndarray): int16 PCM samples, either (frames,) or (frames, channels)
+            sample_rate (int): Sample rate of the samples in Hz
+
+        Returns:
+            np.ndarray: C-contiguous int16 samples shaped (frames, mixer channels)
+        """
+        samples = np.asarray(samples)
+        if samples.ndim == 1:
+            samples = samples[:, np.newaxis]
+
+        # Resample with linear interpolation when the rates differ
+        if sample_rate != self.frequency and samples.shape[0] > 1:
+            frames_out = int(round(samples.shape[0] * self.frequency / float(sample_rate)))
+            positions = np.linspace(0, samples.shape[0] - 1, frames_out)
+            source = np.arange(samples.shape[0])
+            samples = np.stack(
+                [np.interp(positions, source, samples[:, c]) for c in range(samples.shape[1])],
+                axis=1,
+            )
+
+        # Match the channel layout (duplicate mono, downmix anything else)
+        if samples.shape[1] != self.channels:
+            mono = samples.mean(axis=1, keepdims=True)
+            samples = np.repeat(mono, self.channels, axis=1)
+
+        return np.ascontiguousarray(samples, dtype=np.int16)
+
+    def make_sound(self, samples, sample_rate):
+        """
+        Build a mixer Sound from PCM samples.
+
+        Args:
+            samples (np.ndarray): int16 PCM samples
+            sample_rate (int): Sample rate of the samples in Hz
+
+        Returns:
+            pygame.mixer.Sound: A sound ready to play on any channel
+        """
+        self.start()
+        return pygame.mixer.Sound(buffer=self._to_mixer_format(samples, sample_rate).tobytes())
+
+    def play_pcm(self, samples, sample_rate, channel=PROMPT_CHANNEL, block=True):
+        """
+        Play PCM samples on one of the engine's channels.
+
+        Args:
+            samples (np.ndarray): int16 PCM samples
+            sample_rate (int): Sample rate of the samples in Hz
+            channel (str): PROMPT_CHANNEL or SPEECH_CHANNEL
+            block (bool): Whether to wait until playback finishes
+
+        Returns:
+            PlaybackHandle: Completion handle for the clip
+        """
+        return self.play_sound(self.make_sound(samples, sample_rate), channel=channel, block=block)
+
+    def play_sound(self, sound, channel=PROMPT_CHANNEL, block=True, queue=False):
+        """
+        Play a prepared Sound on one of the engine's channels.
+
+        Args:
+            sound (pygame.mixer.Sound): The sound to play
+            channel (str): PROMPT_CHANNEL, SPEECH_CHANNEL or MUSIC_CHANNEL
+            block (bool): Whether to wait until playback finishes
+            queue (bool): Queue the sound to start right after the current one
+                (gapless) instead of replacing it. Only one sound can be queued.
+
+        Returns:
+            PlaybackHandle: Completion handle for the sound
+
+        Raises:
+            RuntimeError: If queue is True and the channel already has a queued sound
+        """
+        self.start()
+        mixer_channel = self._channels[channel]
+        handle = PlaybackHandle(channel, duration=sound.get_length(), sound=sound)
+        replaced = []
+
+        with self._active_changed:
+            playing = self._active.get(channel, [])
+            if queue and playing and mixer_channel.get_busy():
+                if len(playing) > 1:
+                    raise RuntimeError(f"Channel '{channel}' already has a queued sound")
+                handle.started_at = playing[0].expected_end or time.monotonic()
+                mixer_channel.queue(sound)
+                playing.append(handle)
+            else:
+                replaced = playing
+                mixer_channel.play(sound)
+                self._active[channel] = [handle]
+            self._recent.append(handle)
+            self._active_changed.notify()
+
+        for previous in replaced:
+            previous._finish(interrupted=True)
+        if block:
+            handle.wait()
+        return handle
+
+    def reference(self, start, frames, sample_rate):
+        """
+        Reconstruct what the engine played during a window of time, mixed down to mono.
+        This is the reference signal an echo canceller subtracts from the microphone.
+
+        Args:
+            start (float): Monotonic time at which the window starts
+            frames (int): Length of the window in frames
+            sample_rate (int): Sample rate of the window in Hz
+
+        Returns:
+            np.ndarray: float32 mono samples in [-1, 1]; zeros where nothing played
+        """
+        output = np.zeros(frames, dtype=np.float32)
+        end = start + frames / float(sample_rate)
+        with self._active_changed:
+            handles = list(self._recent)
+
+        times = None
+        for handle in handles:
+            if handle.started_at >= end or (handle.ended_at is not None and handle.ended_at <= start):
+                continue
+            mono = handle.mono_samples(self.channels)
+            if len(mono) < 2:
+                continue
+            if times is None:
+                times = start + np.arange(frames) / float(sample_rate)
+            # Linear interpolation from the mixer rate to the requested rate
+            positions = (times - handle.started_at) * self.frequency
+            valid = (positions >= 0) & (positions < len(mono) - 1)
+            if handle.ended_at is not None:
+                valid &= times < handle.ended_at
+            index = positions[valid].astype(np.int64)
+            fraction = (positions[valid] - index).astype(np.float32)
+            output[valid] += mono[index] * (1 - fraction) + mono[index + 1] * fraction
+        return output
+
+    def load_sound(self, path):
+        """
+        Decode an audio file into a Sound in the mixer's format.
+
+        Args:
+            path (str): Path to the audio file
+
+        Returns:
+            pygame.mixer.Sound: The decoded sound
+        """
+        self.start()
+        return pygame.mixer.Sound(path)
+
+    def is_busy(self, channel):
+        """
+        Check whether a channel is currently playing.
+
+        Args:
+            channel (str): PROMPT_CHANNEL, SPEECH_CHANNEL or MUSIC_CHANNEL
+
+        Returns:
+            bool: True if the channel is playing, False otherwise
+        """
+        mixer_channel = self._channels.get(channel)
+        return mixer_channel is not None and mixer_channel.get_busy()
+
+    def current(self, channel):
+        """
+        Get the completion handle of the audio playing on a channel.
+
+        Args:
+            channel (str): PROMPT_CHANNEL, SPEECH_CHANNEL or MUSIC_CHANNEL
+
+        Returns:
+            PlaybackHandle: The active handle, or None if the channel is idle
+        """
+        with self._active_changed:
+            playing = self._active.get(channel)
+            return playing[0] if playing else None
+
+    def wait(self, channel, timeout=None):
+        """
+        Block until a channel stops playing.
+
+        Args:
+            channel (str): PROMPT_CHANNEL, SPEECH_CHANNEL or MUSIC_CHANNEL
+            timeout (float, optional): Maximum number of seconds to wait
+
+        Returns:
+            bool: True if the channel is idle, False if the timeout expired first
+        """
+        with self._active_changed:
+            playing = self._active.get(channel)
+            handle = playing[-1] if playing else None
+        return handle is None or handle.wait(timeout)
+
+    def _watch_completions(self):
+        """
+        Resolve playback handles when their sound stops playing.
+        A sound has finished when its channel goes quiet or when the sound queued
+        behind it has taken over the channel. The thread sleeps until the earliest
+        expected end time and only re-checks frequently for sounds that run late.
+        """
+        while True:
+            finished = []
+            with self._active_changed:
+                while not self._active:
+                    self._active_changed.wait()
+
+                now = time.monotonic()
+                timeout = _UNKNOWN_LENGTH_RECHECK_SECONDS
+                for channel, playing in list(self._active.items()):
+                    mixer_channel = self._channels[channel]
+                    if not mixer_channel.get_busy():
+                        finished.extend(self._active.pop(channel))
+                        continue
+                    if len(playing) > 1 and mixer_channel.get_sound() is playing[1].sound:
+                        finished.append(playing.pop(0))
+                        playing[0].started_at = now
+                    head = playing[0]
+                    if head.expected_end is not None:
+                        timeout = min(timeout, max(head.expected_end - now, _RECHECK_SECONDS))
+
+                if not finished:
+                    self._active_changed.wait(timeout)
+
+            for handle in finished:
+                handle._finish()
+
+    def skip(self, channel=MUSIC_CHANNEL):
+        """
+        Stop the sound playing on a channel and start the queued one immediately.
+
+        Args:
+            channel (str): PROMPT_CHANNEL, SPEECH_CHANNEL or MUSIC_CHANNEL
+        """
+        with self._active_changed:
+            playing = self._active.get(channel)
+            if not playing:
+                return
+            skipped = playing.pop(0)
+            mixer_channel = self._channels[channel]
+            if playing:
+                playing[0].started_at = time.monotonic()
+                mixer_channel.play(playing[0].sound)
+            else:
+                del self._active[channel]
+                mixer_channel.stop()
+            self._active_changed.notify()
+        skipped._finish(interrupted=True)
+
+    def stop(self, channel=None):
+        """
+        Stop playback (including queued sounds) on one channel, or on every channel when none is given.
+
+        Args:
+            channel (str, optional): PROMPT_CHANNEL, SPEECH_CHANNEL or MUSIC_CHANNEL
+        """
+        if not pygame.mixer.get_init():
+            return
+        handles = []
+        with self._active_changed:
+            for name, mixer_channel in self._channels.items():
+                if channel in (None, name):
+                    mixer_channel.stop()
+                    handles.extend(self._active.pop(name, []))
+        for handle in handles:
+            handle._finish(interrupted=True)
+
+
+# The process-wide engine shared by TTS, StaticMessages and SongPlayer
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_audio_engine():
+    """
+    Get the process-wide AudioEngine, starting the mixer on first use.
+
+    Returns:
+        AudioEngine: The shared audio engine
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AudioEngine()
+    _engine.start()
+    return _engine
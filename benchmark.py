@@ -0,0 +1,531 @@
+import os
+import sys
+import json
+import time
+import wave
+import argparse
+import tempfile
+import importlib.util
+from fake_services import FakeLLMServer, FakeElevenLabsServer, FaultProfile, FileMicrophone, ScriptExhausted
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Spans that mark the moment the user starts hearing the jukebox answer
+AUDIO_SPANS = ("play_static_message", "synthesize_speech")
+# Stages whose latency is reported per scenario
+STAGES = ("record_audio", "transcribe_audio_with_elevenlabs", "call_llm", "json_repair",
+          "synthesize_speech", "play_static_message", "submit_song_data")
+# Reported numbers compared against the baseline, and the smallest change that counts
+COMPARED = {
+    "response_p50_ms": 5.0,
+    "response_p95_ms": 5.0,
+    "run_p50_s": 0.05,
+    "llm_calls_per_run": 0.01,
+    "stt_calls_per_run": 0.01,
+    "tts_calls_per_run": 0.01,
+    "calls_per_turn": 0.01,
+    "bytes_per_run": 1.0,
+}
+# Seconds to wait for the song writer to replicate a scenario's documents to MongoDB
+WRITE_FLUSH_SECONDS = 10.0
+
+
+def configure_environment(workdir, llm, elevenlabs):
+    """
+    Point every client at the local stand-ins and keep all state in the work directory.
+    Must run before any jukebox module is imported, since they read their settings on import.
+
+    Args:
+        workdir (str): Scratch directory for the outbox, job store, catalog and traces
+        llm (FakeLLMServer): The fake OpenAI-compatible service
+        elevenlabs (FakeElevenLabsServer): The fake speech service
+    """
+    os.environ.update({
+        "OPENROUTER_API_KEY": "benchmark",
+        "OPENROUTER_BASE_URL": f"{llm.base_url}/v1",
+        "ELEVENLABS_API_KEY": "benchmark",
+        "ELEVENLABS_BASE_URL": elevenlabs.base_url,
+        "SONG_LIBRARY_DIR": os.path.join(workdir, "songs"),
+        "SONG_LIBRARY_REFRESH_SECONDS": "0",
+        "SONG_CATALOG_PATH": os.path.join(workdir, "song_catalog.sqlite3"),
+        "SONG_OUTBOX_PATH": os.path.join(workdir, "song_outbox.jsonl"),
+        "CUSTOM_SONG_JOBS_PATH": os.path.join(workdir, "custom_song_jobs.sqlite3"),
+        "CUSTOM_SONG_GENERATOR": "stub",
+        "CUSTOM_SONG_STUB_SECONDS": "0.5",
+        "JUKEBOX_TRACE_FILE": os.path.join(workdir, "traces.jsonl"),
+        "JUKEBOX_OFFER_GAP": "0",
+        # No sound card needed; playback still takes as long as the audio
+        "SDL_AUDIODRIVER": os.getenv("SDL_AUDIODRIVER", "dummy"),
+    })
+
+
+def write_song(path, seconds=2.0, sample_rate=44100):
+    """
+    Write a silent stereo WAV to stand in for a song in the library.
+    """
+    with wave.open(path, "wb") as song:
+        song.setnchannels(2)
+        song.setsampwidth(2)
+        song.setframerate(sample_rate)
+        song.writeframes(b"\x00\x00\x00\x00" * int(seconds * sample_rate))
+
+
+def load_jukebox():
+    """
+    Import main.jukebox.py, whose file name is not a valid module name.
+
+    Returns:
+        module: The jukebox module
+    """
+    spec = importlib.util.spec_from_file_location("main_jukebox", os.path.join(REPO_DIR, "main.jukebox.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(values, q):
+    """
+    Get a percentile of a list of numbers.
+
+    Args:
+        values (list): The numbers
+        q (float): The percentile, from 0 to 100
+
+    Returns:
+        float: The percentile, or None for an empty list, which has no percentiles
+    """
+    import numpy as np
+    return float(np.percentile(values, q)) if len(values) else None
+
+
+class TraceReader:
+    """
+    Reads the spans appended to the trace file since the last read.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize the TraceReader at the start of the file.
+
+        Args:
+            path (str): The trace file, as written by the tracing module
+        """
+        self.path = path
+        self.offset = 0
+
+    def read_new(self):
+        """
+        Read the spans written since the last call. Lines that are not valid JSON
+        (e.g. a span still being written) are skipped.
+
+        Returns:
+            list: (name, start, end) tuples, with times in seconds since the epoch
+        """
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding="utf-8") as f:
+            f.seek(self.offset)
+            lines = f.readlines()
+            self.offset = f.tell()
+        spans = []
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            spans.append((record["name"], int(record["startTimeUnixNano"]) / 1e9,
+                          int(record["endTimeUnixNano"]) / 1e9))
+        return spans
+
+
+def response_latencies(spans):
+    """
+    Time from the end of each recording until the jukebox's next audio starts.
+
+    Args:
+        spans (list): (name, start, end) tuples of one run
+
+    Returns:
+        list: Latencies in seconds
+    """
+    audio_starts = sorted(end if name == "synthesize_speech" else start
+                          for name, start, end in spans if name in AUDIO_SPANS)
+    latencies = []
+    for name, _, end in spans:
+        if name != "record_audio":
+            continue
+        following = [start for start in audio_starts if start >= end]
+        if following:
+            latencies.append(following[0] - end)
+    return latencies
+
+
+class Benchmark:
+    """
+    Runs scripted dialog scenarios against the real jukebox classes, with local
+    stand-ins for OpenRouter, ElevenLabs, MongoDB and the microphone.
+    """
+
+    def __init__(self, scenario_file, llm_profile, stt_profile, tts_profile, malformed_rate=0.0,
+                 mongo="mongomock", realtime=0.0, seed=1):
+        """
+        Initialize the Benchmark: start the fake services and build the jukebox.
+
+        Args:
+            scenario_file (str): JSON file with "library" (song titles) and "scenarios"
+            llm_profile (FaultProfile): Latency and failures of the fake LLM
+            stt_profile (FaultProfile): Latency and failures of the fake speech-to-text
+            tts_profile (FaultProfile): Latency and failures of the fake text-to-speech
+            malformed_rate (float): Fraction of LLM JSON replies that need the repair path
+            mongo (str): "mongomock" or the URI of a local mongod
+            realtime (float): Fraction of each recording's length the fake microphone waits
+            seed (int): Seed for the injected latency, failures and malformed replies
+        """
+        with open(scenario_file, encoding="utf-8") as f:
+            spec = json.load(f)
+        fixture_dir = os.path.dirname(os.path.abspath(scenario_file))
+        self.scenarios = spec["scenarios"]
+        for scenario in self.scenarios:
+            for utterance in scenario.get("utterances", []):
+                utterance["wav"] = os.path.join(fixture_dir, utterance.get("wav", "recorded_audio.wav"))
+
+        self.llm = FakeLLMServer(llm_profile, malformed_rate=malformed_rate, seed=seed).start()
+        self.elevenlabs = FakeElevenLabsServer(stt_profile, tts_profile).start()
+        self.microphone = FileMicrophone(self.elevenlabs, realtime=realtime)
+
+        # Recordings, custom song intake files and job output all land in the work directory
+        self.workdir = tempfile.mkdtemp(prefix="jukebox-benchmark-")
+        os.makedirs(os.path.join(self.workdir, "songs"))
+        os.makedirs(os.path.join(self.workdir, "empty"))
+        for title in spec.get("library", []):
+            write_song(os.path.join(self.workdir, "songs", f"{title}.wav"))
+        os.symlink(os.path.join(REPO_DIR, "static_audio"), os.path.join(self.workdir, "static_audio"))
+        configure_environment(self.workdir, self.llm, self.elevenlabs)
+        sys.path.insert(0, REPO_DIR)
+        os.chdir(self.workdir)
+
+        from STT import set_microphone
+        from mongodb_handler import MongoDBHandler, set_mongo_handler
+        set_microphone(self.microphone)
+        if mongo == "mongomock":
+            import mongomock
+            set_mongo_handler(MongoDBHandler(client=mongomock.MongoClient()))
+        else:
+            os.environ["MONGODB_URI"] = mongo
+
+        self.traces = TraceReader(os.environ["JUKEBOX_TRACE_FILE"])
+        start = time.perf_counter()
+        self.jukebox = load_jukebox().JukeboxJokeTeller(turn_gap=(0, 0), offer_gap=0)
+        self.startup_seconds = time.perf_counter() - start
+
+    def _drive(self, scenario):
+        """
+        Run one scenario once.
+
+        Returns:
+            str: The outcome, compared with the scenario's "expect" if it has one
+        """
+        driver = scenario["driver"]
+        jukebox = self.jukebox
+        if driver == "jukebox_turn":
+            return "handled" if jukebox.take_turn() else "joke"
+        if driver == "song_picker":
+            from songpicker import SongPicker
+            from song_library import SongLibrary
+            library = None
+            if scenario.get("library") == "empty":
+                # Nothing is playable, so every choice goes to the LLM
+                library = SongLibrary(os.path.join(self.workdir, "empty"))
+            picker = SongPicker(library, jukebox.llm_client, jukebox.static_msgs)
+            result, _ = picker.pick_song()
+            return "confirmed" if result is not None else "cancelled"
+        if driver == "custom_song_picker":
+            jukebox.custom_song_picker.intake_mode = scenario.get("intake_mode", "guided")
+            result, _ = jukebox.custom_song_picker.pick_song()
+            return "confirmed" if result is not None else "cancelled"
+        if driver == "confirmation":
+            return jukebox.confirmation.confirm_song_choice(scenario["song_choice"])
+        raise ValueError(f"Unknown driver '{driver}'")
+
+    def _settle(self):
+        """
+        Stop any song a scenario started, so the next run starts idle.
+        """
+        from status import State
+        if self.jukebox.status.is_song_active():
+            self.jukebox.song_player.stop()
+            self.jukebox.status.wait_until(State.IDLE, timeout=10)
+
+    def _song_writes(self):
+        """
+        Get the song writer's counters.
+
+        Returns:
+            dict: Documents submitted and written, and failed bulk writes so far
+        """
+        from mongo_writer import get_song_writer
+        metrics = get_song_writer().metrics()
+        return {key: metrics[key] for key in ("submitted", "written", "failed_attempts")}
+
+    def _check_song_writes(self, before, failures):
+        """
+        Wait for the song documents of a scenario to reach MongoDB, and record
+        failed bulk writes and documents left in the outbox as failures.
+
+        Args:
+            before (dict): _song_writes() from before the scenario
+            failures (list): The scenario's failure reasons, appended to
+
+        Returns:
+            tuple: (failed bulk writes, documents left in the outbox)
+        """
+        from mongo_writer import get_song_writer
+        writer = get_song_writer()
+        writer.flush(timeout=WRITE_FLUSH_SECONDS)
+        failed = self._song_writes()["failed_attempts"] - before["failed_attempts"]
+        left = writer.metrics()["queue_depth"]
+        if failed:
+            failures.append(f"{failed} song bulk writes to MongoDB failed")
+        if left:
+            failures.append(f"{left} song documents left in the outbox after {WRITE_FLUSH_SECONDS:.0f} s")
+        return failed, left
+
+    def run_scenario(self, scenario, repeat):
+        """
+        Run a scenario a number of times and summarize the runs.
+
+        Args:
+            scenario (dict): The scenario
+            repeat (int): Number of runs
+
+        Returns:
+            dict: Run time, response latency, calls, bytes and stage latency statistics
+        """
+        run_seconds, latencies, failures = [], [], []
+        stages = {stage: [] for stage in STAGES}
+        totals = {"llm": 0, "stt": 0, "tts": 0, "errors": 0, "bytes_up": 0, "bytes_down": 0,
+                  "repairs": 0, "turns": 0}
+        self.llm.set_rules(scenario.get("llm"))
+        writes_before = self._song_writes()
+
+        for _ in range(repeat):
+            self._settle()
+            self.microphone.script(scenario.get("utterances", []))
+            self.llm.reset_stats()
+            self.elevenlabs.reset_stats()
+            self.traces.read_new()
+
+            start = time.perf_counter()
+            try:
+                outcome = self._drive(scenario)
+                if scenario.get("expect") and outcome != scenario["expect"]:
+                    failures.append(f"expected {scenario['expect']}, got {outcome}")
+                elif self.microphone.remaining():
+                    failures.append(f"dialog ended with {self.microphone.remaining()} utterances left")
+            except ScriptExhausted as e:
+                failures.append(str(e))
+            except Exception as e:
+                failures.append(f"{type(e).__name__}: {e}")
+            run_seconds.append(time.perf_counter() - start)
+
+            spans = self.traces.read_new()
+            latencies.extend(response_latencies(spans))
+            for name, span_start, span_end in spans:
+                if name in stages:
+                    stages[name].append(span_end - span_start)
+            llm, speech = self.llm.snapshot(), self.elevenlabs.snapshot()
+            totals["llm"] += llm["requests"]
+            totals["stt"] += speech["by_route"].get("speech-to-text", 0)
+            totals["tts"] += speech["by_route"].get("text-to-speech", 0)
+            totals["errors"] += llm["errors"] + speech["errors"]
+            totals["bytes_up"] += llm["bytes_in"] + speech["bytes_in"]
+            totals["bytes_down"] += llm["bytes_out"] + speech["bytes_out"]
+            totals["repairs"] += sum(1 for name, _, _ in spans if name == "json_repair")
+            totals["turns"] += len(scenario.get("utterances", [])) - self.microphone.remaining()
+        self._settle()
+        failed_writes, outbox_left = self._check_song_writes(writes_before, failures)
+        writes = self._song_writes()
+
+        calls = totals["llm"] + totals["stt"] + totals["tts"]
+        return {
+            "runs": repeat,
+            "failures": len(failures),
+            "failure_reasons": sorted(set(failures)),
+            "run_p50_s": percentile(run_seconds, 50),
+            "run_p95_s": percentile(run_seconds, 95),
+            # None when no recording was followed by audio, e.g. a dialog that only listens
+            "response_p50_ms": percentile(latencies, 50) * 1000 if latencies else None,
+            "response_p95_ms": percentile(latencies, 95) * 1000 if latencies else None,
+            "response_p99_ms": percentile(latencies, 99) * 1000 if latencies else None,
+            "llm_calls_per_run": totals["llm"] / repeat,
+            "stt_calls_per_run": totals["stt"] / repeat,
+            "tts_calls_per_run": totals["tts"] / repeat,
+            "json_repairs_per_run": totals["repairs"] / repeat,
+            "injected_errors_per_run": totals["errors"] / repeat,
+            "calls_per_turn": calls / totals["turns"] if totals["turns"] else 0.0,
+            "bytes_up_per_run": totals["bytes_up"] / repeat,
+            "bytes_down_per_run": totals["bytes_down"] / repeat,
+            "bytes_per_run": (totals["bytes_up"] + totals["bytes_down"]) / repeat,
+            "songs_submitted_per_run": (writes["submitted"] - writes_before["submitted"]) / repeat,
+            "songs_written_per_run": (writes["written"] - writes_before["written"]) / repeat,
+            "failed_song_writes": failed_writes,
+            "outbox_left": outbox_left,
+            "stage_p50_ms": {stage: percentile(values, 50) * 1000 for stage, values in stages.items() if values},
+            "stage_p95_ms": {stage: percentile(values, 95) * 1000 for stage, values in stages.items() if values},
+        }
+
+    def run(self, repeat, only=None):
+        """
+        Run every scenario (or the named ones).
+
+        Returns:
+            dict: Scenario name -> summary
+        """
+        results = {}
+        for scenario in self.scenarios:
+            if only and scenario["name"] not in only:
+                continue
+            print(f"Running scenario '{scenario['name']}' x{repeat}...")
+            results[scenario["name"]] = self.run_scenario(scenario, repeat)
+        return results
+
+    def stop(self):
+        """
+        Stop the fake services.
+        """
+        self.llm.stop()
+        self.elevenlabs.stop()
+
+
+def compare(results, baseline, threshold):
+    """
+    Find the numbers that got worse than the baseline by more than the threshold.
+    Numbers without samples (None) in either run are not compared.
+
+    Args:
+        results (dict): Scenario name -> summary of this run
+        baseline (dict): Scenario name -> summary of the baseline run
+        threshold (float): Allowed relative increase, e.g. 0.1 for 10%
+
+    Returns:
+        list: (scenario, metric, baseline value, current value) for every regression
+    """
+    regressions = []
+    for name, current in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        for metric, floor in COMPARED.items():
+            old, new = before.get(metric, 0.0), current.get(metric, 0.0)
+            if old is None or new is None:
+                continue
+            if new - old > max(old * threshold, floor):
+                regressions.append((name, metric, old, new))
+        if current["failures"] > before.get("failures", 0):
+            regressions.append((name, "failures", before.get("failures", 0), current["failures"]))
+    return regressions
+
+
+def _cell(value, width, digits=0):
+    """
+    Format a number for the report table, with "-" for a number without samples.
+
+    Args:
+        value (float): The number, or None
+        width (int): Column width
+        digits (int): Digits after the decimal point
+
+    Returns:
+        str: The right-aligned cell
+    """
+    return f"{'-':>{width}}" if value is None else f"{value:>{width}.{digits}f}"
+
+
+def print_report(results, startup_seconds):
+    """
+    Print a table of the results, with the failure reasons and stage latencies of each scenario.
+
+    Args:
+        results (dict): Scenario name -> summary
+        startup_seconds (float): Time it took to build the jukebox
+    """
+    print(f"\nJukebox startup: {startup_seconds * 1000:.0f} ms")
+    print(f"{'scenario':<24} {'runs':>5} {'fail':>5} {'run p50 s':>10} {'resp p50':>9} {'resp p95':>9} "
+          f"{'resp p99':>9} {'llm/run':>8} {'stt/run':>8} {'tts/run':>8} {'calls/turn':>11} {'KiB/run':>9}")
+    for name, r in results.items():
+        print(f"{name:<24} {r['runs']:>5} {r['failures']:>5} {r['run_p50_s']:>10.2f} {_cell(r['response_p50_ms'], 9)} "
+              f"{_cell(r['response_p95_ms'], 9)} {_cell(r['response_p99_ms'], 9)} {r['llm_calls_per_run']:>8.1f} "
+              f"{r['stt_calls_per_run']:>8.1f} {r['tts_calls_per_run']:>8.1f} {r['calls_per_turn']:>11.2f} "
+              f"{r['bytes_per_run'] / 1024:>9.1f}")
+        for reason in r["failure_reasons"]:
+            print(f"    failure: {reason}")
+        stages = ", ".join(f"{stage} {ms:.0f}" for stage, ms in r["stage_p50_ms"].items())
+        print(f"    stage p50 ms: {stages}")
+        print(f"    songs/run: {r['songs_submitted_per_run']:.1f} submitted, {r['songs_written_per_run']:.1f} written; "
+              f"{r['failed_song_writes']} failed bulk writes, {r['outbox_left']} left in the outbox")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the jukebox dialogs offline against local fake services.")
+    parser.add_argument("--scenarios", default=os.path.join(REPO_DIR, "benchmark_scenarios.json"),
+                        help="Scenario file")
+    parser.add_argument("--only", nargs="*", help="Run only these scenarios")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per scenario")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Seconds added to every LLM call")
+    parser.add_argument("--stt-latency", type=float, default=0.2, help="Seconds added to every transcription")
+    parser.add_argument("--tts-latency", type=float, default=0.15, help="Seconds added to every synthesis")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many extra seconds per call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls that fail with HTTP 500")
+    parser.add_argument("--malformed-rate", type=float, default=0.0,
+                        help="Fraction of LLM JSON replies that need the repair path")
+    parser.add_argument("--realtime", type=float, default=0.0,
+                        help="Fraction of each recording's length the fake microphone waits")
+    parser.add_argument("--mongo", default="mongomock", help='"mongomock" or a local mongod URI')
+    parser.add_argument("--seed", type=int, default=1, help="Seed for injected latency, errors and malformed replies")
+    parser.add_argument("--baseline", default=os.path.join(REPO_DIR, "benchmark_baseline.json"),
+                        help="Baseline results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed relative regression")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    def profile(latency):
+        return FaultProfile(latency, args.jitter, args.error_rate, seed=args.seed)
+
+    benchmark = Benchmark(
+        args.scenarios, profile(args.llm_latency), profile(args.stt_latency), profile(args.tts_latency),
+        malformed_rate=args.malformed_rate, mongo=args.mongo, realtime=args.realtime, seed=args.seed,
+    )
+    try:
+        results = benchmark.run(args.repeat, args.only)
+    finally:
+        benchmark.stop()
+    print_report(results, benchmark.startup_seconds)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    # Lost or stuck song writes are a bug whatever the baseline says
+    lost = {name: r for name, r in results.items() if r["failed_song_writes"] or r["outbox_left"]}
+    if lost:
+        print(f"\nSong writes to MongoDB failed in: {', '.join(lost)}")
+        sys.exit(1)
+    if args.save_baseline:
+        failed = [name for name, r in results.items() if r["failures"]]
+        if failed:
+            print(f"\nNot saving a baseline with failed runs in: {', '.join(failed)}")
+            sys.exit(1)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"\nRegressions against {args.baseline} (threshold {args.threshold:.0%}):")
+            for name, metric, old, new in regressions:
+                print(f"  {name:<24} {metric:<22} {old:>10.2f} -> {new:>10.2f}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}.")
+    else:
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to create one.")
@@ -1,18 +1,20 @@
-import sys
 from LLM import LLMClient
-from STT import record_audio, transcribe_audio_with_elevenlabs
-from TTS import speak_text
 from static_messages import StaticMessages
 from json_parser import JSONResponseParser
+from dialog import DialogEngine, run_dialog
 
 class Confirmation:
-    def __init__(self):
+    def __init__(self, llm_client=None, static_msgs=None):
         """
         Initialize the Confirmation class with necessary components.
+        
+        Args:
+            llm_client (LLMClient, optional): Client to share instead of creating one
+            static_msgs (StaticMessages, optional): Static messages to share instead of creating them
         """
-        self.llm_client = LLMClient()
+        self.llm_client = llm_client or LLMClient()
         self.json_parser = JSONResponseParser(self.llm_client)
-        self.static_msgs = StaticMessages()
+        self.static_msgs = static_msgs or StaticMessages()
     
     def validate_confirmation(self, user_input):
         """
@@ -49,7 +51,7 @@ class Confirmation:
         
         try:
             print(f"Calling LLM for confirmation validation...")
-            response = self.llm_client.call_llm(prompt)
+            response = self.llm_client.call_llm(prompt, task="confirmation")
             print(f"LLM Response: {response}")
 
             # Try to parse the response
@@ -74,6 +76,7 @@ class Confirmation:
     def confirm_song_choice(self, song_choice):
         """
         Ask the user to confirm their song choice.
+        The dialog itself is the "confirm" dialog of DialogEngine.
         
         Args:
             song_choice (str or dict): The user's song choice (string for simple songs, dict for custom songs)
@@ -81,52 +84,6 @@ class Confirmation:
         Returns:
             str: Action to take ("confirmed", "change_song", "cancel")
         """
-        # Create the confirmation message based on song type
-        if isinstance(song_choice, dict):
-            # Custom song with multiple details
-            confirmation_message = f"Are you sure you want to proceed with {song_choice.get('song_name', 'your song')} in the {song_choice.get('genre', 'specified')} genre?"
-        else:
-            # Simple song choice
-            confirmation_message = f"Are you sure you want to proceed with {song_choice}?"
-        
-        print(f"Confirmation: {confirmation_message}")
-        
-        # Play static confirmation message
-        self.static_msgs.play_static_message("confirm_prompt")
-        
-        while True:
-            try:
-                # Record audio from microphone (5 seconds)
-                print("Listening for your confirmation...")
-                audio_filename = record_audio(record_seconds=5)
-                
-                # Transcribe using ElevenLabs
-                transcription = transcribe_audio_with_elevenlabs(audio_filename)
-                user_input = transcription.text.strip()
-                
-                if user_input:
-                    print(f"User said: {user_input}")
-                    
-                    # Validate user input
-                    validation = self.validate_confirmation(user_input)
-                    print(f"Validation result: {validation}")
-                    
-                    if validation["confidence"] in ["high", "medium"]:
-                        if validation["confirmed"]:
-                            return "confirmed"
-                        elif validation["change_song"]:
-                            return "change_song"
-                        elif validation["cancel"]:
-                            return "cancel"
-                    else:
-                        # Low confidence, ask user to repeat
-                        self.static_msgs.play_static_message("confirmation_low_confidence")
-                        self.static_msgs.play_static_message("try_again")
-                else:
-                    # No input, ask user to repeat
-                    self.static_msgs.play_static_message("confirmation_no_input")
-                    self.static_msgs.play_static_message("try_again")
-            except Exception as e:
-                print(f"Error in confirmation: {e}")
-                self.static_msgs.play_static_message("confirmation_error")
-                self.static_msgs.play_static_message("try_again")
+        engine = DialogEngine(confirmation=self)
+        state, actions = engine.start("confirm", song_choice)
+        return run_dialog(engine, state, actions, self.static_msgs)["action"]
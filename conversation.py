@@ -0,0 +1,102 @@
+from colorama import Fore, Style
+
+# Define color constants
+API_COLOR = Fore.YELLOW
+JOKE_COLOR = Fore.MAGENTA
+RESET_COLOR = Style.RESET_ALL
+
+class Conversation:
+    def __init__(self, llm_client, json_parser):
+        """
+        Initialize the Conversation with the LLM client and parser it shares with its owner.
+        The kiosk and every server session use these prompts, so they live outside the main loop.
+        
+        Args:
+            llm_client (LLMClient): Client used for the LLM calls
+            json_parser (JSONResponseParser): Parser used for the JSON responses
+        """
+        self.llm_client = llm_client
+        self.json_parser = json_parser
+    
+    def validate_user_request(self, user_input):
+        """
+        Use the LLM to validate if user input relates to the song offer.
+        
+        Args:
+            user_input (str): The user's spoken input
+            
+        Returns:
+            dict: JSON response with validation results
+        """
+        prompt = f"""
+        You are evaluating user input to determine if they want songs or custom songs based on our offer.
+        Our offer is: "I can play songs for you or make a song for your loved ones or yourself for just $1 USD each."
+        
+        User said: "{user_input}"
+        
+        Respond with a JSON object containing:
+        1. "relevant" (boolean): Whether the user's input relates to our song offer
+        2. "type" (string): Either "play" for playing existing songs, "custom" for custom songs, or "none" if not relevant
+        3. "confidence" (string): How confident you are in your assessment ("high", "medium", "low")
+        
+        Example format:
+        {{
+            "relevant": true/false,
+            "type": "play/custom/none",
+            "confidence": "high/medium/low"
+        }}
+        
+        ONLY Respond in JSON no Markdown.
+        """
+        CleanJsonPrompt = "Please return only a valid JSON object. Do not include markdown formatting, code blocks, comments, or any extra text. The JSON must contain the following keys: relevant (boolean), type (string), and confidence (string). Ensure all quotation marks are straight quotes, and escape any special characters properly. Do not wrap the response in triple backticks or label it as JSON. Just return the raw JSON object. If the input is malformed, fix it silently and return only the corrected JSON."
+        
+        try:
+            print(f"{API_COLOR}Calling LLM for user request validation...{RESET_COLOR}")
+            response = self.llm_client.call_llm(prompt, task="validation")
+            print(Fore.CYAN + "LLM Response:" + Style.RESET_ALL, response)
+
+            # Try to parse the response
+            result = self.json_parser.parse_json_response(response, CleanJsonPrompt)
+            
+            # Return parsed result or default response
+            return result if result else {
+                "relevant": False,
+                "type": "none",
+                "confidence": "low"
+            }
+        except Exception as e:
+            print(f"Error validating user request: {e}")
+            return {
+                "relevant": False,
+                "type": "none",
+                "confidence": "low"
+            }
+    
+    def tell_joke(self):
+        """
+        Use the LLM to generate an ENTP-style joke with dark humor and social critiques.
+        
+        Returns:
+            str: The generated joke
+        """
+        prompt = """
+        You are an ENTP personality with dark humor who loves to roast society, unfair jobs, and life situations.
+        Tell a short, witty joke that:
+        1. Critiques society, corporate culture, expensive rent, expensive mortgages, or unfair life situations
+        2. Has ENTP-style dark humor (clever, not mean-spirited)
+        3. Is concise and funny
+        4. Roasts the absurdity of modern life, work, or social expectations
+        
+       
+        Generate an original joke following this style do not add comments make it one sentence long no commenting before or after just a one liner joke.
+        """
+        
+        try:
+            print(f"{API_COLOR}Calling LLM for joke generation...{RESET_COLOR}")
+            joke = self.llm_client.call_llm(prompt, task="joke")
+            print(f"{JOKE_COLOR}Joke: {joke.strip()}{RESET_COLOR}")
+            return joke.strip()
+        except Exception as e:
+            error_message = "Uh oh, I couldn't come up with a joke right now. Even my creativity is on strike!"
+            print(f"Error generating joke: {e}")
+            return error_message
@@ -0,0 +1,497 @@
+import os
+import json
+import time
+import uuid
+import zlib
+import queue
+import sqlite3
+import importlib
+import threading
+from abc import ABC, abstractmethod
+from enum import Enum
+import numpy as np
+import soundfile as sf
+from startup import load_environment
+
+# Load environment variables
+load_environment()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    details TEXT NOT NULL,
+    state TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    audio_path TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+class JobState(str, Enum):
+    """
+    The states a custom song job moves through.
+    """
+    QUEUED = "queued"
+    GENERATING = "generating"
+    READY = "ready"
+    PLAYING = "playing"
+    PLAYED = "played"
+    FAILED = "failed"
+
+
+# Jobs in these states still need work after a restart
+UNFINISHED_STATES = (JobState.QUEUED, JobState.GENERATING, JobState.READY, JobState.PLAYING)
+
+
+class CustomSongJob:
+    """
+    One custom song request and the state of its generation.
+    """
+
+    def __init__(self, job_id, details, state=JobState.QUEUED, progress=0.0, audio_path=None,
+                 error=None, attempts=0, created_at=None, updated_at=None):
+        """
+        Initialize the CustomSongJob.
+
+        Args:
+            job_id (str): Unique identifier of the job
+            details (dict): The song details (song_name, genre, styles, lyrics_description)
+            state (JobState): Current state of the job
+            progress (float): Generation progress between 0.0 and 1.0
+            audio_path (str, optional): Path to the generated song, once ready
+            error (str, optional): Error message of the last failed attempt
+            attempts (int): Number of generation attempts so far
+            created_at (float, optional): Unix time the job was submitted
+            updated_at (float, optional): Unix time of the last change
+        """
+        self.job_id = job_id
+        self.details = details
+        self.state = JobState(state)
+        self.progress = progress
+        self.audio_path = audio_path
+        self.error = error
+        self.attempts = attempts
+        self.created_at = created_at or time.time()
+        self.updated_at = updated_at or self.created_at
+
+    @property
+    def song_name(self):
+        """
+        Get the name of the requested song.
+
+        Returns:
+            str: The song name, or "Unknown" if none was given
+        """
+        return self.details.get("song_name") or "Unknown"
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        Build a job from a row of the jobs table.
+
+        Args:
+            row (sqlite3.Row): The stored job
+
+        Returns:
+            CustomSongJob: The job
+        """
+        values = dict(row)
+        values["details"] = json.loads(values["details"])
+        return cls(**values)
+
+
+class CustomSongJobStore:
+    """
+    A persistent SQLite queue of custom song jobs, so queued and unfinished jobs survive a restart.
+    """
+
+    def __init__(self, db_path="custom_song_jobs.sqlite3"):
+        """
+        Initialize the CustomSongJobStore and open (or create) its database.
+
+        Args:
+            db_path (str): Path to the SQLite database file
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(SCHEMA)
+        self._conn.commit()
+
+    def add(self, job):
+        """
+        Store a new job.
+
+        Args:
+            job (CustomSongJob): The job to store
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, details, state, progress, audio_path, error, attempts, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.job_id, json.dumps(job.details), job.state.value, job.progress, job.audio_path,
+                 job.error, job.attempts, job.created_at, job.updated_at),
+            )
+            self._conn.commit()
+
+    def save(self, job):
+        """
+        Persist the current state of a job.
+
+        Args:
+            job (CustomSongJob): The job to update
+        """
+        job.updated_at = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, progress = ?, audio_path = ?, error = ?, attempts = ?, "
+                "updated_at = ? WHERE job_id = ?",
+                (job.state.value, job.progress, job.audio_path, job.error, job.attempts,
+                 job.updated_at, job.job_id),
+            )
+            self._conn.commit()
+
+    def get(self, job_id):
+        """
+        Get a stored job.
+
+        Args:
+            job_id (str): Identifier of the job
+
+        Returns:
+            CustomSongJob: The job, or None if it does not exist
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return CustomSongJob.from_row(row) if row else None
+
+    def unfinished(self):
+        """
+        List the jobs that still need generating or playing, oldest first.
+
+        Returns:
+            list: The unfinished CustomSongJob objects
+        """
+        placeholders = ", ".join("?" for _ in UNFINISHED_STATES)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM jobs WHERE state IN ({placeholders}) ORDER BY created_at",
+                [state.value for state in UNFINISHED_STATES],
+            ).fetchall()
+        return [CustomSongJob.from_row(row) for row in rows]
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        with self._lock:
+            self._conn.close()
+
+
+class SongGenerator(ABC):
+    """
+    Base class for custom song generator backends.
+    Subclasses turn song details into an audio file and report progress as they go.
+    """
+
+    @abstractmethod
+    def generate(self, job, output_path, progress):
+        """
+        Generate the song for a job.
+
+        Args:
+            job (CustomSongJob): The job to generate a song for
+            output_path (str): Path the song should be written to (without extension)
+            progress (callable): Called as progress(fraction) with a value between 0.0 and 1.0
+
+        Returns:
+            str: Path to the generated audio file
+        """
+
+
+class StubSongGenerator(SongGenerator):
+    """
+    A local generator that needs no external service: it waits a while to mimic
+    a real backend and writes a short synthesized melody.
+    """
+
+    def __init__(self, generation_seconds=5.0, song_seconds=20.0, sample_rate=44100):
+        """
+        Initialize the StubSongGenerator.
+
+        Args:
+            generation_seconds (float): How long a generation pretends to take
+            song_seconds (float): Length of the generated song
+            sample_rate (int): Sample rate of the generated song in Hz
+        """
+        self.generation_seconds = generation_seconds
+        self.song_seconds = song_seconds
+        self.sample_rate = sample_rate
+
+    def generate(self, job, output_path, progress):
+        """
+        Wait generation_seconds, reporting progress in ten steps, then write a melody
+        seeded by the song name.
+
+        Args:
+            job (CustomSongJob): The job to generate a song for
+            output_path (str): Path the song should be written to (without extension)
+            progress (callable): Called as progress(fraction) with a value between 0.0 and 1.0
+
+        Returns:
+            str: Path to the generated WAV file
+        """
+        steps = 10
+        for step in range(1, steps + 1):
+            time.sleep(self.generation_seconds / steps)
+            progress(step / steps * 0.9)
+
+        # A melody seeded by the song name, so the same request always sounds the same
+        rng = np.random.default_rng(zlib.crc32(job.song_name.encode("utf-8")))
+        notes = 220.0 * 2 ** (rng.choice([0, 2, 4, 5, 7, 9, 11, 12], size=int(self.song_seconds * 2)) / 12)
+        note_frames = self.sample_rate // 2
+        t = np.arange(note_frames) / self.sample_rate
+        envelope = np.minimum(1.0, 10 * t) * np.exp(-3 * t)
+        melody = np.concatenate([np.sin(2 * np.pi * f * t) * envelope for f in notes])
+        path = f"{output_path}.wav"
+        sf.write(path, (0.3 * melody).astype(np.float32), self.sample_rate)
+        progress(1.0)
+        return path
+
+
+def load_generator(spec=None):
+    """
+    Create the generator backend named by a spec.
+
+    Args:
+        spec (str, optional): "stub" or "package.module:ClassName".
+            Defaults to CUSTOM_SONG_GENERATOR (default: "stub").
+
+    Returns:
+        SongGenerator: The generator backend
+    """
+    spec = spec or os.getenv("CUSTOM_SONG_GENERATOR", "stub")
+    if spec == "stub":
+        return StubSongGenerator(
+            generation_seconds=float(os.getenv("CUSTOM_SONG_STUB_SECONDS", "5")),
+        )
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class CustomSongJobManager:
+    """
+    Runs custom song generation in the background so the kiosk stays responsive.
+    Jobs are stored in a persistent queue, generated by a pool of worker threads
+    and published through Status. Finished songs are queued on the SongPlayer by
+    play_ready(), which the main loop calls at a point where music may start.
+    """
+
+    def __init__(self, status, song_player, store=None, generator=None, workers=1,
+                 output_dir="custom_songs", max_attempts=3, deliver=None):
+        """
+        Initialize the CustomSongJobManager, recover unfinished jobs and start the workers.
+
+        Args:
+            status (Status): Status instance the job progress is published to
+            song_player (SongPlayer): Player the finished songs are queued on
+            store (CustomSongJobStore, optional): Persistent job queue.
+                Defaults to a store at CUSTOM_SONG_JOBS_PATH.
+            generator (SongGenerator, optional): Generator backend. Defaults to load_generator().
+            workers (int): Number of generation worker threads
+            output_dir (str): Directory the generated songs are written to
+            max_attempts (int): Generation attempts before a job is marked as failed
+            deliver (callable, optional): Called as deliver(job) to hand a finished song to
+                someone other than the local SongPlayer, e.g. a remote terminal
+        """
+        self.status = status
+        self.song_player = song_player
+        self.store = store or CustomSongJobStore(os.getenv("CUSTOM_SONG_JOBS_PATH", "custom_song_jobs.sqlite3"))
+        self.generator = generator or load_generator()
+        self.output_dir = output_dir
+        self.max_attempts = max_attempts
+        self.deliver = deliver
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        self._queue = queue.Queue()
+        self._ready = queue.Queue()
+        # Held while a job is queued as ready and published, and while play_ready() takes it,
+        # so a job is never played before READY is stored. Reentrant for READY subscribers.
+        self._ready_lock = threading.RLock()
+        self._recover()
+
+        self._workers = [threading.Thread(target=self._run, daemon=True) for _ in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def _recover(self):
+        """
+        Requeue the jobs that were unfinished when the process stopped.
+        """
+        for job in self.store.unfinished():
+            if job.state in (JobState.READY, JobState.PLAYING) and job.audio_path and os.path.exists(job.audio_path):
+                # Generated but never (fully) played: play it again
+                self._mark_ready(job)
+            else:
+                self._publish(job, JobState.QUEUED, progress=0.0)
+                self._queue.put(job)
+        if not self._queue.empty() or not self._ready.empty():
+            print(f"Recovered {self._queue.qsize()} queued and {self._ready.qsize()} ready custom songs")
+
+    def _publish(self, job, state=None, **changes):
+        """
+        Update a job, persist it and publish it through Status.
+
+        Args:
+            job (CustomSongJob): The job to update
+            state (JobState, optional): New state of the job
+            **changes: Job attributes to change, e.g. progress or error
+        """
+        if state is not None:
+            job.state = state
+        for name, value in changes.items():
+            setattr(job, name, value)
+        self.store.save(job)
+        self.status.update_job(job.job_id, job.state, song_name=job.song_name,
+                               progress=job.progress, error=job.error)
+
+    def submit(self, song_details):
+        """
+        Queue a custom song for background generation.
+
+        Args:
+            song_details (dict): Dictionary containing details about the custom song
+
+        Returns:
+            CustomSongJob: The queued job
+        """
+        # Finished jobs stay visible in Status until the next submission
+        for finished in self.status.jobs():
+            if finished["state"] in (JobState.PLAYED, JobState.FAILED):
+                self.status.forget_job(finished["job_id"])
+
+        job = CustomSongJob(uuid.uuid4().hex, dict(song_details))
+        self.store.add(job)
+        self._publish(job)
+        self._queue.put(job)
+        print(f"Queued custom song '{job.song_name}' for generation (job {job.job_id[:8]}, "
+              f"{self._queue.qsize()} waiting)")
+        return job
+
+    def jobs(self):
+        """
+        Get a snapshot of the jobs being generated, waiting or playing.
+
+        Returns:
+            list: One dictionary per job with job_id, state, song_name, progress and error
+        """
+        return self.status.jobs()
+
+    def _run(self):
+        """
+        Worker loop: generate queued songs one at a time.
+        """
+        while True:
+            job = self._queue.get()
+            self._generate(job)
+
+    def _generate(self, job):
+        """
+        Generate one job, retrying failed attempts up to max_attempts.
+
+        Args:
+            job (CustomSongJob): The job to generate
+        """
+        output_path = os.path.join(self.output_dir, job.job_id)
+        last_reported = [0.0]
+
+        def report(fraction):
+            # Persist progress in 10% steps so the store is not rewritten on every tick
+            if fraction - last_reported[0] >= 0.1 or fraction >= 1.0:
+                last_reported[0] = fraction
+                self._publish(job, progress=fraction)
+
+        while job.attempts < self.max_attempts:
+            self._publish(job, JobState.GENERATING, attempts=job.attempts + 1, progress=0.0)
+            start = time.perf_counter()
+            try:
+                audio_path = self.generator.generate(job, output_path, report)
+            except Exception as e:
+                print(f"Error generating custom song '{job.song_name}' (attempt {job.attempts}): {e}")
+                self._publish(job, error=str(e))
+                continue
+
+            print(f"Custom song '{job.song_name}' generated in {time.perf_counter() - start:.1f} s")
+            self._mark_ready(job, audio_path=audio_path, progress=1.0, error=None)
+            return
+
+        self._publish(job, JobState.FAILED)
+        print(f"Giving up on custom song '{job.song_name}' after {job.attempts} attempts")
+
+    def _mark_ready(self, job, **changes):
+        """
+        Queue a generated job for play_ready() and publish it as READY. The job is queued
+        first, so a READY subscriber that calls play_ready() right away finds it.
+
+        Args:
+            job (CustomSongJob): The generated job
+            **changes: Job attributes to change, e.g. audio_path
+        """
+        with self._ready_lock:
+            self._ready.put(job)
+            self._publish(job, JobState.READY, **changes)
+
+    def play_ready(self):
+        """
+        Queue every generated song on the SongPlayer, or hand it to the deliver callback.
+
+        Returns:
+            list: The jobs that were queued for playback or delivered
+        """
+        started = []
+        while True:
+            with self._ready_lock:
+                try:
+                    job = self._ready.get_nowait()
+                except queue.Empty:
+                    return started
+                if self.deliver is not None:
+                    self.deliver(job)
+                    self._publish(job, JobState.PLAYED)
+                    started.append(job)
+                    continue
+                request = self.song_player.enqueue(job.audio_path, f"custom song {job.song_name}", custom=True)
+                self._publish(job, JobState.PLAYING)
+            threading.Thread(target=self._await_playback, args=(job, request), daemon=True).start()
+            started.append(job)
+
+    def _await_playback(self, job, request):
+        """
+        Mark a job as played once its song is over.
+
+        Args:
+            job (CustomSongJob): The playing job
+            request (SongRequest): The song request queued for the job
+        """
+        request.wait()
+        self._publish(job, JobState.PLAYED)
+
+
+if __name__ == "__main__":
+    # Generate a song with the stub backend and play it
+    from status import Status
+    from song_player import SongPlayer
+
+    status = Status()
+    status.subscribe_jobs(lambda job, _: print(f"  {job['song_name']}: {job['state']} {job['progress']:.0%}"))
+    manager = CustomSongJobManager(status, SongPlayer(status), generator=StubSongGenerator(generation_seconds=2))
+    job = manager.submit({"song_name": "Ode to the Stub", "genre": "chiptune",
+                          "styles": "bleepy", "lyrics_description": "unit tests"})
+    status.wait_for_job(job.job_id, (JobState.READY, JobState.FAILED))
+    for started in manager.play_ready():
+        status.wait_for_job(started.job_id, JobState.PLAYED)
@@ -1,22 +1,51 @@
 import sys
 import os
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from LLM import LLMClient
 from STT import record_audio, transcribe_audio_with_elevenlabs
 from TTS import speak_text
-from mongodb_handler import MongoDBHandler
 from json_parser import JSONResponseParser
 from static_messages import StaticMessages
 from confirmation import Confirmation
+from dialog import DialogEngine, run_dialog
+from tracing import bind
+
+# The custom song questions, asked in order
+INTAKE_FIELDS = [
+    {"key": "song_name", "label": "Song name", "prompt": "song_name_prompt",
+     "question": "What's the name of your song?", "record_seconds": 5, "required": True},
+    {"key": "genre", "label": "Genre", "prompt": "genre_prompt",
+     "question": "What's the genre of your song?", "record_seconds": 5, "required": False},
+    {"key": "styles", "label": "Musical styles", "prompt": "styles_prompt",
+     "question": "Describe the musical styles of your song.", "record_seconds": 7, "required": False},
+    {"key": "lyrics_description", "label": "Lyrics description", "prompt": "lyrics_prompt",
+     "question": "Describe the lyrics of your song.", "record_seconds": 10, "required": False},
+]
+
+# Recorded as the describe_custom_song static message if its clip is missing
+DESCRIBE_SONG_TEXT = "What's the name of your song? What's the genre of your song? Describe the musical styles of your song. Describe the lyrics of your song."
 
 class CustomSongPicker:
-    def __init__(self):
+    def __init__(self, intake_mode=None, llm_client=None, static_msgs=None):
         """
         Initialize the CustomSongPicker with an LLM client.
+        
+        Args:
+            intake_mode (str, optional): "guided" to ask one question per detail, or
+                "single" to take one open-ended description and only ask for what is
+                missing. Defaults to CUSTOM_SONG_INTAKE_MODE (default: "guided").
+            llm_client (LLMClient, optional): Client to share instead of creating one
+            static_msgs (StaticMessages, optional): Static messages to share instead of creating them
         """
-        self.llm_client = LLMClient()
+        self.llm_client = llm_client or LLMClient()
         self.json_parser = JSONResponseParser(self.llm_client)
-        self.static_msgs = StaticMessages()
+        self.static_msgs = static_msgs or StaticMessages()
+        # Transcribes answers in the background while the next question is asked
+        self.transcriber = ThreadPoolExecutor(max_workers=2, thread_name_prefix="intake-stt")
+        self.intake_mode = intake_mode or os.getenv("CUSTOM_SONG_INTAKE_MODE", "guided")
+        self.utterance_seconds = float(os.getenv("CUSTOM_SONG_UTTERANCE_SECONDS", "15"))
     
     def evaluate_song(self, song_details):
         """
@@ -53,7 +82,7 @@ class CustomSongPicker:
         CleanJsonPrompt = "Please return only a valid JSON object. Do not include markdown formatting, code blocks, comments, or any extra text. The JSON must contain the following keys: acceptable (boolean) and roast (string). Ensure all quotation marks are straight quotes, and escape any special characters properly. Do not wrap the response in triple backticks or label it as JSON. Just return the raw JSON object.If the input is malformed, fix it silently and return only the corrected JSON."
         
         try:
-            response = self.llm_client.call_llm(prompt)
+            response = self.llm_client.call_llm(prompt, task="custom_song_evaluation")
             print("LLM Response:", response)
             
             # Use JSONResponseParser to parse the response
@@ -71,139 +100,210 @@ class CustomSongPicker:
                 "roast": f"Nice try, but I can't even process your song choice: {str(e)}"
             }
     
-    def collect_song_details(self):
+    def _transcribe(self, audio_filename):
         """
-        Collect detailed song information from the user.
+        Transcribe one recorded answer. Runs on the transcription worker.
         
+        Args:
+            audio_filename (str): Path to the recorded WAV file
+            
         Returns:
-            dict: Dictionary containing song_name, genre, styles, and lyrics_description
+            str: The transcribed text, or an empty string if transcription failed
         """
-        print("Please provide details about your song choice.")
-        self.static_msgs.play_static_message("custom_song_prompt")
-        
-        # Collect song name
-        print("\nWhat's the name of your song?")
-        self.static_msgs.play_static_message("song_name_prompt")
-        audio_filename = record_audio(record_seconds=5)
-        transcription = transcribe_audio_with_elevenlabs(audio_filename)
-        song_name = transcription.text.strip()
-        print(f"Song name: {song_name}")
+        try:
+            return transcribe_audio_with_elevenlabs(audio_filename).text.strip()
+        except Exception as e:
+            print(f"Error transcribing {audio_filename}: {e}")
+            return ""
+    
+    def _check_answer(self, field, answer):
+        """
+        Apply the quit and silence checks to a transcribed answer, playing the
+        matching message if the intake has to stop.
         
-        if song_name.lower() == 'quit':
+        Args:
+            field (dict): The INTAKE_FIELDS entry the answer belongs to
+            answer (str): The transcribed answer
+            
+        Returns:
+            bool: True if the intake can go on, False otherwise
+        """
+        print(f"{field['label']}: {answer}")
+        if answer.lower() == 'quit':
             self.static_msgs.play_static_message("giving_up")
             self.static_msgs.play_static_message("try_again")
-            return None
+            return False
         
-        if not song_name:
+        if field["required"] and not answer:
             self.static_msgs.play_static_message("silence_not_song")
             self.static_msgs.play_static_message("try_again")
-            return None
+            return False
+        return True
+    
+    def _ask_fields(self, fields):
+        """
+        Ask a list of intake questions and record the answers.
+        Each answer is handed to a background transcription worker while the next
+        prompt plays and the next answer is recorded; the results are joined at the end.
+        Quit and silence checks run as soon as each transcription lands.
         
-        # Collect genre
-        print("\nWhat's the genre of your song?")
-        self.static_msgs.play_static_message("genre_prompt")
-        audio_filename = record_audio(record_seconds=5)
-        transcription = transcribe_audio_with_elevenlabs(audio_filename)
-        genre = transcription.text.strip()
-        print(f"Genre: {genre}")
+        Args:
+            fields (list): The INTAKE_FIELDS entries to ask, in order
+            
+        Returns:
+            dict: The transcribed answer per field key, or None if the user quit or stayed silent
+        """
+        pending = []
+        checked = 0
+        for field in fields:
+            # Answers that landed while we were recording are checked before the next prompt
+            while checked < len(pending) and pending[checked].done():
+                if not self._check_answer(fields[checked], pending[checked].result()):
+                    return None
+                checked += 1
+            
+            print(f"\n{field['question']}")
+            self.static_msgs.play_static_message(field["prompt"])
+            # Each answer gets its own file so the next recording cannot overwrite it mid-upload
+            audio_filename = record_audio(filename=f"custom_{field['key']}.wav",
+                                          record_seconds=field["record_seconds"])
+            pending.append(self.transcriber.submit(bind(self._transcribe, audio_filename)))
         
-        if genre.lower() == 'quit':
-            self.static_msgs.play_static_message("giving_up")
-            self.static_msgs.play_static_message("try_again")
-            return None
+        # Join the remaining transcriptions in order
+        for field, future in zip(fields[checked:], pending[checked:]):
+            if not self._check_answer(field, future.result()):
+                return None
         
-        # Collect musical styles
-        print("\nDescribe the musical styles of your song.")
-        self.static_msgs.play_static_message("styles_prompt")
-        audio_filename = record_audio(record_seconds=7)
-        transcription = transcribe_audio_with_elevenlabs(audio_filename)
-        styles = transcription.text.strip()
-        print(f"Musical styles: {styles}")
+        return {field["key"]: future.result() for field, future in zip(fields, pending)}
+    
+    def collect_song_details(self):
+        """
+        Collect detailed song information from the user, one question per detail.
         
-        if styles.lower() == 'quit':
-            self.static_msgs.play_static_message("giving_up")
-            self.static_msgs.play_static_message("try_again")
-            return None
+        Returns:
+            dict: Dictionary containing song_name, genre, styles, and lyrics_description
+        """
+        print("Please provide details about your song choice.")
+        self.static_msgs.play_static_message("custom_song_prompt")
         
-        # Collect lyrics description
-        print("\nDescribe the lyrics of your song.")
-        self.static_msgs.play_static_message("lyrics_prompt")
-        audio_filename = record_audio(record_seconds=10)
-        transcription = transcribe_audio_with_elevenlabs(audio_filename)
-        lyrics_description = transcription.text.strip()
-        print(f"Lyrics description: {lyrics_description}")
+        start = time.perf_counter()
+        song_details = self._ask_fields(INTAKE_FIELDS)
+        if song_details is not None:
+            print(f"Collected song details in {time.perf_counter() - start:.1f} s")
+        return song_details
+    
+    def extract_song_details(self, utterance):
+        """
+        Use the LLM to fill the custom song details from one free-form description.
         
-        if lyrics_description.lower() == 'quit':
-            self.static_msgs.play_static_message("giving_up")
-            self.static_msgs.play_static_message("try_again")
+        Args:
+            utterance (str): Everything the user said about their song
+            
+        Returns:
+            dict: song_name, genre, styles and lyrics_description, with None for details
+                the user did not mention
+        """
+        prompt = f"""
+        A user described the custom song they want in one go. Extract the song details from what they said.
+
+        User said: "{utterance}"
+
+        Respond with a JSON object containing:
+        1. "song_name" (string or null): The name of the song
+        2. "genre" (string or null): The genre of the song
+        3. "styles" (string or null): The musical styles, instruments or mood of the song
+        4. "lyrics_description" (string or null): What the lyrics should be about
+
+        Use null for any detail the user did not mention. Do not invent details.
+
+        Example format:
+        {{
+            "song_name": "name here",
+            "genre": "genre here",
+            "styles": null,
+            "lyrics_description": "description here"
+        }}
+
+        ONLY Respond in JSON no Markdown.
+        """
+        CleanJsonPrompt = "Please return only a valid JSON object. Do not include markdown formatting, code blocks, comments, or any extra text. The JSON must contain the following keys: song_name, genre, styles and lyrics_description, each a string or null. Ensure all quotation marks are straight quotes, and escape any special characters properly. Do not wrap the response in triple backticks or label it as JSON. Just return the raw JSON object. If the input is malformed, fix it silently and return only the corrected JSON."
+        
+        empty = {field["key"]: None for field in INTAKE_FIELDS}
+        try:
+            response = self.llm_client.call_llm(prompt, task="song_details")
+            print("LLM Response:", response)
+            result = self.json_parser.parse_song_details_json(response, CleanJsonPrompt)
+            if not result:
+                return empty
+            return {key: (result[key] or "").strip() or None for key in empty}
+        except Exception as e:
+            print(f"Error extracting song details: {e}")
+            return empty
+    
+    def collect_song_details_single(self):
+        """
+        Collect detailed song information from one open-ended description.
+        The description is split into details by a single LLM call, and only the
+        details the user left out are asked for afterwards.
+        
+        Returns:
+            dict: Dictionary containing song_name, genre, styles, and lyrics_description
+        """
+        print("Describe your song: its name, genre, musical styles and what the lyrics are about.")
+        if self.static_msgs.play_static_message("describe_custom_song") is None:
+            # Record the missing clip once, so only the first use waits on TTS
+            text = self.static_msgs.get_message_text("describe_custom_song") or DESCRIBE_SONG_TEXT
+            if (self.static_msgs.create_static_message(text, "describe_custom_song") is None
+                    or self.static_msgs.play_static_message("describe_custom_song") is None):
+                speak_text(text)
+        
+        start = time.perf_counter()
+        audio_filename = record_audio(filename="custom_description.wav",
+                                      record_seconds=self.utterance_seconds)
+        utterance = self._transcribe(audio_filename)
+        if not self._check_answer({"label": "Song description", "required": True}, utterance):
             return None
         
-        return {
-            "song_name": song_name,
-            "genre": genre,
-            "styles": styles,
-            "lyrics_description": lyrics_description
-        }
+        song_details = self.extract_song_details(utterance)
+        missing = [field for field in INTAKE_FIELDS if not song_details[field["key"]]]
+        if missing:
+            print(f"Missing details: {', '.join(field['label'] for field in missing)}")
+            answers = self._ask_fields(missing)
+            if answers is None:
+                return None
+            song_details.update(answers)
+        
+        print(f"Collected song details in {time.perf_counter() - start:.1f} s")
+        return song_details
     
     def pick_song(self):
         """
         Main method to run the song picking loop with detailed user input.
+        The dialog itself is the "custom" dialog of DialogEngine; the details are
+        collected with the intake chosen by intake_mode.
         
         Returns:
-            dict: Final JSON response when an acceptable song is selected
+            tuple: (result, song_details) when an acceptable song is confirmed,
+                or (None, None) if the selection was cancelled
         """
-        self.static_msgs.play_static_message("roast_intro")
-        self.static_msgs.play_static_message("custom_song_prompt")
-        
-        while True:
-            song_details = self.collect_song_details()
-            
-            if song_details is None:
-                continue
-            
-            # Evaluate the song choice
-            result = self.evaluate_song(song_details)
-            
-            # Display the roast regardless of acceptability
-            print(f"\nRoast: {result['roast']}")
-            speak_text(result['roast'])
-            
-            # Check if the song is acceptable
-            if result['acceptable']:
-                print("\nFinally! You picked an acceptable song.")
-                self.static_msgs.play_static_message("acceptable_song")
-                
-                # Add confirmation step
-                confirmation = Confirmation()
-                confirmation_action = confirmation.confirm_song_choice(song_details)
-                
-                if confirmation_action == "confirmed":
-                    print("Song confirmed! Enjoy your music.")
-                    self.static_msgs.play_static_message("song_confirmed")
-                    # Save to MongoDB
-                    self.save_to_mongo(song_details, result)
-                    return result, song_details
-                elif confirmation_action == "change_song":
-                    print("Let's choose a different song.")
-                    self.static_msgs.play_static_message("try_again")
-                    continue
-                else:  # cancel
-                    print("Song selection cancelled.")
-                    return None, None
-            else:
-                print("Try again, oh master of terrible music choices.")
-                self.static_msgs.play_static_message("try_again")
+        engine = DialogEngine(custom_song_picker=self, confirmation=Confirmation(self.llm_client, self.static_msgs))
+        state, actions = engine.start("custom")
+        collect = self.collect_song_details_single if self.intake_mode == "single" else self.collect_song_details
+        outcome = run_dialog(engine, state, actions, self.static_msgs, collect_details=collect)
+        return outcome["result"], outcome["choice"]
 
     def save_to_mongo(self, song_details, result):
         """
-        Save custom song data to MongoDB after confirmation.
+        Queue custom song data for MongoDB after confirmation. The write happens in the
+        background, so a slow database never delays the conversation.
         
         Args:
             song_details (dict): Dictionary containing song_name, genre, styles, and lyrics_description
             result (dict): The evaluation result from the LLM
         """
+        # pymongo is slow to import, so the writer is only loaded once a song is confirmed
+        from mongo_writer import get_song_writer
         try:
-            mongo_handler = MongoDBHandler()
             song_data = {
                 "song_name": song_details['song_name'],
                 "genre": song_details['genre'],
@@ -212,12 +312,10 @@ class CustomSongPicker:
                 "acceptable": result['acceptable'],
                 "roast": result['roast']
             }
-            success = mongo_handler.insert_song_data(song_data)
-            if success:
-                print("\nSong data successfully saved to MongoDB!")
+            if get_song_writer().submit(song_data):
+                print("\nSong data queued for MongoDB.")
             else:
-                print("\nFailed to save song data to MongoDB.")
-            mongo_handler.close_connection()
+                print("\nFailed to queue song data for MongoDB.")
         except Exception as e:
             print(f"\nError saving to MongoDB: {e}")
 
@@ -235,7 +333,8 @@ if __name__ == "__main__":
     
     # Save to MongoDB
     try:
-        mongo_handler = MongoDBHandler()
+        from mongodb_handler import get_mongo_handler
+        mongo_handler = get_mongo_handler()
         song_data = {
             "song_name": song_details['song_name'],
             "genre": song_details['genre'],
@@ -249,6 +348,5 @@ if __name__ == "__main__":
             print("\nSong data successfully saved to MongoDB!")
         else:
             print("\nFailed to save song data to MongoDB.")
-        mongo_handler.close_connection()
     except Exception as e:
         print(f"\nError saving to MongoDB: {e}")
@@ -0,0 +1,549 @@
+import copy
+import time
+from STT import record_audio, transcribe_audio_with_elevenlabs
+from TTS import speak_text
+
+# The answer to a listen action whose recording or transcription failed, so the dialog
+# can report the error instead of treating it as silence
+LISTEN_FAILED = {"error": "listen_failed"}
+
+
+def _message(message_id):
+    """
+    Build an action that plays a static message.
+
+    Args:
+        message_id (str): Identifier of the static message
+
+    Returns:
+        dict: The message action
+    """
+    return {"type": "message", "id": message_id}
+
+
+def _say(text):
+    """
+    Build an action that speaks a text.
+
+    Args:
+        text (str): The text to speak
+
+    Returns:
+        dict: The say action
+    """
+    return {"type": "say", "text": text}
+
+
+def _listen(record_seconds=5, filename="recorded_audio.wav", partials=None):
+    """
+    Build an action that records and transcribes the user's next answer.
+
+    Args:
+        record_seconds (float): Length of the recording
+        filename (str): Path the recording is written to
+        partials (str, optional): "song" to hand partial transcripts to SongPicker.speculate
+
+    Returns:
+        dict: The listen action
+    """
+    action = {"type": "listen", "seconds": record_seconds, "filename": filename}
+    if partials:
+        action["partials"] = partials
+    return action
+
+
+class DialogEngine:
+    """
+    The song picking, custom song and confirmation dialogs as resumable state machines.
+
+    A dialog is a JSON-serializable state dict. start() creates one, and step() feeds it
+    the user's answer and returns the next state; both also return the actions to carry
+    out before the next answer is needed:
+        {"type": "message", "id"}         play a static message
+        {"type": "say", "text"}           speak a text
+        {"type": "listen", "seconds", "filename"[, "partials"]}
+                                          record and transcribe the next answer; "partials"
+                                          ("song") asks for partial transcripts to be handed
+                                          to SongPicker.speculate while the user talks
+        {"type": "collect_details"}       run the custom song intake; its details dict is the next answer
+    A listen or collect_details action is always last. A listen whose recording or
+    transcription failed is answered with LISTEN_FAILED rather than an empty transcript. Once state["done"] is set the
+    dialog is over and state["outcome"] holds its result.
+
+    Nothing lives outside the state, so each step can run on any worker that loads it
+    from a SessionStore.
+    """
+
+    def __init__(self, song_picker=None, custom_song_picker=None, confirmation=None):
+        """
+        Initialize the DialogEngine.
+
+        Args:
+            song_picker (SongPicker, optional): Needed for the "song" dialog
+            custom_song_picker (CustomSongPicker, optional): Needed for the "custom" dialog
+            confirmation (Confirmation): Validates the confirmation answers
+        """
+        self.song_picker = song_picker
+        self.custom_song_picker = custom_song_picker
+        self.confirmation = confirmation
+
+    def start(self, flow, song_choice=None, session_id=None):
+        """
+        Start a dialog.
+
+        Args:
+            flow (str): "song" (SongPicker.pick_song), "custom" (CustomSongPicker.pick_song)
+                or "confirm" (Confirmation.confirm_song_choice)
+            song_choice (str or dict, optional): The song to confirm, for the "confirm" dialog
+            session_id (str, optional): The session the dialog runs in, so speculative
+                evaluations of one session are never resolved by another
+
+        Returns:
+            tuple: (state, actions)
+        """
+        state = {"flow": flow, "step": None, "data": {}, "done": False, "outcome": None,
+                 "session_id": session_id}
+        if flow == "song":
+            actions = [_message("roast_intro")] + self._ask_song_choice(state)
+        elif flow == "custom":
+            actions = [_message("roast_intro"), _message("custom_song_prompt")] + self._ask_details(state)
+        elif flow == "confirm":
+            state["data"]["song_choice"] = song_choice
+            actions = self._ask_confirmation(state)
+        else:
+            raise ValueError(f"Unknown dialog '{flow}'")
+        return state, actions
+
+    def step(self, state, user_input):
+        """
+        Advance a dialog with the user's answer. The given state is left untouched.
+
+        Args:
+            state (dict): The dialog state
+            user_input (str or dict): The transcribed answer, or the song details (None if
+                the user quit or stayed silent) for a collect_details action
+
+        Returns:
+            tuple: (state, actions)
+        """
+        if state["done"]:
+            raise ValueError(f"The {state['flow']} dialog has already finished")
+        state = copy.deepcopy(state)
+        handler = getattr(self, f"_on_{state['flow']}_{state['step']}")
+        return state, handler(state, user_input)
+
+    def _finish(self, state, outcome, actions=()):
+        """
+        End a dialog.
+
+        Args:
+            state (dict): The dialog state
+            outcome (dict): The dialog's result
+            actions (iterable): Actions to carry out before the dialog returns
+
+        Returns:
+            list: The actions
+        """
+        state["done"] = True
+        state["outcome"] = outcome
+        return list(actions)
+
+    def _ask_confirmation(self, state):
+        """
+        Move to the confirmation step for the song in state["data"]["song_choice"].
+
+        Args:
+            state (dict): The dialog state
+
+        Returns:
+            list: The actions that ask for confirmation
+        """
+        state["step"] = "confirm"
+        song_choice = state["data"]["song_choice"]
+        if isinstance(song_choice, dict):
+            print(f"Confirmation: Are you sure you want to proceed with {song_choice.get('song_name', 'your song')} "
+                  f"in the {song_choice.get('genre', 'specified')} genre?")
+        else:
+            print(f"Confirmation: Are you sure you want to proceed with {song_choice}?")
+        return [_message("confirm_prompt"), _listen()]
+
+    def _read_confirmation(self, user_input):
+        """
+        Interpret a confirmation answer.
+
+        Args:
+            user_input (str or dict): The transcribed answer, or LISTEN_FAILED
+
+        Returns:
+            tuple: (action, actions) where action is "confirmed", "change_song", "cancel" or
+                None, and actions ask for the answer again when action is None
+        """
+        if user_input == LISTEN_FAILED:
+            return None, [_message("confirmation_error"), _message("try_again"), _listen()]
+        user_input = (user_input or "").strip()
+        if not user_input:
+            return None, [_message("confirmation_no_input"), _message("try_again"), _listen()]
+
+        print(f"User said: {user_input}")
+        validation = self.confirmation.validate_confirmation(user_input)
+        print(f"Validation result: {validation}")
+        if validation["confidence"] not in ["high", "medium"]:
+            return None, [_message("confirmation_low_confidence"), _message("try_again"), _listen()]
+        for action in ("confirmed", "change_song", "cancel"):
+            if validation[action]:
+                return action, []
+        return None, [_listen()]
+
+    def _on_confirm_confirm(self, state, user_input):
+        """
+        Handle the answer to a standalone confirmation.
+
+        Args:
+            state (dict): The dialog state
+            user_input (str or dict): The transcribed answer, or LISTEN_FAILED
+
+        Returns:
+            list: The next actions
+        """
+        action, actions = self._read_confirmation(user_input)
+        if action is None:
+            return actions
+        return self._finish(state, {"action": action})
+
+    def _ask_song_choice(self, state):
+        """
+        Move to the step that asks for a song choice.
+
+        Args:
+            state (dict): The dialog state
+
+        Returns:
+            list: The actions that ask for the song
+        """
+        state["step"] = "choice"
+        print("\nPlease say your song choice...")
+        return [_message("song_choice_prompt"), _listen(partials="song")]
+
+    def _on_song_choice(self, state, user_input):
+        """
+        Handle a song choice: play it from the library, suggest close titles or let the LLM judge it.
+
+        Args:
+            state (dict): The dialog state
+            user_input (str or dict): The transcribed song choice, or LISTEN_FAILED
+
+        Returns:
+            list: The next actions
+        """
+        picker = self.song_picker
+        if user_input == LISTEN_FAILED:
+            return [_message("confirmation_error")] + self._ask_song_choice(state)
+        song_choice = (user_input or "").strip()
+        print(f"You said: {song_choice}")
+
+        if song_choice.lower() == 'quit':
+            return self._finish(state, {"result": None, "choice": None},
+                                [_message("giving_up"), _message("try_again")])
+
+        if not song_choice:
+            return [_message("silence_not_song"), _message("try_again")] + self._ask_song_choice(state)
+
+        # Check the library before any LLM round-trip
+        verdict, title, suggestions = picker.check_library(song_choice)
+        if verdict == "known":
+            # We can play it, so skip the LLM and use a pooled roast
+            print(f"'{song_choice}' is in the library as '{title}'")
+            song_choice = title
+            result = {"acceptable": True, "roast": picker.roast_pool.take()}
+        elif verdict == "suggest" and state["data"].get("suggested_for") != song_choice.lower():
+            print(f"'{song_choice}' is not in the library. Did you mean: {suggestions}")
+            # Saying the same title again after the suggestions means the user wants that one
+            state["data"]["suggested_for"] = song_choice.lower()
+            return ([_say(f"I don't have that one. Did you mean {', or '.join(suggestions)}?")]
+                    + self._ask_song_choice(state))
+        else:
+            # Songs the library does not have are judged by the LLM; playback falls back to the demo song
+            result = picker.evaluate_song_choice(song_choice, state.get("session_id"))
+
+        print(f"\nRoast: {result['roast']}")
+        actions = [_say(result['roast'])]
+        if result['acceptable']:
+            print("\nFinally! You picked an acceptable song.")
+            state["data"] = {"song_choice": song_choice, "result": result}
+            return actions + [_message("acceptable_song")] + self._ask_confirmation(state)
+
+        print("Try again, oh master of terrible music choices.")
+        return actions + [_message("try_again")] + self._ask_song_choice(state)
+
+    def _on_song_confirm(self, state, user_input):
+        """
+        Handle the confirmation of a song choice, saving it once confirmed.
+
+        Args:
+            state (dict): The dialog state
+            user_input (str or dict): The transcribed answer, or LISTEN_FAILED
+
+        Returns:
+            list: The next actions
+        """
+        action, actions = self._read_confirmation(user_input)
+        data = state["data"]
+        if action == "confirmed":
+            print("Song confirmed!")
+            self.song_picker.save_to_mongo(data["song_choice"], data["result"])
+            return self._finish(state, {"result": data["result"], "choice": data["song_choice"]})
+        elif action == "change_song":
+            print("Let's pick a different song.")
+            return [_message("try_again")] + self._ask_song_choice(state)
+        elif action == "cancel":
+            print("Song selection cancelled.")
+            return self._finish(state, {"result": None, "choice": None}, [_message("try_again")])
+        return actions
+
+    def _ask_details(self, state):
+        """
+        Move to the step that collects the custom song details.
+
+        Args:
+            state (dict): The dialog state
+
+        Returns:
+            list: The collect_details action
+        """
+        state["step"] = "details"
+        return [{"type": "collect_details"}]
+
+    def _on_custom_details(self, state, song_details):
+        """
+        Handle the custom song details by letting the LLM judge them.
+
+        Args:
+            state (dict): The dialog state
+            song_details (dict): The details, or None if the user quit or stayed silent
+
+        Returns:
+            list: The next actions
+        """
+        if song_details is None:
+            return self._ask_details(state)
+
+        result = self.custom_song_picker.evaluate_song(song_details)
+        print(f"\nRoast: {result['roast']}")
+        actions = [_say(result['roast'])]
+        if result['acceptable']:
+            print("\nFinally! You picked an acceptable song.")
+            state["data"] = {"song_choice": song_details, "result": result}
+            return actions + [_message("acceptable_song")] + self._ask_confirmation(state)
+
+        print("Try again, oh master of terrible music choices.")
+        return actions + [_message("try_again")] + self._ask_details(state)
+
+    def _on_custom_confirm(self, state, user_input):
+        """
+        Handle the confirmation of a custom song, saving it once confirmed.
+
+        Args:
+            state (dict): The dialog state
+            user_input (str or dict): The transcribed answer, or LISTEN_FAILED
+
+        Returns:
+            list: The next actions
+        """
+        action, actions = self._read_confirmation(user_input)
+        data = state["data"]
+        if action == "confirmed":
+            print("Song confirmed! Enjoy your music.")
+            self.custom_song_picker.save_to_mongo(data["song_choice"], data["result"])
+            return self._finish(state, {"result": data["result"], "choice": data["song_choice"]},
+                                [_message("song_confirmed")])
+        elif action == "change_song":
+            print("Let's choose a different song.")
+            return [_message("try_again")] + self._ask_details(state)
+        elif action == "cancel":
+            print("Song selection cancelled.")
+            return self._finish(state, {"result": None, "choice": None})
+        return actions
+
+
+class TurnTimeoutError(Exception):
+    """
+    Raised when a turn finishes after its deadline. The turn's state is not saved,
+    since the caller has given up on it and may already be running the next turn.
+    """
+
+
+class SessionDialogs:
+    """
+    The turns of remote jukebox sessions. Each turn loads the session's state from a
+    SessionStore, advances it and saves it back, so consecutive turns of one session can
+    run on different workers. Besides the running dialog, a session's state holds its
+    joke count.
+
+    On top of the DialogEngine actions, turns can return:
+        {"type": "joke"}                      tell a joke
+        {"type": "play_song", "title"}        start a confirmed song
+        {"type": "custom_song", "details"}    start generating a confirmed custom song
+    """
+
+    def __init__(self, engine, conversation, store, offer_frequency=3):
+        """
+        Initialize the SessionDialogs.
+
+        Args:
+            engine (DialogEngine): Runs the song picking dialogs
+            conversation (Conversation): Classifies what the user asks for
+            store (SessionStore): Where session states are kept between turns
+            offer_frequency (int): Make an offer after this many jokes
+        """
+        self.engine = engine
+        self.conversation = conversation
+        self.store = store
+        self.offer_frequency = offer_frequency
+
+    def begin(self, session_id):
+        """
+        Create a session's state.
+
+        Args:
+            session_id (str): Identifier of the session
+
+        Returns:
+            list: The actions that open the session
+        """
+        self.store.put(session_id, {"joke_count": 0, "dialog": None})
+        return [_message("welcome"), _message("offer"), _listen()]
+
+    def turn(self, session_id, user_input, deadline=None):
+        """
+        Run one turn of a session.
+
+        Args:
+            session_id (str): Identifier of the session
+            user_input (str or dict): The answer to the previous listen or collect_details action
+            deadline (float, optional): time.monotonic() value after which the caller no longer
+                waits for the turn. A turn finishing later is dropped instead of saved.
+
+        Returns:
+            list: The actions to carry out, ending with the next listen or collect_details
+
+        Raises:
+            StaleSessionError: If another worker advanced the session in the meantime
+            TurnTimeoutError: If the turn finished after its deadline
+        """
+        session = self.store.get(session_id)
+        if session is None:
+            session = {"joke_count": 0, "dialog": None}
+        actions = self._turn(session_id, session, user_input)
+        if deadline is not None and time.monotonic() > deadline:
+            raise TurnTimeoutError(f"Turn of session {session_id} finished after its deadline; dropped")
+        self.store.put(session_id, session)
+        return actions
+
+    def end(self, session_id):
+        """
+        Forget a session's state.
+
+        Args:
+            session_id (str): Identifier of the session
+        """
+        self.store.delete(session_id)
+        if self.engine.song_picker is not None:
+            self.engine.song_picker.end_session(session_id)
+
+    def _turn(self, session_id, session, user_input):
+        """
+        Advance a session: step its dialog, or tell a joke, or start the dialog the user asks for.
+
+        Args:
+            session_id (str): Identifier of the session
+            session (dict): The session's state, changed in place
+            user_input (str or dict): The answer to the previous listen or collect_details action
+
+        Returns:
+            list: The actions to carry out
+        """
+        if session["dialog"] is not None:
+            dialog, actions = self.engine.step(session["dialog"], user_input)
+            if not dialog["done"]:
+                session["dialog"] = dialog
+                return actions
+            session["dialog"] = None
+            return actions + self._finish_dialog(dialog) + [_listen()]
+
+        # A failed recording outside a dialog is treated like silence
+        if not user_input or user_input == LISTEN_FAILED:
+            session["joke_count"] += 1
+            actions = [{"type": "joke"}]
+            if session["joke_count"] % self.offer_frequency == 0:
+                actions.append(_message("offer"))
+            return actions + [_listen()]
+
+        print(f"User said: {user_input}")
+        validation = self.conversation.validate_user_request(user_input)
+        print(f"Validation result: {validation}")
+        if validation["relevant"] and validation["confidence"] in ["high", "medium"]:
+            if validation["type"] == "play":
+                session["dialog"], actions = self.engine.start("song", session_id=session_id)
+                return [_message("pick_song")] + actions
+            elif validation["type"] == "custom":
+                session["dialog"], actions = self.engine.start("custom", session_id=session_id)
+                return [_message("create_custom_song")] + actions
+        return [_listen()]
+
+    def _finish_dialog(self, dialog):
+        """
+        Turn a finished dialog's outcome into the actions that announce and start the song.
+
+        Args:
+            dialog (dict): The finished dialog state
+
+        Returns:
+            list: The actions
+        """
+        choice = dialog["outcome"]["choice"]
+        if dialog["flow"] == "song":
+            if choice is None:
+                print("Song selection was cancelled.")
+                return [_message("song_selection_cancelled")]
+            print("Song selected and confirmed!")
+            return [_message("song_selected_confirmed"), {"type": "play_song", "title": choice}]
+        if choice is None:
+            print("Song selection was cancelled.")
+            return [_message("custom_song_selection_cancelled")]
+        print("Custom song selected and confirmed!")
+        return [_message("custom_song_selected_confirmed"), {"type": "custom_song", "details": choice}]
+
+
+def run_dialog(engine, state, actions, static_msgs, collect_details=None):
+    """
+    Run a dialog to the end on this thread, with the local microphone and speakers.
+
+    Args:
+        engine (DialogEngine): The engine that advances the dialog
+        state (dict): The dialog state, as returned by DialogEngine.start()
+        actions (list): The actions returned with the state
+        static_msgs (StaticMessages): Plays the static messages
+        collect_details (callable, optional): Runs the custom song intake for collect_details actions
+
+    Returns:
+        dict: The dialog's outcome
+    """
+    while True:
+        user_input = None
+        for action in actions:
+            if action["type"] == "message":
+                static_msgs.play_static_message(action["id"])
+            elif action["type"] == "say":
+                speak_text(action["text"])
+            elif action["type"] == "listen":
+                try:
+                    audio_filename = record_audio(filename=action["filename"], record_seconds=action["seconds"])
+                    user_input = transcribe_audio_with_elevenlabs(audio_filename).text.strip()
+                except Exception as e:
+                    print(f"Error in listening: {e}")
+                    user_input = LISTEN_FAILED
+            elif action["type"] == "collect_details":
+                user_input = collect_details()
+        if state["done"]:
+            return state["outcome"]
+        state, actions = engine.step(state, user_input)
@@ -0,0 +1,385 @@
+import io
+import os
+import time
+import wave
+import queue
+import threading
+from collections import deque
+import numpy as np
+from audio_engine import PROMPT_CHANNEL, SPEECH_CHANNEL
+
+
+def estimate_delay(mic, reference, max_lag):
+    """
+    Find how far the microphone trails a reference with a PHAT-weighted cross-correlation.
+
+    Args:
+        mic (np.ndarray): Microphone samples
+        reference (np.ndarray): Reference samples starting max_lag samples before the
+            microphone window would line up and running max_lag samples past it
+        max_lag (int): Largest shift to search, in samples, in either direction
+
+    Returns:
+        tuple: (lag, prominence) where lag is the extra delay in samples (positive if the
+            microphone trails more than assumed) and prominence is the correlation peak
+            relative to the mean correlation
+    """
+    n = len(mic) + len(reference)
+    cross = np.conj(np.fft.rfft(mic, n)) * np.fft.rfft(reference, n)
+    cross /= np.abs(cross) + 1e-12
+    correlation = np.abs(np.fft.irfft(cross, n)[:2 * max_lag + 1])
+    peak = int(np.argmax(correlation))
+    return max_lag - peak, correlation[peak] / (correlation.mean() + 1e-12)
+
+
+class EchoCanceller:
+    """
+    An adaptive echo canceller: a frequency-domain NLMS filter (overlap-save, one block
+    per partition) that learns the echo path from the reference to the microphone and
+    subtracts the predicted echo. The filter only adapts while the reference is playing
+    and the microphone is not louder than the reference (Geigel double-talk detection),
+    so the user's voice does not train it away.
+    """
+
+    def __init__(self, block_size=256, step=0.5, smoothing=0.9, double_talk_ratio=0.5):
+        """
+        Initialize the EchoCanceller.
+
+        Args:
+            block_size (int): Samples per block; also the length of the echo path the filter covers
+            step (float): NLMS step size (0 < step <= 1)
+            smoothing (float): Smoothing of the per-bin reference power used for normalization
+            double_talk_ratio (float): Freeze adaptation when the microphone peak exceeds this
+                fraction of the recent reference peak
+        """
+        self.block_size = block_size
+        self.step = step
+        self.smoothing = smoothing
+        self.double_talk_ratio = double_talk_ratio
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the learned echo path, e.g. after the delay estimate moved.
+        """
+        bins = self.block_size + 1
+        self._weights = np.zeros(bins, dtype=np.complex128)
+        self._power = np.full(bins, 1e-6)
+        self._previous = np.zeros(self.block_size, dtype=np.float32)
+        self._reference_peaks = deque(maxlen=32)
+
+    def process(self, mic, reference):
+        """
+        Cancel the echo in one block.
+
+        Args:
+            mic (np.ndarray): block_size float samples from the microphone
+            reference (np.ndarray): block_size float samples that were playing at the same time
+
+        Returns:
+            tuple: (cleaned, echo) float32 blocks: the microphone minus the predicted echo,
+                and the predicted echo
+        """
+        n = self.block_size
+        spectrum = np.fft.rfft(np.concatenate([self._previous, reference]))
+        self._previous = reference
+        echo = np.fft.irfft(spectrum * self._weights)[n:]
+        cleaned = mic - echo
+
+        self._reference_peaks.append(float(np.abs(reference).max()))
+        reference_peak = max(self._reference_peaks)
+        if reference_peak > 1e-4 and np.abs(mic).max() < reference_peak * self.double_talk_ratio:
+            self._power = self.smoothing * self._power + (1 - self.smoothing) * np.abs(spectrum) ** 2
+            error = np.fft.rfft(np.concatenate([np.zeros(n), cleaned]))
+            gradient = np.fft.irfft(self.step * np.conj(spectrum) * error / (self._power + 1e-10))
+            # Constrain the update to a causal filter of block_size taps
+            gradient[n:] = 0
+            self._weights += np.fft.rfft(gradient)
+        return cleaned.astype(np.float32), echo.astype(np.float32)
+
+
+class DuplexListener:
+    """
+    Full-duplex microphone capture for the kiosk. The microphone stays open while
+    prompts and speech play; our own output is removed with an EchoCanceller fed from
+    AudioEngine.reference(), and whatever remains is checked for speech against both the
+    noise floor and the expected residual echo.
+
+    Speech while a prompt or speech is playing is a barge-in: the prompt and speech
+    channels are stopped, barge_in is set and the utterance is captured, so the next
+    utterance() call returns it at once. Utterances end after a stretch of silence
+    instead of after a fixed recording length.
+    """
+
+    def __init__(self, audio_engine, sample_rate=16000, block_size=256, echo_delay=None,
+                 speech_ratio=3.0, min_speech_seconds=0.2, end_silence_seconds=0.8,
+                 partial_silence_seconds=0.3, preroll_seconds=0.4, max_utterance_seconds=None):
+        """
+        Initialize the DuplexListener. Capture starts with start().
+
+        Args:
+            audio_engine (AudioEngine): The engine whose output is cancelled
+            sample_rate (int): Microphone sample rate in Hz
+            block_size (int): Samples per processing block
+            echo_delay (float, optional): Initial delay from a sample being played to it reaching
+                the microphone, in seconds. Defaults to the mixer buffer plus JUKEBOX_ECHO_DELAY_MS
+                (default: 40). It is refined from the audio while prompts play.
+            speech_ratio (float): How far above the noise floor and the expected echo counts as speech
+            min_speech_seconds (float): Speech needed to start an utterance (and to barge in)
+            end_silence_seconds (float): Silence that ends an utterance
+            partial_silence_seconds (float): Shorter pause at which the utterance so far is
+                handed out as a partial, for callers that want to start work early
+            preroll_seconds (float): Audio kept from before speech was detected
+            max_utterance_seconds (float, optional): Longest utterance.
+                Defaults to JUKEBOX_MAX_UTTERANCE_SECONDS (default: 15).
+        """
+        self.audio_engine = audio_engine
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        block_seconds = block_size / float(sample_rate)
+        if echo_delay is None:
+            echo_delay = (audio_engine.buffer_size / float(audio_engine.frequency)
+                          + float(os.getenv("JUKEBOX_ECHO_DELAY_MS", "40")) / 1000)
+        self.echo_delay = echo_delay
+        self.speech_ratio = speech_ratio
+        self.min_speech_blocks = max(1, int(round(min_speech_seconds / block_seconds)))
+        self.end_silence_blocks = max(1, int(round(end_silence_seconds / block_seconds)))
+        self.partial_silence_blocks = max(1, int(round(partial_silence_seconds / block_seconds)))
+        self.max_utterance_seconds = max_utterance_seconds or float(os.getenv("JUKEBOX_MAX_UTTERANCE_SECONDS", "15"))
+        self.max_utterance_blocks = int(self.max_utterance_seconds / block_seconds)
+        self.canceller = EchoCanceller(block_size)
+
+        # Levels the speech detector compares against, adapted while nobody speaks
+        self.noise_floor = 1e-3
+        self.coupling = 1.0  # residual echo level per unit of reference level
+
+        self.barge_in = threading.Event()
+        self.barge_ins = 0
+        self._changed = threading.Condition()
+        self._listening = False
+        self._on_partial = None
+        self._preroll = deque(maxlen=max(1, int(round(preroll_seconds / block_seconds))))
+        self._speech_run = 0
+        self._silence_run = 0
+        self._capture = None  # cleaned blocks of the utterance being captured
+        self._captured = deque(maxlen=1)  # (finished_at, samples) of the latest finished utterance
+        self.stale_seconds = 10.0
+
+        # Recent microphone blocks for re-estimating the echo delay
+        self._history = deque(maxlen=int(1.0 / block_seconds))
+        self._next_delay_check = 0.0
+
+        self._blocks = queue.Queue()
+        self._pyaudio = None
+        self._stream = None
+        self._input_latency = 0.0
+        self._processor = None
+
+    def start(self):
+        """
+        Open the microphone and start processing.
+        """
+        if self._stream is not None:
+            return
+        # Only needed with a local microphone, so the server never imports it
+        import pyaudio
+        self._pyaudio = pyaudio.PyAudio()
+        self._continue = pyaudio.paContinue
+        self._stream = self._pyaudio.open(format=pyaudio.paInt16, channels=1, rate=self.sample_rate,
+                                          input=True, frames_per_buffer=self.block_size,
+                                          stream_callback=self._on_audio)
+        self._input_latency = self._stream.get_input_latency()
+        if self._processor is None:
+            self._processor = threading.Thread(target=self._process_loop, daemon=True)
+            self._processor.start()
+        print(f"Barge-in listening at {self.sample_rate} Hz, echo delay {self.echo_delay * 1000:.0f} ms")
+
+    def pause(self):
+        """
+        Close the microphone, e.g. while something else records from it. resume() reopens it.
+        """
+        if self._stream is None:
+            return
+        self._stream.stop_stream()
+        self._stream.close()
+        self._pyaudio.terminate()
+        self._stream = None
+        with self._changed:
+            self._capture = None
+            self._speech_run = 0
+            self._preroll.clear()
+            self._history.clear()
+
+    def resume(self):
+        """
+        Reopen the microphone after pause().
+        """
+        self.start()
+
+    def close(self):
+        """
+        Close the microphone and stop processing.
+        """
+        self.pause()
+        self._blocks.put(None)
+
+    def _on_audio(self, in_data, frame_count, time_info, status):
+        # Runs on the PortAudio thread: only timestamp the block and hand it over
+        captured_at = time.monotonic() - frame_count / float(self.sample_rate) - self._input_latency
+        self._blocks.put((captured_at, in_data))
+        return None, self._continue
+
+    def _process_loop(self):
+        while True:
+            block = self._blocks.get()
+            if block is None:
+                return
+            captured_at, data = block
+            mic = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
+            if len(mic) == self.block_size:
+                self._process(captured_at, mic)
+
+    def _process(self, captured_at, mic):
+        """
+        Cancel the echo in one microphone block and update the speech detector.
+
+        Args:
+            captured_at (float): Monotonic time of the block's first sample
+            mic (np.ndarray): The block as float samples
+        """
+        reference = self.audio_engine.reference(captured_at - self.echo_delay, len(mic), self.sample_rate)
+        cleaned, _ = self.canceller.process(mic, reference)
+        level = float(np.sqrt(np.mean(cleaned ** 2)))
+        reference_level = float(np.sqrt(np.mean(reference ** 2)))
+        playing = reference_level > 1e-4
+
+        threshold = self.speech_ratio * max(self.noise_floor, self.coupling * reference_level)
+        speech = level > threshold
+        if not speech and self._capture is None:
+            if playing:
+                self.coupling = 0.95 * self.coupling + 0.05 * (level / reference_level)
+            else:
+                self.noise_floor = max(1e-4, 0.98 * self.noise_floor + 0.02 * level)
+
+        if playing:
+            self._history.append((captured_at, mic))
+            if captured_at >= self._next_delay_check and len(self._history) == self._history.maxlen:
+                self._next_delay_check = captured_at + 2.0
+                self._update_delay()
+
+        self._detect(speech, cleaned)
+
+    def _update_delay(self):
+        """
+        Re-estimate the echo delay from the last second of microphone audio.
+        """
+        start = self._history[0][0]
+        mic = np.concatenate([block for _, block in self._history])
+        max_lag = int(0.1 * self.sample_rate)
+        reference = self.audio_engine.reference(start - self.echo_delay - max_lag / float(self.sample_rate),
+                                                len(mic) + 2 * max_lag, self.sample_rate)
+        if not reference.any():
+            return
+        lag, prominence = estimate_delay(mic, reference, max_lag)
+        if prominence < 8 or lag == 0:
+            return
+        self.echo_delay += lag / float(self.sample_rate)
+        if abs(lag) > self.block_size // 4:
+            # The learned echo path no longer lines up with the reference
+            self.canceller.reset()
+        print(f"Echo delay adjusted to {self.echo_delay * 1000:.0f} ms")
+
+    def _detect(self, speech, cleaned):
+        """
+        Start, extend or finish the utterance being captured.
+
+        Args:
+            speech (bool): Whether the block contains speech
+            cleaned (np.ndarray): The echo-cancelled block
+        """
+        barge_in = False
+        partial = None
+        with self._changed:
+            if self._capture is None:
+                self._preroll.append(cleaned)
+                self._speech_run = self._speech_run + 1 if speech else 0
+                if self._speech_run < self.min_speech_blocks:
+                    return
+                talking_over = (self.audio_engine.is_busy(PROMPT_CHANNEL)
+                                or self.audio_engine.is_busy(SPEECH_CHANNEL))
+                if not (self._listening or talking_over):
+                    return
+                self._capture = list(self._preroll)
+                self._silence_run = 0
+                if talking_over:
+                    barge_in = True
+                    self.barge_in.set()
+                    self.barge_ins += 1
+            else:
+                self._capture.append(cleaned)
+                self._silence_run = 0 if speech else self._silence_run + 1
+                if self._silence_run >= self.end_silence_blocks or len(self._capture) >= self.max_utterance_blocks:
+                    self._captured.append((time.monotonic(), np.concatenate(self._capture)))
+                    self._capture = None
+                    self._speech_run = 0
+                elif self._silence_run == self.partial_silence_blocks and self._on_partial is not None:
+                    partial = (self._on_partial, np.concatenate(self._capture))
+            self._changed.notify_all()
+
+        if partial is not None:
+            on_partial, samples = partial
+            on_partial(self._to_wav(samples))
+        if barge_in:
+            print("Barge-in: stopping playback")
+            self.audio_engine.stop(PROMPT_CHANNEL)
+            self.audio_engine.stop(SPEECH_CHANNEL)
+
+    def utterance(self, wait_seconds=5, on_partial=None):
+        """
+        Wait for the next utterance. An utterance captured by a barge-in is returned at once.
+
+        Args:
+            wait_seconds (float): How long to wait for speech to start
+            on_partial (callable, optional): Called with the utterance so far (WAV bytes) each
+                time the user pauses briefly. Runs on the processing thread, so it must not block.
+
+        Returns:
+            bytes: The utterance as a WAV file, or None if nobody spoke
+        """
+        with self._changed:
+            self._listening = True
+            self._on_partial = on_partial
+            # An utterance nobody asked for within a few seconds belongs to an earlier moment
+            if self._captured and time.monotonic() - self._captured[0][0] > self.stale_seconds:
+                self._captured.clear()
+            try:
+                if not self._changed.wait_for(lambda: self._captured or self._capture is not None, wait_seconds):
+                    return None
+                if not self._changed.wait_for(lambda: self._captured, self.max_utterance_seconds + 1):
+                    # Processing fell behind; take what has been captured so far
+                    self._captured.append((time.monotonic(), np.concatenate(self._capture)))
+                    self._capture = None
+                _, samples = self._captured.popleft()
+            finally:
+                self._listening = False
+                self._on_partial = None
+                self.barge_in.clear()
+        return self._to_wav(samples)
+
+    def _to_wav(self, samples):
+        """
+        Encode float samples as a 16-bit mono WAV file.
+
+        Args:
+            samples (np.ndarray): float samples in [-1, 1]
+
+        Returns:
+            bytes: The WAV file
+        """
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(self.sample_rate)
+            wf.writeframes((np.clip(samples, -1, 1) * 32767).astype(np.int16).tobytes())
+        return buffer.getvalue()
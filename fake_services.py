@@ -0,0 +1,411 @@
+import io
+import re
+import json
+import time
+import wave
+import random
+import hashlib
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Replies for prompts no scenario rule matches, keyed by a marker only that prompt contains
+DEFAULT_LLM_REPLIES = [
+    ('"roasts"', {"roasts": [f"Benchmark roast number {i}." for i in range(8)]}),
+    ('"confirmed"', {"confirmed": True, "change_song": False, "cancel": False, "confidence": "high"}),
+    ('"acceptable"', {"acceptable": True, "roast": "Bold choice for a benchmark."}),
+    ('"lyrics_description"', {"song_name": "Benchmark Anthem", "genre": "pop", "styles": None,
+                              "lyrics_description": None}),
+    ('"relevant"', {"relevant": False, "type": "none", "confidence": "low"}),
+]
+DEFAULT_JOKE = "My rent went up again, so now my landlord and my therapist have the same hourly rate."
+
+# The start of every JSONResponseParser repair prompt
+REPAIR_MARKER = "Please return only a valid JSON object"
+
+
+class FaultProfile:
+    """
+    Latency and failures injected into every request to a fake service.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        """
+        Initialize the FaultProfile.
+
+        Args:
+            latency (float): Seconds added to every request
+            jitter (float): Up to this many extra seconds, drawn uniformly per request
+            error_rate (float): Fraction of requests answered with HTTP 500
+            seed (int, optional): Seed for the random draws, for repeatable runs
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def apply(self):
+        """
+        Sleep for the injected latency.
+
+        Returns:
+            bool: True if the request should fail
+        """
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            fail = self._random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        return fail
+
+
+class FakeService:
+    """
+    A local HTTP server standing in for an external API. It counts requests, failures
+    and payload bytes in each direction, so a benchmark can report calls and bytes per turn.
+    """
+
+    name = "service"
+
+    def __init__(self, profile=None, host="127.0.0.1", port=0):
+        """
+        Initialize the FakeService. Call start() to begin serving.
+
+        Args:
+            profile (FaultProfile, optional): Latency and failures to inject. Defaults to none.
+            host (str): Address to bind
+            port (int): Port to bind; 0 picks a free port
+        """
+        self.profile = profile or FaultProfile()
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real APIs
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length) if length else b""
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_GET(self):
+                service._serve(self, "GET", b"")
+
+            def do_POST(self):
+                service._serve(self, "POST", self._body())
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name=f"fake-{self.name}", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_stats(self):
+        """
+        Zero the counters, e.g. between benchmark scenarios.
+        """
+        with self._lock:
+            self.stats = {"requests": 0, "errors": 0, "bytes_in": 0, "bytes_out": 0, "by_route": {}}
+
+    def snapshot(self):
+        """
+        Get a copy of the counters.
+
+        Returns:
+            dict: Requests, injected errors, payload bytes received and sent, and requests per route
+        """
+        with self._lock:
+            return json.loads(json.dumps(self.stats))
+
+    def _serve(self, request, method, body):
+        route = self.route(method, request.path)
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["bytes_in"] += len(body)
+            self.stats["by_route"][route] = self.stats["by_route"].get(route, 0) + 1
+
+        if self.profile_for(route).apply():
+            status, content_type, payload = 500, "application/json", json.dumps({"error": "injected failure"}).encode()
+            with self._lock:
+                self.stats["errors"] += 1
+        else:
+            try:
+                status, content_type, payload = self.handle(method, request.path, request.headers, body)
+            except Exception as e:
+                status, content_type, payload = 500, "application/json", json.dumps({"error": str(e)}).encode()
+
+        with self._lock:
+            self.stats["bytes_out"] += len(payload)
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(payload)))
+        request.end_headers()
+        request.wfile.write(payload)
+
+    def route(self, method, path):
+        return path.split("?")[0]
+
+    def profile_for(self, route):
+        return self.profile
+
+    def handle(self, method, path, headers, body):
+        """
+        Answer a request.
+
+        Returns:
+            tuple: (status, content type, payload bytes)
+        """
+        raise NotImplementedError
+
+
+class FakeLLMServer(FakeService):
+    """
+    An OpenAI-compatible chat completions endpoint (as served by OpenRouter).
+    Replies come from scenario rules, then from defaults recognised by the prompt's
+    JSON keys; anything else is answered with a joke.
+    """
+
+    name = "llm"
+
+    def __init__(self, profile=None, malformed_rate=0.0, seed=None, **kwargs):
+        """
+        Initialize the FakeLLMServer.
+
+        Args:
+            profile (FaultProfile, optional): Latency and failures to inject
+            malformed_rate (float): Fraction of JSON replies wrapped in chatter, to exercise the repair path
+            seed (int, optional): Seed for the malformed draws
+            **kwargs: Passed to FakeService
+        """
+        super().__init__(profile, **kwargs)
+        self.malformed_rate = malformed_rate
+        self._random = random.Random(seed)
+        self.rules = []
+
+    def set_rules(self, rules):
+        """
+        Set the scenario's reply rules.
+
+        Args:
+            rules (list): Dicts with "match" (substrings the prompt must all contain) and
+                "reply" (a dict sent as JSON, or a string sent as is)
+        """
+        self.rules = list(rules or [])
+
+    def reply_for(self, prompt):
+        """
+        Pick the reply to a prompt.
+
+        Returns:
+            tuple: (reply text, whether it is JSON)
+        """
+        if prompt.startswith(REPAIR_MARKER):
+            # Hand back the first JSON object in the malformed response, cleaned up
+            found = re.search(r"\{.*\}", prompt[len(REPAIR_MARKER):], re.S)
+            return (found.group(0) if found else "{}"), False
+        for rule in self.rules:
+            if all(marker in prompt for marker in rule["match"]):
+                reply = rule["reply"]
+                return (reply, False) if isinstance(reply, str) else (json.dumps(reply), True)
+        for marker, reply in DEFAULT_LLM_REPLIES:
+            if marker in prompt:
+                return json.dumps(reply), True
+        return DEFAULT_JOKE, False
+
+    def handle(self, method, path, headers, body):
+        if not path.split("?")[0].endswith("/chat/completions"):
+            return 404, "application/json", b'{"error": "not found"}'
+        request = json.loads(body or b"{}")
+        prompt = "\n".join(str(message.get("content", "")) for message in request.get("messages", []))
+        content, is_json = self.reply_for(prompt)
+        if is_json and self._random.random() < self.malformed_rate:
+            content = f"Sure! Here you go:\n{content}\nHope that helps!"
+        completion = {
+            "id": f"chatcmpl-{hashlib.sha1(body).hexdigest()[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                         "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt.split()), "completion_tokens": len(content.split()),
+                      "total_tokens": len(prompt.split()) + len(content.split())},
+        }
+        return 200, "application/json", json.dumps(completion).encode()
+
+
+class FakeElevenLabsServer(FakeService):
+    """
+    The ElevenLabs speech-to-text and text-to-speech endpoints.
+    Transcripts are looked up by the uploaded audio, so FileMicrophone registers each
+    recording it hands out; synthesized speech is silence whose length follows the text.
+    """
+
+    name = "elevenlabs"
+
+    def __init__(self, profile=None, tts_profile=None, seconds_per_character=0.01, **kwargs):
+        """
+        Initialize the FakeElevenLabsServer.
+
+        Args:
+            profile (FaultProfile, optional): Latency and failures for speech-to-text
+            tts_profile (FaultProfile, optional): Latency and failures for text-to-speech. Defaults to profile.
+            seconds_per_character (float): Length of synthesized speech per character of text
+            **kwargs: Passed to FakeService
+        """
+        super().__init__(profile, **kwargs)
+        self.stt_profile = self.profile
+        self.tts_profile = tts_profile or self.profile
+        self.seconds_per_character = seconds_per_character
+        self._transcripts = {}
+        self.characters = 0
+
+    def register_transcript(self, audio_bytes, text):
+        """
+        Set the transcript returned for a recording.
+
+        Args:
+            audio_bytes (bytes): The recording exactly as it will be uploaded
+            text (str): What the recording "says"
+        """
+        with self._lock:
+            self._transcripts[hashlib.sha1(audio_bytes).hexdigest()] = text
+
+    def route(self, method, path):
+        path = path.split("?")[0]
+        if path.startswith("/v1/speech-to-text"):
+            return "speech-to-text"
+        if path.startswith("/v1/text-to-speech"):
+            return "text-to-speech"
+        return path
+
+    def profile_for(self, route):
+        # Each endpoint has its own fault profile
+        return self.tts_profile if route == "text-to-speech" else self.stt_profile
+
+    def handle(self, method, path, headers, body):
+        route = self.route(method, path)
+        if route == "speech-to-text":
+            message = BytesParser(policy=HTTP).parsebytes(
+                b"Content-Type: " + headers["Content-Type"].encode() + b"\r\n\r\n" + body
+            )
+            audio = b""
+            for part in message.iter_parts():
+                if part.get_param("name", header="content-disposition") == "file":
+                    audio = part.get_payload(decode=True)
+            with self._lock:
+                text = self._transcripts.get(hashlib.sha1(audio).hexdigest(), "")
+            transcript = {"language_code": "eng", "language_probability": 1.0, "text": text, "words": []}
+            return 200, "application/json", json.dumps(transcript).encode()
+        if route == "text-to-speech":
+            text = json.loads(body or b"{}").get("text", "")
+            with self._lock:
+                self.characters += len(text)
+            # pcm_<rate> output: 16-bit mono silence
+            match = re.search(r"output_format=pcm_(\d+)", path)
+            sample_rate = int(match.group(1)) if match else 24000
+            frames = int(len(text) * self.seconds_per_character * sample_rate)
+            return 200, "audio/pcm", b"\x00\x00" * frames
+        return 404, "application/json", b'{"error": "not found"}'
+
+
+class ScriptExhausted(BaseException):
+    """
+    Raised when a dialog asks for more utterances than its scenario scripted.
+    A BaseException, so the dialogs' own error handling cannot turn it into silence and loop.
+    """
+
+
+class FileMicrophone:
+    """
+    A microphone that "records" scripted utterances from WAV fixtures.
+    Each recording gets a few unique trailing silent frames, so the fake speech-to-text
+    service can tell recordings of the same fixture apart and return each one's transcript.
+    """
+
+    name = "file microphone"
+
+    def __init__(self, stt_server, realtime=0.0):
+        """
+        Initialize the FileMicrophone.
+
+        Args:
+            stt_server (FakeElevenLabsServer): Service the transcripts are registered with
+            realtime (float): Fraction of each recording's length to actually wait (0 returns at once)
+        """
+        self.stt_server = stt_server
+        self.realtime = realtime
+        self._lock = threading.Lock()
+        self._script = []
+        self._count = 0
+
+    def script(self, utterances):
+        """
+        Queue the utterances the next recordings return. The fixtures are read now,
+        so recordings written over a fixture's path cannot change what later ones return.
+
+        Args:
+            utterances (list): Dicts with "text" and optionally "wav" (default: recorded_audio.wav)
+        """
+        script = []
+        for utterance in utterances:
+            with wave.open(utterance.get("wav", "recorded_audio.wav"), "rb") as fixture:
+                script.append((utterance.get("text", ""), fixture.getparams(),
+                               fixture.readframes(fixture.getnframes())))
+        with self._lock:
+            self._script = script
+
+    def remaining(self):
+        with self._lock:
+            return len(self._script)
+
+    def record(self, filename, record_seconds):
+        """
+        Write the next scripted utterance to a WAV file.
+
+        Args:
+            filename (str): Where to write the recording
+            record_seconds (float): Length the caller asked for
+
+        Returns:
+            str: The filename
+        """
+        with self._lock:
+            if not self._script:
+                raise ScriptExhausted("The dialog asked for more utterances than the scenario scripted")
+            text, params, frames = self._script.pop(0)
+            self._count += 1
+            padding = self._count
+
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as out:
+            out.setparams(params)
+            out.writeframes(frames + b"\x00" * (padding * params.sampwidth * params.nchannels))
+        audio = buffer.getvalue()
+
+        self.stt_server.register_transcript(audio, text)
+        if self.realtime > 0:
+            time.sleep(record_seconds * self.realtime)
+        with open(filename, "wb") as f:
+            f.write(audio)
+        return filename
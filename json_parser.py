@@ -1,5 +1,9 @@
 import json
 import re
+from tracing import span
+from metrics import counter
+
+JSON_REPAIRS = counter("jukebox_json_repairs_total", "Malformed LLM responses sent back to the LLM for repair", ("parser",))
 
 class JSONResponseParser:
     def __init__(self, llm_client):
@@ -11,6 +15,22 @@ class JSONResponseParser:
         """
         self.llm_client = llm_client
     
+    def repair(self, parser, clean_prompt, response_text):
+        """
+        Ask the LLM to turn a malformed response into valid JSON.
+        
+        Args:
+            parser (str): Which response is being repaired, e.g. "confirmation"
+            clean_prompt (str): Prompt describing the JSON expected
+            response_text (str): The malformed response
+            
+        Returns:
+            str: The LLM's cleaned-up response
+        """
+        JSON_REPAIRS.labels(parser).inc()
+        with span("json_repair", parser=parser):
+            return self.llm_client.call_llm(clean_prompt + response_text, task="json_repair")
+    
     def parse_json_response(self, response_text, clean_prompt=None):
         """
         Parse JSON response with optional cleaning.
@@ -38,7 +58,7 @@ class JSONResponseParser:
         # If parsing failed and we have a clean prompt, try cleaning
         if clean_prompt:
             try:
-                clean_response = self.llm_client.call_llm(clean_prompt + response_text)
+                clean_response = self.repair("validation", clean_prompt, response_text)
                 print("\033[93mCleaned JSON response:\033[0m", clean_response)
                 
                 result = json.loads(clean_response)
@@ -90,7 +110,7 @@ class JSONResponseParser:
         # If parsing failed and we have a clean prompt, try cleaning
         if clean_prompt:
             try:
-                clean_response = self.llm_client.call_llm(clean_prompt + response_text)
+                clean_response = self.repair("confirmation", clean_prompt, response_text)
                 print("\033[93mCleaned JSON response:\033[0m", clean_response)
                 
                 result = json.loads(clean_response)
@@ -142,7 +162,7 @@ class JSONResponseParser:
         # If parsing failed and we have a clean prompt, try cleaning
         if clean_prompt:
             try:
-                clean_response = self.llm_client.call_llm(clean_prompt + response_text)
+                clean_response = self.repair("song_picker", clean_prompt, response_text)
                 print("\033[93mCleaned JSON response:\033[0m", clean_response)
                 
                 result = json.loads(clean_response)
@@ -191,7 +211,7 @@ class JSONResponseParser:
         # If parsing failed and we have a clean prompt, try cleaning
         if clean_prompt:
             try:
-                clean_response = self.llm_client.call_llm(clean_prompt + response_text)
+                clean_response = self.repair("custom_song_picker", clean_prompt, response_text)
                 print("\033[93mCleaned JSON response:\033[0m", clean_response)
                 
                 result = json.loads(clean_response)
@@ -203,3 +223,95 @@ class JSONResponseParser:
                 pass  # Will return None to indicate failure
         
         return None  # Indicates parsing failed
+    
+    def parse_roast_pool_json(self, response_text, clean_prompt=None):
+        """
+        Parse and validate JSON response for a batch of pooled roasts.
+        
+        Required keys:
+        - "roasts" (list of strings): Short roasts that fit any song choice
+        
+        Args:
+            response_text (str): The response text to parse
+            clean_prompt (str, optional): Prompt to clean the response if needed
+            
+        Returns:
+            dict: Parsed JSON result with all required keys or None if parsing fails
+        """
+        try:
+            # Remove Markdown formatting
+            cleaned_response = re.sub(r"```json|```", "", response_text).strip()
+            
+            # Try to parse the response as JSON
+            result = json.loads(cleaned_response)
+            
+            # Validate required keys and their types
+            if (isinstance(result.get("roasts"), list) and
+                all(isinstance(roast, str) for roast in result["roasts"])):
+                return result
+        except:
+            pass  # Continue to cleaning attempt if provided
+        
+        # If parsing failed and we have a clean prompt, try cleaning
+        if clean_prompt:
+            try:
+                clean_response = self.repair("roast_pool", clean_prompt, response_text)
+                print("\033[93mCleaned JSON response:\033[0m", clean_response)
+                
+                result = json.loads(clean_response)
+                if (isinstance(result.get("roasts"), list) and
+                    all(isinstance(roast, str) for roast in result["roasts"])):
+                    return result
+            except:
+                pass  # Will return None to indicate failure
+        
+        return None  # Indicates parsing failed
+    
+    def parse_song_details_json(self, response_text, clean_prompt=None):
+        """
+        Parse and validate JSON response for custom song details extracted from one utterance.
+        
+        Required keys (each a string, or null if the user did not mention it):
+        - "song_name": Name of the song
+        - "genre": Genre of the song
+        - "styles": Musical styles of the song
+        - "lyrics_description": What the lyrics should be about
+        
+        Args:
+            response_text (str): The response text to parse
+            clean_prompt (str, optional): Prompt to clean the response if needed
+            
+        Returns:
+            dict: Parsed JSON result with all required keys or None if parsing fails
+        """
+        # Define required keys for the custom song details
+        required_keys = ["song_name", "genre", "styles", "lyrics_description"]
+        
+        try:
+            # Remove Markdown formatting
+            cleaned_response = re.sub(r"```json|```", "", response_text).strip()
+            
+            # Try to parse the response as JSON
+            result = json.loads(cleaned_response)
+            
+            # Validate required keys and their types
+            if (all(key in result for key in required_keys) and
+                all(result[key] is None or isinstance(result[key], str) for key in required_keys)):
+                return result
+        except:
+            pass  # Continue to cleaning attempt if provided
+        
+        # If parsing failed and we have a clean prompt, try cleaning
+        if clean_prompt:
+            try:
+                clean_response = self.repair("song_details", clean_prompt, response_text)
+                print("\033[93mCleaned JSON response:\033[0m", clean_response)
+                
+                result = json.loads(clean_response)
+                if (all(key in result for key in required_keys) and
+                    all(result[key] is None or isinstance(result[key], str) for key in required_keys)):
+                    return result
+            except:
+                pass  # Will return None to indicate failure
+        
+        return None  # Indicates parsing failed
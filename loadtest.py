@@ -0,0 +1,92 @@
+import time
+import asyncio
+import argparse
+import numpy as np
+import aiohttp
+
+
+async def run_session(base_url, turns, utterance, text, latencies, errors):
+    """
+    Drive one simulated terminal through a number of conversational turns.
+
+    Args:
+        base_url (str): HTTP URL of the server, e.g. http://localhost:8080
+        turns (int): Number of utterances to send
+        utterance (bytes, optional): WAV-encoded utterance to send each turn
+        text (str): Text sent instead when no utterance audio is given
+        latencies (list): Turn latencies in seconds are appended here
+        errors (list): Error messages are appended here
+    """
+    try:
+        async with aiohttp.ClientSession() as http:
+            async with http.ws_connect(f"{base_url}/session", max_msg_size=16 * 1024 * 1024) as ws:
+                sent_at = None
+                done = 0
+                async for message in ws:
+                    if message.type != aiohttp.WSMsgType.TEXT:
+                        continue
+                    event = message.json()
+                    if event["type"] == "audio" and sent_at is not None:
+                        latencies.append(time.perf_counter() - sent_at)
+                        sent_at = None
+                        done += 1
+                    elif event["type"] == "listen":
+                        if done >= turns:
+                            await ws.send_json({"type": "stop"})
+                            break
+                        sent_at = time.perf_counter()
+                        if utterance is not None:
+                            await ws.send_bytes(utterance)
+                        else:
+                            await ws.send_json({"type": "text", "text": text})
+    except Exception as e:
+        errors.append(str(e))
+
+
+async def main(args):
+    base_url = args.url.rstrip("/")
+    utterance = None
+    if args.wav:
+        with open(args.wav, "rb") as f:
+            utterance = f.read()
+
+    async with aiohttp.ClientSession() as http:
+        async with http.get(f"{base_url}/stats") as response:
+            before = await response.json()
+
+        latencies, errors = [], []
+        start = time.perf_counter()
+        sessions = []
+        for _ in range(args.sessions):
+            sessions.append(asyncio.create_task(
+                run_session(base_url, args.turns, utterance, args.text, latencies, errors)))
+            await asyncio.sleep(args.ramp / max(1, args.sessions))
+        await asyncio.gather(*sessions)
+        elapsed = time.perf_counter() - start
+
+        async with http.get(f"{base_url}/stats") as response:
+            after = await response.json()
+
+    # CPU the server burned per wall-clock second, in cores
+    cores_busy = (after["cpu_seconds"] - before["cpu_seconds"]) / max(1e-9, after["wall_seconds"] - before["wall_seconds"])
+    turns_ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    print(f"Sessions:          {args.sessions} ({len(errors)} failed)")
+    print(f"Turns:             {len(latencies)} in {elapsed:.1f} s ({len(latencies) / elapsed:.1f} turns/s)")
+    print(f"Turn latency:      p50 {np.percentile(turns_ms, 50):.0f} ms, p95 {np.percentile(turns_ms, 95):.0f} ms, "
+          f"max {turns_ms.max():.0f} ms")
+    print(f"Server CPU:        {cores_busy:.2f} cores busy of {after['cpu_count']}")
+    if cores_busy > 0:
+        print(f"Sessions per core: {args.sessions / cores_busy:.1f}")
+    for error in errors[:5]:
+        print(f"Error: {error}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the jukebox server with simulated terminals.")
+    parser.add_argument("--url", default="http://localhost:8080", help="Server URL")
+    parser.add_argument("--sessions", type=int, default=20, help="Concurrent terminals")
+    parser.add_argument("--turns", type=int, default=10, help="Utterances per terminal")
+    parser.add_argument("--ramp", type=float, default=5.0, help="Seconds over which the terminals connect")
+    parser.add_argument("--wav", help="WAV utterance to send each turn (exercises STT)")
+    parser.add_argument("--text", default="", help="Text utterance to send when no WAV is given")
+    asyncio.run(main(parser.parse_args()))
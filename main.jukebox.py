@@ -1,17 +1,28 @@
+import os
 import time
 import random
+from startup import StartupReport, load_environment
 from LLM import LLMClient
 from TTS import speak_text
-from STT import record_audio, transcribe_audio_with_elevenlabs
+from STT import record_audio, transcribe_audio_with_elevenlabs, check_microphone
 from songpicker import SongPicker
 from custom_songpicker import CustomSongPicker
+from confirmation import Confirmation
 from json_parser import JSONResponseParser
+from conversation import Conversation
 from static_messages import StaticMessages
+from audio_engine import get_audio_engine
+from speech_client import get_speech_client
+from tracing import turn
+from metrics import start_http_server
+from song_library import get_song_library
+from song_catalog import get_song_catalog
 import re
 
 # Import the new classes
-from status import Status
+from status import Status, State
 from song_player import SongPlayer
+from custom_song_jobs import CustomSongJobManager
 
 from colorama import init, Fore, Style
 init(autoreset=True)  # Initialize colorama
@@ -26,21 +37,112 @@ CUSTOM_SONG_COLOR = Fore.CYAN
 RESET_COLOR = Style.RESET_ALL
 
 class JukeboxJokeTeller:
-    def __init__(self):
+    def __init__(self, turn_gap=None, offer_gap=None):
         """
         Initialize the JukeboxJokeTeller with an LLM client and song pickers.
+        
+        Args:
+            turn_gap (tuple, optional): (min, max) seconds of silence between turns.
+                Defaults to JUKEBOX_TURN_GAP_MIN / JUKEBOX_TURN_GAP_MAX or (8, 15).
+            offer_gap (float, optional): Seconds of silence between a joke and an offer.
+                Defaults to JUKEBOX_OFFER_GAP or 1.
         """
-        self.llm_client = LLMClient()
-        self.song_picker = SongPicker()
-        self.custom_song_picker = CustomSongPicker()
+        # Subsystems that do not depend on each other warm up in parallel. Audio output
+        # comes up first on its own thread, so the welcome plays while the rest loads.
+        self.startup = StartupReport()
+        self.startup.timed("environment", load_environment)
+        self.welcome_playback = None
+        warm = self.startup.warm_up({
+            "audio output": self._open_audio,
+            "llm client": LLMClient,
+            "song library": get_song_library,
+            "song catalog": get_song_catalog,
+            "microphone": check_microphone,
+            "speech service": self._open_speech_service,
+            "database": self._connect_database,
+        })
+        
+        # One LLM client and one set of static messages are shared by every component
+        self.static_msgs = warm["audio output"].result()
+        self.llm_client = warm["llm client"].result()
+        library = warm["song library"].result()
+        self.song_picker = SongPicker(library, self.llm_client, self.static_msgs)
+        self.custom_song_picker = CustomSongPicker(llm_client=self.llm_client, static_msgs=self.static_msgs)
+        self.confirmation = Confirmation(self.llm_client, self.static_msgs)
         self.json_parser = JSONResponseParser(self.llm_client)
-        self.static_msgs = StaticMessages()
+        self.conversation = Conversation(self.llm_client, self.json_parser)
+        try:
+            print(f"Microphone: {warm['microphone'].result()}")
+        except Exception as e:
+            print(f"No microphone available: {e}")
         self.joke_count = 0
         self.offer_frequency = 3  # Make an offer every 3 jokes
         
+        # Pauses are measured from the moment the previous audio finished playing
+        self.turn_gap = turn_gap or (
+            float(os.getenv("JUKEBOX_TURN_GAP_MIN", "8")),
+            float(os.getenv("JUKEBOX_TURN_GAP_MAX", "15")),
+        )
+        self.offer_gap = offer_gap if offer_gap is not None else float(os.getenv("JUKEBOX_OFFER_GAP", "1"))
+        # Extra time a song queue may run past its catalogued length before it is stopped
+        self.song_overrun_grace = float(os.getenv("JUKEBOX_SONG_OVERRUN_GRACE", "30"))
+        
         # Initialize the new classes
         self.status = Status()
-        self.song_player = SongPlayer(self.status)
+        self.song_player = SongPlayer(self.status, library, warm["song catalog"].result())
+        # Custom songs are generated in the background while the jokes go on
+        self.custom_jobs = CustomSongJobManager(
+            self.status, self.song_player,
+            workers=int(os.getenv("CUSTOM_SONG_WORKERS", "1")),
+        )
+        self.startup.mark("ready")
+        self.startup.print_report()
+    
+    def _open_audio(self):
+        """
+        Open the audio output, start the welcome message and preload the other static messages.
+        
+        Returns:
+            StaticMessages: The static messages, preloaded
+        """
+        get_audio_engine()
+        static_msgs = StaticMessages()
+        self.welcome_playback = static_msgs.play_static_message("welcome", block=False)
+        self.startup.mark("welcome playing")
+        self.startup.timed("static audio", static_msgs.preload)
+        return static_msgs
+    
+    def _open_speech_service(self):
+        """
+        Create the shared speech client and open its first connection before the first turn.
+        """
+        get_speech_client().preconnect(int(os.getenv("ELEVENLABS_WARM_CONNECTIONS", "1")))
+    
+    def _connect_database(self):
+        """
+        Open the song writer's outbox and database connection ahead of the first confirmed song.
+        """
+        # pymongo is slow to import, so it is only loaded here, off the startup path
+        from mongo_writer import get_song_writer
+        get_song_writer().handler.connect()
+    
+    def welcome(self, block=True):
+        """
+        Play the welcome message, unless it already started during startup.
+        
+        Args:
+            block (bool): Whether to wait until the welcome finishes playing
+            
+        Returns:
+            PlaybackHandle: Completion handle for the welcome, or None if it could not be played
+        """
+        playback = self.welcome_playback
+        self.welcome_playback = None
+        if playback is None:
+            playback = self.static_msgs.play_static_message("welcome", block=False)
+        if block and playback is not None:
+            playback.wait()
+        return playback
     
     
     def validate_user_request(self, user_input):
@@ -53,49 +155,7 @@ class JukeboxJokeTeller:
         Returns:
             dict: JSON response with validation results
         """
-        prompt = f"""
-        You are evaluating user input to determine if they want songs or custom songs based on our offer.
-        Our offer is: "I can play songs for you or make a song for your loved ones or yourself for just $1 USD each."
-        
-        User said: "{user_input}"
-        
-        Respond with a JSON object containing:
-        1. "relevant" (boolean): Whether the user's input relates to our song offer
-        2. "type" (string): Either "play" for playing existing songs, "custom" for custom songs, or "none" if not relevant
-        3. "confidence" (string): How confident you are in your assessment ("high", "medium", "low")
-        
-        Example format:
-        {{
-            "relevant": true/false,
-            "type": "play/custom/none",
-            "confidence": "high/medium/low"
-        }}
-        
-        ONLY Respond in JSON no Markdown.
-        """
-        CleanJsonPrompt = "Please return only a valid JSON object. Do not include markdown formatting, code blocks, comments, or any extra text. The JSON must contain the following keys: relevant (boolean), type (string), and confidence (string). Ensure all quotation marks are straight quotes, and escape any special characters properly. Do not wrap the response in triple backticks or label it as JSON. Just return the raw JSON object. If the input is malformed, fix it silently and return only the corrected JSON."
-        
-        try:
-            print(f"{API_COLOR}Calling LLM for user request validation...{RESET_COLOR}")
-            response = self.llm_client.call_llm(prompt)
-            print(Fore.CYAN + "LLM Response:" + Style.RESET_ALL, response)
-
-            # Try to parse the response
-            result = self.json_parser.parse_json_response(response, CleanJsonPrompt)
-            
-            # Return parsed result or default response
-            return result if result else {
-                "relevant": False,
-                "type": "none",
-                "confidence": "low"
-            }
-        except Exception as e:
-            print(f"Error validating user request: {e}")
-            return {
-                "relevant": False,
-                "type": "none",
-                "confidence": "low"
-            }
+        return self.conversation.validate_user_request(user_input)
     
     def listen_once(self):
         """
@@ -105,10 +165,14 @@ class JukeboxJokeTeller:
         try:
             # Record audio from microphone (5 seconds)
             print(f"{LISTEN_COLOR}Listening for user input...{RESET_COLOR}")
-            audio_filename = record_audio(record_seconds=5)
-            
-            # Transcribe using ElevenLabs
-            transcription = transcribe_audio_with_elevenlabs(audio_filename)
+            self.status.transition(State.LISTENING, expected=State.IDLE)
+            try:
+                audio_filename = record_audio(record_seconds=5)
+                
+                # Transcribe using ElevenLabs
+                transcription = transcribe_audio_with_elevenlabs(audio_filename)
+            finally:
+                self.status.transition(State.IDLE, expected=State.LISTENING)
             user_input = transcription.text.strip()
             
             if user_input:
@@ -129,8 +193,8 @@ class JukeboxJokeTeller:
                         else:
                             print("Song selected and confirmed!")
                             self.static_msgs.play_static_message("song_selected_confirmed")
-                            # Play the selected song using SongPlayer
-                            self.song_player.play_song(song_choice)
+                            # Queue the selected song; the main loop waits for playback to end
+                            self.song_player.play_song_async(song_choice)
                     elif validation["type"] == "custom":
                         self.static_msgs.play_static_message("create_custom_song")
                         print(f"{CUSTOM_SONG_COLOR}Going to custom song picker...{RESET_COLOR}")
@@ -141,8 +205,8 @@ class JukeboxJokeTeller:
                         else:
                             print("Custom song selected and confirmed!")
                             self.static_msgs.play_static_message("custom_song_selected_confirmed")
-                            # Play the custom song using SongPlayer
-                            self.song_player.play_custom_song(song_details)
+                            # Generate the song in the background; the main loop plays it when it is ready
+                            self.custom_jobs.submit(song_details)
                 return True
             return False
         except Exception as e:
@@ -156,41 +220,57 @@ class JukeboxJokeTeller:
         Returns:
             str: The generated joke
         """
-        prompt = """
-        You are an ENTP personality with dark humor who loves to roast society, unfair jobs, and life situations.
-        Tell a short, witty joke that:
-        1. Critiques society, corporate culture, expensive rent, expensive mortgages, or unfair life situations
-        2. Has ENTP-style dark humor (clever, not mean-spirited)
-        3. Is concise and funny
-        4. Roasts the absurdity of modern life, work, or social expectations
-        
-       
-        Generate an original joke following this style do not add comments make it one sentence long no commenting before or after just a one liner joke.
-        """
-        
-        try:
-            print(f"{API_COLOR}Calling LLM for joke generation...{RESET_COLOR}")
-            joke = self.llm_client.call_llm(prompt)
-            print(f"{JOKE_COLOR}Joke: {joke.strip()}{RESET_COLOR}")
-            return joke.strip()
-        except Exception as e:
-            error_message = "Uh oh, I couldn't come up with a joke right now. Even my creativity is on strike!"
-            print(f"Error generating joke: {e}")
-            return error_message
+        return self.conversation.tell_joke()
     
-    def offer(self):
+    def offer(self, block=True):
         """
         Make an offer to play songs or make custom songs.
+        
+        Args:
+            block (bool): Whether to wait until the offer finishes playing
+            
+        Returns:
+            PlaybackHandle: Completion handle for the offer, or None if it could not be played
         """
-        self.static_msgs.play_static_message("offer")
         print("Offer: I can play songs for you or make a song for your loved ones or yourself for just $1 each.")
+        return self.static_msgs.play_static_message("offer", block=block)
+    
+    def take_turn(self):
+        """
+        Run one turn: listen, and either handle what the user asked for or tell a joke
+        (followed by an offer every few jokes). Each turn is traced, from listening
+        until the answer, joke or offer has played.
+        
+        Returns:
+            bool: True if user input was processed, False if a joke was told
+        """
+        with turn():
+            # Listen for user input
+            if self.listen_once():
+                return True
+            
+            # Tell a joke and wait for the speech to finish playing
+            joke = self.tell_joke()
+            print(f"Joke: {joke}")
+            playback = speak_text(joke, block=False)
+            if playback:
+                playback.wait()
+            
+            # Increment joke counter
+            self.joke_count += 1
+            
+            # Make an offer every few jokes
+            if self.joke_count % self.offer_frequency == 0:
+                time.sleep(self.offer_gap)  # Brief pause before offer
+                self.offer()
+            return False
     
     def run(self):
         """
         Main loop that alternates between listening and telling jokes in the same thread.
         """
         print("Jukebox Joke Teller started! Enjoy the humor...")
-        self.static_msgs.play_static_message("welcome")
+        self.welcome()
         
         # Initial offer
         self.offer()
@@ -198,49 +278,47 @@ class JukeboxJokeTeller:
         # Main loop that alternates between listening and joke telling
         while True:
             try:
-                # Check if a song is currently playing
-                if self.status.playing_song or self.status.playing_custom_song:
-                    print("Song is currently playing. Waiting for it to finish...")
-                    time.sleep(2)  # Check every 2 seconds if song is still playing
-                    continue
+                # Start any custom songs that finished generating since the last turn
+                for job in self.custom_jobs.play_ready():
+                    print(f"{CUSTOM_SONG_COLOR}Custom song '{job.song_name}' is ready!{RESET_COLOR}")
                 
-                # Listen for user input
-                user_input_processed = self.listen_once()
+                # Block until any song activity is over instead of polling the status
+                if self.status.is_song_active():
+                    remaining = self.song_player.remaining_seconds()
+                    print(f"Song is currently playing. Waiting about {remaining:.0f}s for it to finish...")
+                    # The catalog tells us how long the queue should take; stop it if it overruns badly
+                    if not self.status.wait_until(State.IDLE, timeout=remaining + self.song_overrun_grace):
+                        if remaining > 0 and self.status.state == State.PLAYING:
+                            print("Song playback overran its catalogued length, stopping it.")
+                            self.song_player.stop()
+                    continue
                 
                 # If user input was processed, continue to next iteration
-                if user_input_processed:
+                if self.take_turn():
                     continue
                 
-                # Tell a joke
-                joke = self.tell_joke()
-                print(f"Joke: {joke}")
-                speak_text(joke)
-
-                # Wait a few seconds for the joke audio to finish playing
-                time.sleep(5)
-
-                # Increment joke counter
-                self.joke_count += 1
-                
-                # Make an offer every few jokes
-                if self.joke_count % self.offer_frequency == 0:
-                    time.sleep(2)  # Brief pause before offer
-                    self.offer()
-                    time.sleep(3)  # Wait for offer to finish playing
-                
                 # Wait before next cycle (random interval for natural feel)
-                wait_time = random.randint(8, 15)
-                time.sleep(wait_time)
+                time.sleep(random.uniform(*self.turn_gap))
             except Exception as e:
                 print(f"Error in main loop: {e}")
                 self.static_msgs.play_static_message("try_again")
                 time.sleep(5)  # Wait before continuing
 
 if __name__ == "__main__":
+    # Expose counters and latency histograms to Prometheus if a port is configured
+    if os.getenv("JUKEBOX_METRICS_PORT"):
+        start_http_server(int(os.getenv("JUKEBOX_METRICS_PORT")), os.getenv("JUKEBOX_METRICS_HOST", "0.0.0.0"))
+    
     # Create an instance of JukeboxJokeTeller and run it
     joke_teller = JukeboxJokeTeller()
     try:
-        joke_teller.run()
+        if os.getenv("JUKEBOX_ASYNC", "1") == "1":
+            # Overlap listening, LLM calls and speech synthesis on an asyncio loop
+            import asyncio
+            from orchestrator import JukeboxOrchestrator
+            asyncio.run(JukeboxOrchestrator(joke_teller).run())
+        else:
+            joke_teller.run()
     except KeyboardInterrupt:
         print("\nJukebox Joke Teller stopped.")
         speak_text("Thanks for listening! Come back anytime for more social commentary!")
@@ -0,0 +1,228 @@
+import os
+import time
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Any
+from bson import ObjectId
+from mongodb_handler import get_mongo_handler
+from song_outbox import SongOutbox
+from tracing import traced
+from metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_COMMIT_SECONDS = histogram("jukebox_song_outbox_commit_seconds", "Time to commit a song document to the local outbox")
+
+
+class SongWriteQueue:
+    """
+    A write-behind replicator in front of MongoDBHandler.
+    Callers hand over song documents, which are committed to the local SongOutbox
+    (a group-fsynced append-only log) before submit() returns. A background worker
+    drains the outbox in batches, once a batch is full or the flush interval passes,
+    and acknowledges each batch after MongoDB has stored it. Nothing is lost while
+    MongoDB is unreachable or the process restarts: the worker backs off and the
+    outbox keeps the backlog on disk.
+    """
+
+    def __init__(self, handler, outbox, batch_size=50, flush_interval=1.0,
+                 retry_backoff=0.5, max_backoff=60.0):
+        """
+        Initialize the SongWriteQueue and start its worker thread.
+
+        Args:
+            handler (MongoDBHandler): Handler used for the bulk upserts
+            outbox (SongOutbox): Durable log that every document is committed to first
+            batch_size (int): Maximum number of documents per bulk write
+            flush_interval (float): Maximum seconds a document waits before its batch is written
+            retry_backoff (float): Seconds before the first retry, doubled on each retry
+            max_backoff (float): Upper bound for the retry delay
+        """
+        self.handler = handler
+        self.outbox = outbox
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self._stopping = threading.Event()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            "submitted": 0,
+            "written": 0,
+            "failed_attempts": 0,
+            "flushes": 0,
+            "last_commit_ms": 0.0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    @traced("submit_song_data")
+    def submit(self, song_data: Dict[str, Any]) -> bool:
+        """
+        Commit a song document to the local outbox for replication.
+        The document gets its "_id" and "timestamp" now, so the stored timestamp is
+        the time of the request rather than the time of the flush.
+
+        Args:
+            song_data (dict): Dictionary containing song information
+
+        Returns:
+            bool: True if the document was committed locally, False otherwise
+        """
+        document = song_data.copy()
+        document.setdefault("_id", ObjectId())
+        document.setdefault("timestamp", datetime.now(timezone.utc))
+        start = time.perf_counter()
+        try:
+            self.outbox.append(document)
+        except Exception as e:
+            logger.error(f"Error committing song data to the outbox: {e}")
+            return False
+        elapsed = time.perf_counter() - start
+        OUTBOX_COMMIT_SECONDS.observe(elapsed)
+        with self._metrics_lock:
+            self._metrics["submitted"] += 1
+            self._metrics["last_commit_ms"] = elapsed * 1000
+        return True
+
+    def _run(self):
+        """
+        Worker loop: replicate outbox batches to MongoDB and acknowledge them.
+        """
+        backoff = self.retry_backoff
+        while not self._stopping.is_set():
+            batch = self.outbox.take(self.batch_size, self.flush_interval)
+            if not batch:
+                continue
+
+            start = time.perf_counter()
+            if self.handler.upsert_song_documents([document for _, document in batch]):
+                # Counted before the ack, so flush() never returns ahead of the metrics
+                self._record_flush(len(batch), time.perf_counter() - start)
+                self.outbox.ack(batch[-1][0])
+                backoff = self.retry_backoff
+            else:
+                # MongoDB is unreachable; the batch stays in the outbox until a retry succeeds
+                with self._metrics_lock:
+                    self._metrics["failed_attempts"] += 1
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def _record_flush(self, count, seconds):
+        """
+        Record a successful flush in the metrics.
+
+        Args:
+            count (int): Number of documents written
+            seconds (float): Time the flush took
+        """
+        elapsed_ms = seconds * 1000
+        with self._metrics_lock:
+            self._metrics["written"] += count
+            self._metrics["flushes"] += 1
+            self._metrics["last_flush_ms"] = elapsed_ms
+            self._metrics["max_flush_ms"] = max(self._metrics["max_flush_ms"], elapsed_ms)
+            self._metrics["total_flush_ms"] += elapsed_ms
+
+    def flush(self, timeout=None):
+        """
+        Block until every committed document has been replicated.
+
+        Args:
+            timeout (float, optional): Maximum number of seconds to wait
+
+        Returns:
+            bool: True if the backlog drained, False if the timeout expired first
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.outbox.backlog() > 0:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def close(self, timeout=10.0):
+        """
+        Try to replicate the backlog, then stop the worker and close the outbox.
+        Anything not replicated in time stays in the outbox for the next start.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait for the final flush
+
+        Returns:
+            bool: True if everything was replicated, False otherwise
+        """
+        drained = self.flush(timeout)
+        self._stopping.set()
+        self.outbox.close()
+        self._worker.join(timeout=max(self.flush_interval, 0.1))
+        if not drained:
+            logger.warning(f"{self.outbox.backlog()} song records left in {self.outbox.path} for the next start")
+        return drained
+
+    def metrics(self):
+        """
+        Get a snapshot of the replication metrics.
+
+        Returns:
+            dict: Backlog depth, document counters and commit/flush latency in milliseconds
+        """
+        with self._metrics_lock:
+            snapshot = dict(self._metrics)
+        flushes = snapshot.pop("total_flush_ms")
+        snapshot["avg_flush_ms"] = flushes / snapshot["flushes"] if snapshot["flushes"] else 0.0
+        snapshot["queue_depth"] = self.outbox.backlog()
+        return snapshot
+
+
+# The process-wide write queue used by the song pickers
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_song_writer():
+    """
+    Get the process-wide SongWriteQueue, configured from MONGODB_WRITE_* and
+    SONG_OUTBOX_* env vars. The backlog is flushed (or left durable) at interpreter exit.
+
+    Returns:
+        SongWriteQueue: The shared write queue
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            # The outbox comes first: records are committed locally even if MongoDB is misconfigured
+            outbox = SongOutbox(
+                os.getenv("SONG_OUTBOX_PATH", "song_outbox.jsonl"),
+                max_in_memory=int(os.getenv("SONG_OUTBOX_MAX_IN_MEMORY", "1000")),
+            )
+            # Fetch the handler before registering our close so its close runs after our final flush (atexit is LIFO)
+            handler = get_mongo_handler()
+            _writer = SongWriteQueue(
+                handler,
+                outbox,
+                batch_size=int(os.getenv("MONGODB_WRITE_BATCH_SIZE", "50")),
+                flush_interval=float(os.getenv("MONGODB_WRITE_FLUSH_SECONDS", "1.0")),
+                max_backoff=float(os.getenv("MONGODB_WRITE_MAX_BACKOFF_SECONDS", "60")),
+            )
+            atexit.register(_writer.close)
+        return _writer
+
+
+# Example usage
+if __name__ == "__main__":
+    writer = get_song_writer()
+    for i in range(5):
+        writer.submit({
+            "song_name": f"Example Song {i}",
+            "acceptable": True,
+            "roast": "Not bad, but could use more cowbell."
+        })
+    print(f"Queued: {writer.metrics()}")
+    writer.close()
+    print(f"After close: {writer.metrics()}")
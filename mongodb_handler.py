@@ -1,50 +1,296 @@
 import os
+import time
+import atexit
 import logging
-from datetime import datetime, timezone
-from typing import Dict, Any
-from pymongo import MongoClient
-from dotenv import load_dotenv
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List
+from pymongo import MongoClient, ReplaceOne, UpdateOne, ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+from startup import load_environment
+from titles import normalize_title
+from tracing import traced
+from metrics import counter, histogram
 
 # Load environment variables
-load_dotenv()
+load_environment()
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+MONGO_WRITES = counter("jukebox_mongo_writes_total", "MongoDB song writes by operation and outcome", ("operation", "outcome"))
+MONGO_WRITE_SECONDS = histogram("jukebox_mongo_write_seconds", "MongoDB song write latency by operation", ("operation",))
+
+# Genre of the song totals that count every genre together
+ALL_GENRES = "*"
+
 
 class MongoDBHandler:
-    def __init__(self):
+    def __init__(self, client=None):
         """
         Initialize the MongoDB handler with connection configuration.
+        The connection is opened lazily on first use and then kept open; the
+        underlying MongoClient pools connections, so one handler serves the whole process.
+        
+        Args:
+            client (MongoClient, optional): An existing client to use instead of
+                connecting to MONGODB_URI, e.g. a mongomock client in tests
         """
         self.mongodb_uri = os.getenv("MONGODB_URI")
         self.database_name = os.getenv("MONGODB_DATABASE", "aijukebox")
         self.collection_name = os.getenv("MONGODB_COLLECTION", "songs")
-        self.client = None
+        self.rollup_collection_name = os.getenv("MONGODB_ROLLUP_COLLECTION", "song_rollups")
+        self.totals_collection_name = os.getenv("MONGODB_TOTALS_COLLECTION", "song_totals")
+        # Width of the time buckets the popularity counters are kept in
+        self.rollup_bucket = timedelta(minutes=int(os.getenv("MONGODB_ROLLUP_BUCKET_MINUTES", "60")))
+        self.client = client
+        self._owns_client = client is None
         self.db = None
         self.collection = None
+        self.rollups = None
+        self.totals = None
+        self._lock = threading.Lock()
         
-        if not self.mongodb_uri:
-            raise ValueError("MONGODB_URI not found in environment variables")
-        
-        self.connect()
+        # Pool and timeout tuning
+        self.client_options = {
+            "maxPoolSize": int(os.getenv("MONGODB_MAX_POOL_SIZE", "10")),
+            "minPoolSize": int(os.getenv("MONGODB_MIN_POOL_SIZE", "1")),
+            "maxIdleTimeMS": int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "300000")),
+            "serverSelectionTimeoutMS": int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+            "connectTimeoutMS": int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000")),
+            "socketTimeoutMS": int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "10000")),
+            "retryWrites": True,
+        }
+        self.connect_retries = int(os.getenv("MONGODB_CONNECT_RETRIES", "3"))
+        self.retry_backoff = float(os.getenv("MONGODB_RETRY_BACKOFF_SECONDS", "0.5"))
     
     def connect(self):
         """
-        Establish connection to MongoDB.
+        Establish connection to MongoDB, retrying with exponential backoff.
+        Does nothing if the handler is already connected.
+        
+        Raises:
+            ValueError: If there is no client and MONGODB_URI is not set
+            PyMongoError: If MongoDB cannot be reached
+        """
+        with self._lock:
+            if self.collection is not None:
+                return
+            
+            if self.client is not None:
+                # Injected client: nothing to dial
+                self._open_collections()
+                return
+            
+            # Checked here rather than on creation, so song writes still reach the outbox
+            if not self.mongodb_uri:
+                raise ValueError("MONGODB_URI not found in environment variables")
+            
+            for attempt in range(1, self.connect_retries + 1):
+                client = None
+                try:
+                    client = MongoClient(self.mongodb_uri, **self.client_options)
+                    # Test the connection once; afterwards the pool handles reconnects
+                    client.admin.command('ping')
+                    self.client = client
+                    self._open_collections()
+                    logger.info("Successfully connected to MongoDB")
+                    return
+                except PyMongoError as e:
+                    if client is not None:
+                        client.close()
+                    logger.error(f"Error connecting to MongoDB (attempt {attempt}/{self.connect_retries}): {e}")
+                    if attempt == self.connect_retries:
+                        raise
+                    time.sleep(self.retry_backoff * (2 ** (attempt - 1)))
+    
+    def _open_collections(self):
+        """
+        Bind the songs, rollup and totals collections and make sure their indexes exist.
+        Call with the lock held.
         """
+        self.db = self.client[self.database_name]
+        self.collection = self.db[self.collection_name]
+        self.rollups = self.db[self.rollup_collection_name]
+        self.totals = self.db[self.totals_collection_name]
         try:
-            self.client = MongoClient(self.mongodb_uri)
-            # Test the connection
-            self.client.admin.command('ping')
-            self.db = self.client[self.database_name]
-            self.collection = self.db[self.collection_name]
-            logger.info("Successfully connected to MongoDB")
-        except Exception as e:
-            logger.error(f"Error connecting to MongoDB: {e}")
-            raise
+            # create_index is a no-op for indexes that already exist
+            self.collection.create_index([("timestamp", DESCENDING)])
+            self.collection.create_index([("song_name", ASCENDING)])
+            self.collection.create_index([("genre", ASCENDING), ("timestamp", DESCENDING)])
+            self.rollups.create_index([("bucket", DESCENDING)])
+            self.rollups.create_index([("genre", ASCENDING), ("bucket", DESCENDING)])
+            self.rollups.create_index([("title", ASCENDING), ("bucket", DESCENDING)])
+            # All-time leaderboards are read straight off this index
+            self.totals.create_index([("genre", ASCENDING), ("requests", DESCENDING), ("title", ASCENDING)])
+        except PyMongoError as e:
+            logger.warning(f"Could not create MongoDB indexes: {e}")
     
+    def get_collection(self):
+        """
+        Get the songs collection, connecting on first use.
+        
+        Returns:
+            Collection: The MongoDB collection for song data
+        """
+        if self.collection is None:
+            self.connect()
+        return self.collection
+    
+    def get_rollup_collection(self):
+        """
+        Get the rollup collection of per-song popularity counters, connecting on first use.
+        
+        Returns:
+            Collection: The MongoDB collection for song rollups
+        """
+        if self.rollups is None:
+            self.connect()
+        return self.rollups
+    
+    def get_totals_collection(self):
+        """
+        Get the collection of all-time per-song counters, connecting on first use.
+        
+        Returns:
+            Collection: The MongoDB collection for song totals
+        """
+        if self.totals is None:
+            self.connect()
+        return self.totals
+    
+    @staticmethod
+    def _to_utc(timestamp):
+        """
+        Convert a timestamp to naive UTC, the form MongoDB returns dates in.
+        
+        Args:
+            timestamp (datetime): A naive UTC or timezone-aware timestamp
+            
+        Returns:
+            datetime: The naive UTC timestamp
+        """
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        return timestamp
+    
+    def _bucket_start(self, timestamp):
+        """
+        Get the start of the rollup bucket that contains a timestamp.
+        
+        Args:
+            timestamp (datetime): The timestamp of a song request
+            
+        Returns:
+            datetime: Start of the bucket, in naive UTC
+        """
+        epoch = datetime(1970, 1, 1)
+        return epoch + ((self._to_utc(timestamp) - epoch) // self.rollup_bucket) * self.rollup_bucket
+    
+    def update_rollups(self, documents: List[Dict[str, Any]]):
+        """
+        Add song documents to the popularity counters.
+        Documents are counted per normalized title, genre and time bucket, and per
+        title and genre for all time (once in their genre and once in ALL_GENRES).
+        Documents with the same key are merged into one $inc before writing.
+        
+        Args:
+            documents (list): Song documents, each with a "song_name" and "timestamp"
+        """
+        counters = {}
+        for doc in documents:
+            title = normalize_title(str(doc.get("song_name") or ""))
+            if not title:
+                continue
+            genre = normalize_title(str(doc.get("genre") or "")) or None
+            timestamp = self._to_utc(doc.get("timestamp") or datetime.now(timezone.utc))
+            bucket = self._bucket_start(timestamp)
+            counter = counters.setdefault((title, genre, bucket), {
+                "song_name": doc.get("song_name"),
+                "requests": 0,
+                "accepted": 0,
+                "last_requested": timestamp,
+            })
+            counter["requests"] += 1
+            counter["accepted"] += 1 if doc.get("acceptable") else 0
+            if timestamp >= counter["last_requested"]:
+                # Shown as the song's name: the spelling of its latest request
+                counter["song_name"] = doc.get("song_name")
+                counter["last_requested"] = timestamp
+        if not counters:
+            return
+        
+        totals = {}
+        for (title, genre, _), counter in counters.items():
+            for key in ((title, genre), (title, ALL_GENRES)):
+                total = totals.setdefault(key, dict(counter, requests=0, accepted=0))
+                total["requests"] += counter["requests"]
+                total["accepted"] += counter["accepted"]
+                if counter["last_requested"] >= total["last_requested"]:
+                    total["song_name"] = counter["song_name"]
+                    total["last_requested"] = counter["last_requested"]
+        
+        operations = [
+            UpdateOne(
+                {"_id": {"title": title, "genre": genre, "bucket": bucket}},
+                {
+                    "$inc": {"requests": counter["requests"], "accepted": counter["accepted"]},
+                    "$max": {"last_requested": counter["last_requested"]},
+                    "$setOnInsert": {"title": title, "genre": genre, "bucket": bucket,
+                                     "song_name": counter["song_name"]},
+                },
+                upsert=True,
+            )
+            for (title, genre, bucket), counter in counters.items()
+        ]
+        self.get_rollup_collection().bulk_write(operations, ordered=False)
+        
+        self.get_totals_collection().bulk_write([
+            UpdateOne(
+                {"_id": {"title": title, "genre": genre}},
+                {
+                    "$inc": {"requests": total["requests"], "accepted": total["accepted"]},
+                    "$max": {"last_requested": total["last_requested"]},
+                    "$set": {"song_name": total["song_name"]},
+                    "$setOnInsert": {"title": title, "genre": genre},
+                },
+                upsert=True,
+            )
+            for (title, genre), total in totals.items()
+        ], ordered=False)
+    
+    def rebuild_totals(self):
+        """
+        Recompute the all-time totals from the rollups, e.g. after the totals
+        collection was added to a database that already had rollups.
+        
+        Returns:
+            int: Number of totals written
+        """
+        totals = {}
+        # Newest buckets first, so the first spelling seen is the latest one
+        for row in self.get_rollup_collection().find().sort("bucket", DESCENDING):
+            for genre in (row.get("genre"), ALL_GENRES):
+                total = totals.setdefault((row["title"], genre), {
+                    "title": row["title"],
+                    "genre": genre,
+                    "song_name": row.get("song_name"),
+                    "requests": 0,
+                    "accepted": 0,
+                    "last_requested": row.get("last_requested"),
+                })
+                total["requests"] += row.get("requests", 0)
+                total["accepted"] += row.get("accepted", 0)
+        operations = [
+            ReplaceOne({"_id": {"title": title, "genre": genre}}, total, upsert=True)
+            for (title, genre), total in totals.items()
+        ]
+        if operations:
+            self.get_totals_collection().bulk_write(operations, ordered=False)
+        return len(operations)
+    
+    @traced("insert_song_data")
     def insert_song_data(self, song_data: Dict[str, Any]) -> bool:
         """
         Insert song data into MongoDB collection.
@@ -61,33 +307,252 @@ class MongoDBHandler:
             song_data_with_timestamp["timestamp"] = datetime.now(timezone.utc)
             
             # Insert the data
-            result = self.collection.insert_one(song_data_with_timestamp)
+            start = time.perf_counter()
+            result = self.get_collection().insert_one(song_data_with_timestamp)
+            MONGO_WRITE_SECONDS.labels("insert").observe(time.perf_counter() - start)
+            MONGO_WRITES.labels("insert", "ok").inc()
             
             if result.inserted_id:
                 logger.info(f"Successfully inserted song data with ID: {result.inserted_id}")
+                try:
+                    self.update_rollups([song_data_with_timestamp])
+                except Exception as e:
+                    logger.error(f"Error updating song rollups: {e}")
                 return True
             else:
                 logger.warning("Failed to insert song data")
                 return False
                 
         except Exception as e:
+            MONGO_WRITES.labels("insert", "error").inc()
             logger.error(f"Error inserting song data: {e}")
             return False
     
+    @traced("upsert_song_documents")
+    def upsert_song_documents(self, documents: List[Dict[str, Any]]) -> bool:
+        """
+        Write a batch of prepared song documents in one round-trip.
+        Each document is upserted by its "_id", so replaying a batch after a
+        crash or a lost acknowledgement never creates duplicates. Only newly
+        inserted documents are added to the popularity counters, so replays do not
+        count a request twice.
+        
+        Args:
+            documents (list): Song documents, each with an "_id" and "timestamp"
+            
+        Returns:
+            bool: True if every document is stored, False otherwise
+        """
+        if not documents:
+            return True
+        try:
+            operations = [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in documents]
+            start = time.perf_counter()
+            result = self.get_collection().bulk_write(operations, ordered=False)
+            MONGO_WRITE_SECONDS.labels("upsert_batch").observe(time.perf_counter() - start)
+            MONGO_WRITES.labels("upsert_batch", "ok").inc()
+            logger.info(f"Stored {len(documents)} song documents "
+                        f"({result.upserted_count} new, {result.matched_count} replayed)")
+        except Exception as e:
+            MONGO_WRITES.labels("upsert_batch", "error").inc()
+            logger.error(f"Error writing song batch: {e}")
+            return False
+        
+        try:
+            self.update_rollups([documents[index] for index in result.upserted_ids])
+        except Exception as e:
+            # The documents are stored; a replay would not count them again, so do not fail the batch
+            logger.error(f"Error updating song rollups: {e}")
+        return True
+    
+    def _bucket_match(self, since=None, until=None, genre=None, title=None):
+        """
+        Build the rollup filter for a time range and optional genre or title.
+        
+        Args:
+            since (datetime, optional): Only count requests at or after this time
+            until (datetime, optional): Only count requests before this time
+            genre (str, optional): Only count requests in this genre
+            title (str, optional): Only count requests for this song
+            
+        Returns:
+            dict: A filter on the rollup collection
+        """
+        match = {}
+        if since is not None or until is not None:
+            match["bucket"] = {}
+            if since is not None:
+                match["bucket"]["$gte"] = self._bucket_start(since)
+            if until is not None:
+                match["bucket"]["$lt"] = self._to_utc(until)
+        if genre is not None:
+            match["genre"] = normalize_title(genre) or None
+        if title is not None:
+            match["title"] = normalize_title(title)
+        return match
+    
+    def top_songs(self, limit=10, since=None, until=None, genre=None) -> List[Dict[str, Any]]:
+        """
+        Get the most requested songs, read from the counters rather than the raw requests.
+        Without a time range the all-time totals are read in index order, so only
+        `limit` documents are examined. With a time range the rollups of every song
+        requested in the range are summed, which costs one document per song and bucket.
+        
+        Args:
+            limit (int): Maximum number of songs to return
+            since (datetime, optional): Only count requests at or after this time
+                (rounded down to the start of its bucket)
+            until (datetime, optional): Only count requests before this time
+            genre (str, optional): Only count requests in this genre
+            
+        Returns:
+            list: Dictionaries with title, song_name (the spelling of the latest request),
+                requests, accepted and acceptance_rate, most requested first
+        """
+        if since is None and until is None:
+            genre = ALL_GENRES if genre is None else normalize_title(genre) or None
+            rows = (self.get_totals_collection()
+                    .find({"genre": genre})
+                    .sort([("requests", DESCENDING), ("title", ASCENDING)])
+                    .limit(limit))
+            return [self._song_row(row["title"], row) for row in rows]
+        
+        pipeline = [
+            {"$match": self._bucket_match(since, until, genre)},
+            # Newest bucket first, so $first picks the latest spelling
+            {"$sort": {"bucket": -1}},
+            {"$group": {
+                "_id": "$title",
+                "song_name": {"$first": "$song_name"},
+                "requests": {"$sum": "$requests"},
+                "accepted": {"$sum": "$accepted"},
+            }},
+            {"$sort": {"requests": -1, "_id": 1}},
+            {"$limit": limit},
+        ]
+        return [self._song_row(row["_id"], row) for row in self.get_rollup_collection().aggregate(pipeline)]
+    
+    @staticmethod
+    def _song_row(title, row):
+        return {
+            "title": title,
+            "song_name": row["song_name"],
+            "requests": row["requests"],
+            "accepted": row["accepted"],
+            "acceptance_rate": row["accepted"] / row["requests"] if row["requests"] else 0.0,
+        }
+    
+    def genre_stats(self, since=None, until=None) -> List[Dict[str, Any]]:
+        """
+        Get request counts and acceptance rates per genre.
+        
+        Args:
+            since (datetime, optional): Only count requests at or after this time
+            until (datetime, optional): Only count requests before this time
+            
+        Returns:
+            list: Dictionaries with genre, requests, accepted and acceptance_rate,
+                most requested first (genre is None for requests without one)
+        """
+        pipeline = [
+            {"$match": self._bucket_match(since, until)},
+            {"$group": {
+                "_id": "$genre",
+                "requests": {"$sum": "$requests"},
+                "accepted": {"$sum": "$accepted"},
+            }},
+            {"$sort": {"requests": -1}},
+        ]
+        return [
+            {
+                "genre": row["_id"],
+                "requests": row["requests"],
+                "accepted": row["accepted"],
+                "acceptance_rate": row["accepted"] / row["requests"] if row["requests"] else 0.0,
+            }
+            for row in self.get_rollup_collection().aggregate(pipeline)
+        ]
+    
+    def song_trend(self, song_name=None, genre=None, since=None, until=None) -> List[Dict[str, Any]]:
+        """
+        Get request counts per time bucket, for one song, one genre or everything.
+        
+        Args:
+            song_name (str, optional): Only count requests for this song
+            genre (str, optional): Only count requests in this genre
+            since (datetime, optional): Only count requests at or after this time
+            until (datetime, optional): Only count requests before this time
+            
+        Returns:
+            list: Dictionaries with bucket, requests and accepted, oldest bucket first
+        """
+        pipeline = [
+            {"$match": self._bucket_match(since, until, genre, song_name)},
+            {"$group": {
+                "_id": "$bucket",
+                "requests": {"$sum": "$requests"},
+                "accepted": {"$sum": "$accepted"},
+            }},
+            {"$sort": {"_id": 1}},
+        ]
+        return [
+            {"bucket": row["_id"], "requests": row["requests"], "accepted": row["accepted"]}
+            for row in self.get_rollup_collection().aggregate(pipeline)
+        ]
+    
     def close_connection(self):
         """
-        Close the MongoDB connection.
+        Close the MongoDB connection. The handler reconnects on next use.
         """
-        if self.client:
-            self.client.close()
-            logger.info("MongoDB connection closed")
+        with self._lock:
+            if self.client and self._owns_client:
+                self.client.close()
+                self.client = None
+                logger.info("MongoDB connection closed")
+            self.db = None
+            self.collection = None
+            self.rollups = None
+            self.totals = None
+
+
+# The process-wide handler shared by every song picker
+_handler = None
+_handler_lock = threading.Lock()
+
+
+def get_mongo_handler():
+    """
+    Get the process-wide MongoDBHandler. Its connection is closed at interpreter exit.
+    
+    Returns:
+        MongoDBHandler: The shared MongoDB handler
+    """
+    global _handler
+    with _handler_lock:
+        if _handler is None:
+            _handler = MongoDBHandler()
+            atexit.register(_handler.close_connection)
+        return _handler
+
+
+def set_mongo_handler(handler):
+    """
+    Replace the process-wide MongoDBHandler, e.g. with one around a mongomock client.
+    Must be called before the song writer is first used.
+    
+    Args:
+        handler (MongoDBHandler): The handler to share from now on
+    """
+    global _handler
+    with _handler_lock:
+        _handler = handler
 
 
 # Example usage
 if __name__ == "__main__":
     try:
-        # Initialize the MongoDB handler
-        mongo_handler = MongoDBHandler()
+        # Get the shared MongoDB handler
+        mongo_handler = get_mongo_handler()
         
         # Example song data
         example_song_data = {
@@ -103,6 +568,11 @@ if __name__ == "__main__":
         success = mongo_handler.insert_song_data(example_song_data)
         print(f"Insertion successful: {success}")
         
+        # Most requested songs in the last day
+        since = datetime.now(timezone.utc) - timedelta(days=1)
+        for song in mongo_handler.top_songs(limit=5, since=since):
+            print(f"{song['requests']:>5}  {song['song_name']} ({song['acceptance_rate']:.0%} accepted)")
+        
         # Close the connection
         mongo_handler.close_connection()
         print("MongoDB connection closed.")
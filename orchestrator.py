@@ -0,0 +1,522 @@
+import os
+import time
+import random
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from STT import record_audio, transcribe_audio_bytes, transcribe_audio_with_elevenlabs
+from TTS import synthesize_speech, play_speech
+from audio_engine import get_audio_engine
+from dialog import DialogEngine, LISTEN_FAILED
+from duplex import DuplexListener
+from status import State, Status
+from tracing import bind, turn
+
+
+class JukeboxOrchestrator:
+    """
+    An asyncio conversation loop for the jukebox.
+    Capture, transcription, LLM calls, TTS synthesis, playback and database writes
+    run as tasks with timeouts and cancellation. The blocking SDK calls run in a
+    thread pool, so stages that do not depend on each other overlap: the next joke
+    is written and synthesized while the kiosk is listening. With a DuplexListener
+    the microphone stays open during playback, so the user can talk over a prompt
+    and the next turn starts at once.
+
+    The orchestrator reuses the components and prompts of a JukeboxJokeTeller,
+    re-expresses listen_once as a coroutine and drives the DialogEngine dialogs
+    with awaitable audio I/O.
+    """
+
+    def __init__(self, jukebox=None, max_workers=8, executor=None, components=None, local_audio=True):
+        """
+        Initialize the JukeboxOrchestrator.
+
+        Args:
+            jukebox (JukeboxJokeTeller, optional): The jukebox whose components and prompts are used
+            max_workers (int): Number of threads for blocking SDK calls
+            executor (ThreadPoolExecutor, optional): Shared thread pool to use instead of a new one
+            components (object, optional): Provides static_msgs, song_picker, custom_song_picker,
+                conversation, confirmation and optionally dialogs instead of the jukebox, e.g. a JukeboxServer
+            local_audio (bool): Whether audio plays and is captured on this machine. Without it
+                there is no audio engine and no barge-in listener.
+        """
+        source = components if components is not None else jukebox
+        self.jukebox = jukebox
+        self.session_id = None  # A local jukebox is a single session
+        self.status = jukebox.status if jukebox is not None else Status()
+        self.static_msgs = source.static_msgs
+        self.song_picker = source.song_picker
+        self.custom_song_picker = source.custom_song_picker
+        self.conversation = source.conversation
+        self.confirmation = source.confirmation
+        self.dialogs = getattr(source, "dialogs", None) or DialogEngine(
+            self.song_picker, self.custom_song_picker, self.confirmation)
+        self.audio_engine = get_audio_engine() if local_audio else None
+        self._owns_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="jukebox-io")
+
+        # Per-stage timeouts in seconds
+        self.stt_timeout = float(os.getenv("JUKEBOX_STT_TIMEOUT", "30"))
+        self.llm_timeout = float(os.getenv("JUKEBOX_LLM_TIMEOUT", "30"))
+        self.tts_timeout = float(os.getenv("JUKEBOX_TTS_TIMEOUT", "30"))
+
+        self._background = set()
+        self._next_joke = None
+
+        # Keep the microphone open during playback so the user can talk over prompts
+        self.duplex = None
+        if local_audio and os.getenv("JUKEBOX_BARGE_IN", "1") == "1":
+            try:
+                self.duplex = DuplexListener(self.audio_engine)
+                self.duplex.start()
+            except Exception as e:
+                print(f"Barge-in disabled: {e}")
+                self.duplex = None
+
+    def barged_in(self):
+        """
+        Check whether the user has started talking over the jukebox.
+        Prompts and speech are skipped until their utterance has been listened to.
+
+        Returns:
+            bool: True if a barge-in utterance is waiting, False otherwise
+        """
+        return self.duplex is not None and self.duplex.barge_in.is_set()
+
+    async def run_blocking(self, func, *args, timeout=None, **kwargs):
+        """
+        Run a blocking call in the thread pool.
+
+        Args:
+            func (callable): The blocking function
+            *args: Positional arguments for the function
+            timeout (float, optional): Maximum number of seconds to wait for the result
+            **kwargs: Keyword arguments for the function
+
+        Returns:
+            The function's return value
+
+        Raises:
+            asyncio.TimeoutError: If the call takes longer than the timeout
+        """
+        loop = asyncio.get_running_loop()
+        # The call runs in this turn's trace context, so its spans are attributed to the turn
+        future = loop.run_in_executor(self.executor, bind(func, *args, **kwargs))
+        return await asyncio.wait_for(future, timeout)
+
+    def spawn(self, coro):
+        """
+        Run a coroutine in the background, keeping a reference until it finishes.
+
+        Args:
+            coro (coroutine): The coroutine to run
+
+        Returns:
+            asyncio.Task: The background task
+        """
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    async def wait_playback(self, handle):
+        """
+        Wait for a PlaybackHandle without holding a thread. Cancelling the wait stops the audio.
+
+        Args:
+            handle (PlaybackHandle): The handle to wait for, or None
+        """
+        if handle is None:
+            return
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+
+        def resolve(_handle):
+            loop.call_soon_threadsafe(lambda: finished.done() or finished.set_result(None))
+
+        handle.add_done_callback(resolve)
+        try:
+            await finished
+        except asyncio.CancelledError:
+            self.audio_engine.stop(handle.channel)
+            raise
+
+    async def play_message(self, message_id):
+        """
+        Play a static message and wait for it to finish.
+
+        Args:
+            message_id (str): Unique identifier for the message
+        """
+        if self.barged_in():
+            return
+        await self.wait_playback(self.static_msgs.play_static_message(message_id, block=False))
+
+    async def synthesize(self, text):
+        """
+        Synthesize speech in the thread pool.
+
+        Args:
+            text (str): The text to convert to speech
+
+        Returns:
+            np.ndarray: The speech samples, or None if TTS failed or timed out
+        """
+        try:
+            return await self.run_blocking(synthesize_speech, text, timeout=self.tts_timeout)
+        except Exception as e:
+            print(f"Error in TTS: {e}")
+            return None
+
+    async def speak(self, text, samples=None):
+        """
+        Speak a text and wait for it to finish.
+
+        Args:
+            text (str): The text to speak
+            samples (np.ndarray, optional): Speech synthesized ahead of time for the text
+        """
+        if self.barged_in():
+            return
+        if samples is None:
+            samples = await self.synthesize(text)
+        if samples is not None:
+            await self.wait_playback(play_speech(samples, block=False))
+
+    async def listen(self, record_seconds=5, filename="recorded_audio.wav", on_partial=None, failed=""):
+        """
+        Record from the microphone and transcribe the recording.
+
+        Args:
+            record_seconds (float): Length of the recording
+            filename (str): Path the recording is written to
+            on_partial (callable, optional): Called from the thread pool with partial
+                transcripts while the user is still talking (needs the DuplexListener)
+            failed (optional): Returned if capture or transcription failed, e.g. LISTEN_FAILED
+
+        Returns:
+            str: The transcribed text, or `failed` if capture or transcription failed
+        """
+        if self.duplex is not None:
+            return await self.listen_duplex(record_seconds, on_partial, failed)
+        try:
+            # Capture cannot be interrupted, so allow it its full length plus a margin
+            audio_filename = await self.run_blocking(record_audio, filename=filename,
+                                                     record_seconds=record_seconds,
+                                                     timeout=record_seconds + 5)
+            transcription = await self.run_blocking(transcribe_audio_with_elevenlabs, audio_filename,
+                                                    timeout=self.stt_timeout)
+            return transcription.text.strip()
+        except asyncio.TimeoutError:
+            print("Listening timed out")
+        except Exception as e:
+            print(f"Error in listening: {e}")
+        return failed
+
+    async def listen_duplex(self, wait_seconds=5, on_partial=None, failed=""):
+        """
+        Take the next utterance from the always-open microphone. It may already have been
+        captured by a barge-in; otherwise wait for the user to start talking.
+
+        Args:
+            wait_seconds (float): How long to wait for speech to start
+            on_partial (callable, optional): Called from the thread pool with the transcript
+                of the utterance so far whenever the user pauses
+            failed (optional): Returned if capture or transcription failed, e.g. LISTEN_FAILED
+
+        Returns:
+            str: The transcribed text, an empty string if nobody spoke, or `failed` if
+                capture or transcription failed
+        """
+        listening = [True]
+        # Partials arrive on the capture thread; transcribe them in this turn's trace context
+        context = contextvars.copy_context()
+
+        def transcribe_partial(audio):
+            try:
+                text = transcribe_audio_bytes(audio).text.strip()
+            except Exception as e:
+                print(f"Error transcribing partial utterance: {e}")
+                return
+            # A partial that lands after the final transcript is of no use
+            if text and listening[0]:
+                print(f"Partial: {text}")
+                on_partial(text)
+
+        def hand_off_partial(audio):
+            self.executor.submit(context.copy().run, transcribe_partial, audio)
+
+        try:
+            audio = await self.run_blocking(self.duplex.utterance, wait_seconds,
+                                            hand_off_partial if on_partial is not None else None,
+                                            timeout=wait_seconds + self.duplex.max_utterance_seconds + 5)
+            if audio is None:
+                return ""
+            transcription = await self.run_blocking(transcribe_audio_bytes, audio, timeout=self.stt_timeout)
+            return transcription.text.strip()
+        except asyncio.TimeoutError:
+            print("Listening timed out")
+        except Exception as e:
+            print(f"Error in listening: {e}")
+        finally:
+            listening[0] = False
+        return failed
+
+    async def ask_llm(self, func, *args, fallback=None):
+        """
+        Run one of the blocking LLM helpers with the LLM timeout.
+
+        Args:
+            func (callable): The helper, e.g. SongPicker.evaluate_song
+            *args: Arguments for the helper
+            fallback: Value returned if the call times out
+
+        Returns:
+            The helper's return value, or the fallback
+        """
+        try:
+            return await self.run_blocking(func, *args, timeout=self.llm_timeout)
+        except asyncio.TimeoutError:
+            print(f"LLM call {func.__name__} timed out")
+            return fallback
+
+    async def perform(self, action):
+        """
+        Carry out one dialog action. See DialogEngine and SessionDialogs.
+
+        Args:
+            action (dict): The action
+
+        Returns:
+            The user's answer for listen and collect_details actions, None otherwise
+        """
+        kind = action["type"]
+        if kind == "message":
+            await self.play_message(action["id"])
+        elif kind == "say":
+            await self.speak(action["text"])
+        elif kind == "listen":
+            on_partial = None
+            if action.get("partials") == "song":
+                on_partial = lambda partial: self.song_picker.speculate(partial, self.session_id)
+            # Dialogs answer a failed recording differently from silence
+            return await self.listen(action["seconds"], action["filename"], on_partial, failed=LISTEN_FAILED)
+        elif kind == "collect_details":
+            return await self.collect_custom_details()
+        elif kind == "play_song":
+            await self.start_song(action["title"])
+        elif kind == "custom_song":
+            await self.start_custom_song(action["details"])
+        return None
+
+    async def run_dialog(self, flow):
+        """
+        Run one of the DialogEngine dialogs to the end. Each step runs in the thread pool;
+        a step that times out leaves the dialog where it was and asks again.
+
+        Args:
+            flow (str): "song" or "custom"
+
+        Returns:
+            tuple: (result, choice), or (None, None) if the selection was cancelled
+        """
+        state, actions = self.dialogs.start(flow, session_id=self.session_id)
+        while True:
+            for action in actions:
+                answer = await self.perform(action)
+                if action["type"] in ("listen", "collect_details"):
+                    retry, user_input = action, answer
+            if state["done"]:
+                return state["outcome"]["result"], state["outcome"]["choice"]
+            try:
+                state, actions = await self.run_blocking(self.dialogs.step, state, user_input,
+                                                         timeout=self.llm_timeout)
+            except asyncio.TimeoutError:
+                print(f"The {flow} dialog timed out")
+                actions = [{"type": "message", "id": "try_again"}, retry]
+
+    async def pick_song(self):
+        """
+        Run the song picking dialog. See SongPicker.pick_song.
+
+        Returns:
+            tuple: (result, song_choice), or (None, None) if the selection was cancelled
+        """
+        return await self.run_dialog("song")
+
+    async def collect_custom_details(self):
+        """
+        Collect the custom song details with the picker's intake.
+
+        Returns:
+            dict: The song details, or None if the user quit or stayed silent
+        """
+        picker = self.custom_song_picker
+        collect = picker.collect_song_details_single if picker.intake_mode == "single" else picker.collect_song_details
+        # The intake pipelines its own recordings and transcriptions, so it gets the microphone to itself
+        if self.duplex is not None:
+            self.duplex.pause()
+        try:
+            return await self.run_blocking(collect)
+        finally:
+            if self.duplex is not None:
+                self.duplex.resume()
+
+    async def start_song(self, song_choice):
+        """
+        Start a confirmed song.
+
+        Args:
+            song_choice (str): The confirmed song
+        """
+        self.jukebox.song_player.play_song_async(song_choice)
+
+    async def start_custom_song(self, song_details):
+        """
+        Start generating a confirmed custom song.
+
+        Args:
+            song_details (dict): The confirmed song details
+        """
+        self.jukebox.custom_jobs.submit(song_details)
+
+    async def pick_custom_song(self):
+        """
+        Run the custom song dialog. See CustomSongPicker.pick_song.
+
+        Returns:
+            tuple: (result, song_details), or (None, None) if the selection was cancelled
+        """
+        return await self.run_dialog("custom")
+
+    async def listen_once(self):
+        """
+        Listen for user input once and run the dialog it asks for. See JukeboxJokeTeller.listen_once.
+
+        Returns:
+            bool: True if user input was processed, False otherwise
+        """
+        print("Listening for user input...")
+        self.status.transition(State.LISTENING, expected=State.IDLE)
+        try:
+            user_input = await self.listen()
+        finally:
+            self.status.transition(State.IDLE, expected=State.LISTENING)
+        if not user_input:
+            return False
+
+        print(f"User said: {user_input}")
+        validation = await self.ask_llm(self.conversation.validate_user_request, user_input,
+                                        fallback={"relevant": False, "type": "none", "confidence": "low"})
+        print(f"Validation result: {validation}")
+
+        if validation["relevant"] and validation["confidence"] in ["high", "medium"]:
+            if validation["type"] == "play":
+                await self.play_message("pick_song")
+                result, song_choice = await self.pick_song()
+                if result is None and song_choice is None:
+                    print("Song selection was cancelled.")
+                    await self.play_message("song_selection_cancelled")
+                else:
+                    print("Song selected and confirmed!")
+                    await self.play_message("song_selected_confirmed")
+                    await self.start_song(song_choice)
+            elif validation["type"] == "custom":
+                await self.play_message("create_custom_song")
+                result, song_details = await self.pick_custom_song()
+                if result is None and song_details is None:
+                    print("Song selection was cancelled.")
+                    await self.play_message("custom_song_selection_cancelled")
+                else:
+                    print("Custom song selected and confirmed!")
+                    await self.play_message("custom_song_selected_confirmed")
+                    await self.start_custom_song(song_details)
+        return True
+
+    async def prepare_joke(self):
+        """
+        Write a joke and synthesize it, so it can play as soon as it is needed.
+
+        Returns:
+            tuple: (joke, samples) where samples is None if TTS failed
+        """
+        start = time.perf_counter()
+        joke = await self.ask_llm(self.conversation.tell_joke, fallback="My joke writer timed out. Relatable.")
+        samples = await self.synthesize(joke)
+        print(f"Prepared next joke in {time.perf_counter() - start:.1f} s")
+        return joke, samples
+
+    async def wait_for_songs(self):
+        """
+        Wait until the song queue has played out, stopping it if it overruns badly.
+        """
+        remaining = self.jukebox.song_player.remaining_seconds()
+        print(f"Song is currently playing. Waiting about {remaining:.0f}s for it to finish...")
+        # Passed positionally: run_blocking's own timeout keyword would swallow it
+        finished = await self.run_blocking(self.status.wait_until, State.IDLE,
+                                           remaining + self.jukebox.song_overrun_grace)
+        if not finished and remaining > 0 and self.status.state == State.PLAYING:
+            print("Song playback overran its catalogued length, stopping it.")
+            self.jukebox.song_player.stop()
+
+    async def run(self):
+        """
+        Main loop: listen, tell jokes and make offers, overlapping the stages where possible.
+        """
+        print("Jukebox Joke Teller started (async)! Enjoy the humor...")
+        await self.wait_playback(self.jukebox.welcome(block=False))
+        await self.wait_playback(self.jukebox.offer(block=False))
+
+        try:
+            while True:
+                try:
+                    for job in self.jukebox.custom_jobs.play_ready():
+                        print(f"Custom song '{job.song_name}' is ready!")
+
+                    if self.status.is_song_active():
+                        await self.wait_for_songs()
+                        continue
+
+                    with turn():
+                        # Write and synthesize the next joke while listening
+                        if self._next_joke is None:
+                            self._next_joke = self.spawn(self.prepare_joke())
+
+                        if await self.listen_once():
+                            continue
+
+                        joke, samples = await self._next_joke
+                        self._next_joke = None
+                        print(f"Joke: {joke}")
+                        await self.speak(joke, samples)
+
+                        self.jukebox.joke_count += 1
+                        if self.jukebox.joke_count % self.jukebox.offer_frequency == 0:
+                            await asyncio.sleep(self.jukebox.offer_gap)
+                            await self.wait_playback(self.jukebox.offer(block=False))
+
+                    await asyncio.sleep(random.uniform(*self.jukebox.turn_gap))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"Error in main loop: {e}")
+                    self._next_joke = None
+                    await self.play_message("try_again")
+                    await asyncio.sleep(5)
+        finally:
+            if self.song_picker.speculator is not None:
+                print(f"Speculative evaluation: {self.song_picker.speculator.metrics()}")
+            await self.shutdown()
+
+    async def shutdown(self):
+        """
+        Cancel background tasks and release the thread pool.
+        """
+        for task in list(self._background):
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+        if self.duplex is not None:
+            self.duplex.close()
+        if self._owns_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
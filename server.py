@@ -0,0 +1,438 @@
+import os
+import time
+import uuid
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from aiohttp import web, WSMsgType
+from startup import load_environment
+from LLM import LLMClient
+from STT import transcribe_audio_bytes
+from TTS import TTS_SAMPLE_RATE
+from json_parser import JSONResponseParser
+from conversation import Conversation
+from static_messages import StaticMessages
+from songpicker import SongPicker
+from custom_songpicker import CustomSongPicker, INTAKE_FIELDS
+from confirmation import Confirmation
+from custom_song_jobs import CustomSongJobManager
+from orchestrator import JukeboxOrchestrator
+from dialog import DialogEngine, SessionDialogs
+from session_store import get_session_store
+from status import Status
+from speech_client import SpeechClient, get_speech_client, set_speech_client
+from tracing import turn
+from metrics import REGISTRY, CONTENT_TYPE, gauge, histogram
+
+# Load environment variables
+load_environment()
+
+# Extra seconds the session waits past a turn's deadline, so a turn that made its deadline can still save
+TURN_SAVE_GRACE_SECONDS = 2.0
+
+TURN_SECONDS = histogram("jukebox_turn_seconds", "Time from receiving an utterance to sending the first reply audio")
+ACTIVE_SESSIONS = gauge("jukebox_active_sessions", "Terminals currently connected")
+
+
+class RemoteSession(JukeboxOrchestrator):
+    """
+    One terminal connected to the JukeboxServer over a WebSocket.
+    The session only does the audio I/O: utterances arrive from the terminal and
+    prompts, speech and song choices are sent back to it. Each turn runs in the
+    thread pool through the server's SessionDialogs, which keeps the dialog state
+    in the session store, so no turn depends on the thread that ran the previous one.
+    The LLM, STT and TTS clients, the static clips and the thread pool are shared.
+
+    Protocol (server -> terminal):
+        {"type": "audio", "sample_rate", "channels", "label"} followed by one binary
+            frame of int16 PCM
+        {"type": "listen"} when the terminal should record the next utterance
+        {"type": "play_song", "title", "path"} once a song is confirmed
+        {"type": "custom_song_queued", "job_id"} and later
+            {"type": "custom_song_ready", "job_id", "url"} for custom songs
+    Protocol (terminal -> server):
+        A binary frame with one WAV-encoded utterance, or {"type": "text", "text"}
+        {"type": "stop"} to end the session
+    """
+
+    def __init__(self, server, ws):
+        """
+        Initialize the RemoteSession. Shared components come from the server.
+
+        Args:
+            server (JukeboxServer): The server the session belongs to
+            ws (web.WebSocketResponse): The terminal's WebSocket
+        """
+        # Audio plays and is captured on the terminal, so there is no local audio engine
+        super().__init__(executor=server.executor, components=server, local_audio=False)
+        self.server = server
+        self.ws = ws
+        self.session_id = uuid.uuid4().hex
+
+        self.stt_timeout = server.stt_timeout
+        self.llm_timeout = server.llm_timeout
+        self.tts_timeout = server.tts_timeout
+        self.listen_timeout = server.listen_timeout
+
+        self._utterances = asyncio.Queue()
+        self._turn_started = None
+
+    def receive_utterance(self, kind, payload):
+        """
+        Hand an utterance from the terminal to the dialog.
+
+        Args:
+            kind (str): "audio" for WAV bytes or "text" for an already transcribed utterance
+            payload (bytes or str): The utterance
+        """
+        self._turn_started = time.perf_counter()
+        self._utterances.put_nowait((kind, payload))
+
+    async def send_audio(self, samples, sample_rate, label):
+        """
+        Send PCM audio to the terminal.
+
+        Args:
+            samples (np.ndarray): int16 samples, mono or shaped (frames, channels)
+            sample_rate (int): Sample rate of the samples in Hz
+            label (str): Message ID or text of the audio, for the terminal's log
+        """
+        channels = samples.shape[1] if samples.ndim == 2 else 1
+        await self.ws.send_json({"type": "audio", "sample_rate": sample_rate,
+                                 "channels": channels, "label": label})
+        await self.ws.send_bytes(np.ascontiguousarray(samples, dtype=np.int16).tobytes())
+        if self._turn_started is not None:
+            # A turn ends when the first audio answering the utterance goes out
+            self.server.record_turn(time.perf_counter() - self._turn_started)
+            self._turn_started = None
+
+    async def play_message(self, message_id):
+        clip = self.static_msgs.audio_bank.get(message_id)
+        if clip is None:
+            print(f"Static message '{message_id}' not found")
+            return
+        await self.send_audio(clip.samples, clip.sample_rate, message_id)
+
+    async def speak(self, text, samples=None):
+        if samples is None:
+            samples = await self.synthesize(text)
+        if samples is not None:
+            await self.send_audio(samples, TTS_SAMPLE_RATE, text)
+
+    async def next_utterance(self):
+        """
+        Ask the terminal to record and wait for what it sends back.
+
+        Returns:
+            tuple: (kind, payload), or None if nothing arrived within the listen timeout
+        """
+        await self.ws.send_json({"type": "listen"})
+        try:
+            return await asyncio.wait_for(self._utterances.get(), self.listen_timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def transcribe(self, utterance, failed=""):
+        """
+        Turn an utterance into text.
+
+        Args:
+            utterance (tuple): (kind, payload) from next_utterance(), or None
+            failed (optional): Returned if transcription failed, e.g. LISTEN_FAILED
+
+        Returns:
+            str: The text, an empty string if there was nothing to transcribe, or `failed`
+                if transcription failed
+        """
+        if utterance is None:
+            return ""
+        kind, payload = utterance
+        if kind == "text":
+            return payload.strip()
+        try:
+            transcription = await self.run_blocking(transcribe_audio_bytes, payload, timeout=self.stt_timeout)
+            return transcription.text.strip()
+        except asyncio.TimeoutError:
+            print("Transcription timed out")
+        except Exception as e:
+            print(f"Error transcribing utterance: {e}")
+        return failed
+
+    async def listen(self, record_seconds=5, filename=None, on_partial=None, failed=""):
+        return await self.transcribe(await self.next_utterance(), failed)
+
+    async def collect_custom_details(self):
+        """
+        Ask the custom song questions, transcribing each answer while the next question is asked.
+
+        Returns:
+            dict: The song details, or None if the user quit or stayed silent
+        """
+        await self.play_message("custom_song_prompt")
+        pending = []
+        for field in INTAKE_FIELDS:
+            await self.play_message(field["prompt"])
+            pending.append(self.spawn(self.transcribe(await self.next_utterance())))
+
+        song_details = {}
+        for field, task in zip(INTAKE_FIELDS, pending):
+            answer = await task
+            print(f"{field['label']}: {answer}")
+            if answer.lower() == 'quit':
+                await self.play_message("giving_up")
+                await self.play_message("try_again")
+                return None
+            if field["required"] and not answer:
+                await self.play_message("silence_not_song")
+                await self.play_message("try_again")
+                return None
+            song_details[field["key"]] = answer
+        return song_details
+
+    async def start_song(self, song_choice):
+        match = self.song_picker.library.best_match(song_choice)
+        path = match[0].path if match else None
+        await self.ws.send_json({"type": "play_song", "title": song_choice, "path": path})
+
+    async def start_custom_song(self, song_details):
+        job = self.server.custom_jobs.submit(song_details)
+        self.server.job_owners[job.job_id] = self
+        await self.ws.send_json({"type": "custom_song_queued", "job_id": job.job_id})
+
+    async def perform(self, action):
+        if action["type"] == "joke":
+            joke, samples = await self._next_joke
+            self._next_joke = None
+            await self.speak(joke, samples)
+            return None
+        return await super().perform(action)
+
+    async def run(self):
+        """
+        Session loop: carry out the actions of each turn and hand the answer to the next turn.
+        Staying quiet is an empty answer, which the turn answers with a joke.
+        """
+        session_dialogs = self.server.session_dialogs
+        try:
+            actions = await self.run_blocking(session_dialogs.begin, self.session_id)
+            while True:
+                try:
+                    # Write and synthesize the next joke while waiting for the terminal
+                    if self._next_joke is None:
+                        self._next_joke = self.spawn(self.prepare_joke())
+
+                    with turn(self.session_id):
+                        user_input = None
+                        for action in actions:
+                            answer = await self.perform(action)
+                            if action["type"] in ("listen", "collect_details"):
+                                user_input = answer
+                        # A turn still running when we give up is dropped at its deadline rather
+                        # than saved, so it cannot overwrite the state of the turn that follows
+                        deadline = time.monotonic() + self.llm_timeout
+                        actions = await self.run_blocking(session_dialogs.turn, self.session_id, user_input,
+                                                          deadline=deadline,
+                                                          timeout=self.llm_timeout + TURN_SAVE_GRACE_SECONDS)
+                except asyncio.CancelledError:
+                    raise
+                except ConnectionResetError:
+                    return
+                except Exception as e:
+                    print(f"Error in session {self.session_id[:8]}: {e}")
+                    self._next_joke = None
+                    actions = [{"type": "message", "id": "try_again"},
+                               {"type": "listen", "seconds": 5, "filename": None}]
+        finally:
+            session_dialogs.end(self.session_id)
+            await self.shutdown()
+
+
+class JukeboxServer:
+    """
+    One backend process serving many jukebox terminals over HTTP and WebSockets.
+    Clients, caches and the thread pool are created once and shared by every session.
+    """
+
+    def __init__(self, io_threads=None):
+        """
+        Initialize the JukeboxServer and its shared components.
+
+        Args:
+            io_threads (int, optional): Threads for blocking SDK calls.
+                Defaults to JUKEBOX_SERVER_IO_THREADS (default: 32).
+        """
+        io_threads = io_threads or int(os.getenv("JUKEBOX_SERVER_IO_THREADS", "32"))
+        self.executor = ThreadPoolExecutor(
+            max_workers=io_threads,
+            thread_name_prefix="jukebox-io",
+        )
+        # Every I/O thread may be talking to the speech service at once, so size its pool to match
+        if not os.getenv("ELEVENLABS_MAX_CONNECTIONS"):
+            set_speech_client(SpeechClient(
+                max_connections=io_threads,
+                max_keepalive=max(1, io_threads // 2),
+            ))
+        self.llm_client = LLMClient()
+        self.json_parser = JSONResponseParser(self.llm_client)
+        self.conversation = Conversation(self.llm_client, self.json_parser)
+        self.static_msgs = StaticMessages()
+        self.static_msgs.preload()
+        self.song_picker = SongPicker(llm_client=self.llm_client, static_msgs=self.static_msgs)
+        self.custom_song_picker = CustomSongPicker(llm_client=self.llm_client, static_msgs=self.static_msgs)
+        self.confirmation = Confirmation(self.llm_client, self.static_msgs)
+        self.dialogs = DialogEngine(self.song_picker, self.custom_song_picker, self.confirmation)
+        self.session_store = get_session_store()
+        self.session_dialogs = SessionDialogs(self.dialogs, self.conversation, self.session_store)
+
+        # Custom songs are generated once per process and handed to the terminal that ordered them
+        self.status = Status()
+        self.custom_jobs = CustomSongJobManager(
+            self.status, None,
+            workers=int(os.getenv("CUSTOM_SONG_WORKERS", "1")),
+            deliver=self._deliver_custom_song,
+        )
+        self.job_owners = {}
+
+        self.stt_timeout = float(os.getenv("JUKEBOX_STT_TIMEOUT", "30"))
+        self.llm_timeout = float(os.getenv("JUKEBOX_LLM_TIMEOUT", "30"))
+        self.tts_timeout = float(os.getenv("JUKEBOX_TTS_TIMEOUT", "30"))
+        self.listen_timeout = float(os.getenv("JUKEBOX_SESSION_LISTEN_SECONDS", "10"))
+
+        self.sessions = {}
+        self.turns = 0
+        self.turn_latencies = deque(maxlen=10000)
+        self.started_at = time.monotonic()
+        self._loop = None
+
+    def record_turn(self, seconds):
+        """
+        Record the latency of one conversational turn.
+
+        Args:
+            seconds (float): Time from receiving an utterance to sending the first reply audio
+        """
+        self.turns += 1
+        self.turn_latencies.append(seconds)
+        TURN_SECONDS.observe(seconds)
+
+    def stats(self):
+        """
+        Get load statistics for the server process.
+
+        Returns:
+            dict: Session and turn counts, turn latency percentiles and CPU usage
+        """
+        latencies = np.array(self.turn_latencies) * 1000 if self.turn_latencies else np.zeros(1)
+        return {
+            "sessions": len(self.sessions),
+            "turns": self.turns,
+            "turn_p50_ms": float(np.percentile(latencies, 50)),
+            "turn_p95_ms": float(np.percentile(latencies, 95)),
+            "cpu_seconds": time.process_time(),
+            "wall_seconds": time.monotonic() - self.started_at,
+            "cpu_count": os.cpu_count(),
+            "custom_jobs": self.status.jobs(),
+        }
+
+    def _deliver_custom_song(self, job):
+        """
+        Tell the terminal that ordered a custom song where to fetch it. Runs on the event loop.
+
+        Args:
+            job (CustomSongJob): The finished job
+        """
+        session = self.job_owners.pop(job.job_id, None)
+        if session is None or session.ws.closed:
+            print(f"Custom song '{job.song_name}' is ready but its terminal is gone")
+            return
+        session.spawn(session.ws.send_json({
+            "type": "custom_song_ready",
+            "job_id": job.job_id,
+            "url": f"/custom_songs/{job.job_id}",
+        }))
+
+    def _on_job_update(self, job, _status):
+        """
+        Deliver custom songs once they are ready. Called from the generation workers.
+        """
+        if job["state"] == "ready" and self._loop is not None:
+            self._loop.call_soon_threadsafe(self.custom_jobs.play_ready)
+
+    async def handle_session(self, request):
+        """
+        Serve one terminal over a WebSocket until it disconnects.
+        """
+        ws = web.WebSocketResponse(heartbeat=30, max_msg_size=16 * 1024 * 1024)
+        await ws.prepare(request)
+        session = RemoteSession(self, ws)
+        self.sessions[session.session_id] = session
+        await ws.send_json({"type": "ready", "session_id": session.session_id})
+        dialog = asyncio.create_task(session.run())
+        print(f"Session {session.session_id[:8]} connected ({len(self.sessions)} active)")
+
+        try:
+            async for message in ws:
+                if message.type == WSMsgType.BINARY:
+                    session.receive_utterance("audio", message.data)
+                elif message.type == WSMsgType.TEXT:
+                    data = message.json()
+                    if data.get("type") == "text":
+                        session.receive_utterance("text", data.get("text", ""))
+                    elif data.get("type") == "stop":
+                        break
+                elif message.type == WSMsgType.ERROR:
+                    break
+        finally:
+            dialog.cancel()
+            await asyncio.gather(dialog, return_exceptions=True)
+            del self.sessions[session.session_id]
+            print(f"Session {session.session_id[:8]} disconnected ({len(self.sessions)} active)")
+        return ws
+
+    async def handle_stats(self, request):
+        return web.json_response(self.stats())
+
+    async def handle_metrics(self, request):
+        ACTIVE_SESSIONS.set(len(self.sessions))
+        return web.Response(body=REGISTRY.expose().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+    async def handle_custom_song(self, request):
+        job = self.custom_jobs.store.get(request.match_info["job_id"])
+        if job is None or not job.audio_path or not os.path.exists(job.audio_path):
+            raise web.HTTPNotFound()
+        return web.FileResponse(job.audio_path)
+
+    async def _on_startup(self, app):
+        self._loop = asyncio.get_running_loop()
+        self.status.subscribe_jobs(self._on_job_update)
+        # Songs finished while the server was down have lost their terminal; clear them out
+        self.custom_jobs.play_ready()
+        # Open connections to the speech service before the first terminal connects
+        self._loop.run_in_executor(
+            self.executor, get_speech_client().preconnect, int(os.getenv("ELEVENLABS_WARM_CONNECTIONS", "4"))
+        )
+
+    def make_app(self):
+        """
+        Build the aiohttp application.
+
+        Returns:
+            web.Application: The application with the session, stats, metrics and custom song routes
+        """
+        app = web.Application()
+        app.router.add_get("/session", self.handle_session)
+        app.router.add_get("/stats", self.handle_stats)
+        app.router.add_get("/metrics", self.handle_metrics)
+        app.router.add_get("/custom_songs/{job_id}", self.handle_custom_song)
+        app.on_startup.append(self._on_startup)
+        return app
+
+
+if __name__ == "__main__":
+    server = JukeboxServer()
+    web.run_app(
+        server.make_app(),
+        host=os.getenv("JUKEBOX_SERVER_HOST", "0.0.0.0"),
+        port=int(os.getenv("JUKEBOX_SERVER_PORT", "8080")),
+    )
@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+class StaleSessionError(Exception):
+    """
+    Raised when a session state is saved over a newer version written by another worker.
+    """
+
+
+class SessionStore:
+    """
+    Base class for session stores. A store keeps one JSON-serializable state dict per
+    session, so whichever worker handles the next turn can load it.
+
+    Every stored state carries a "version". put() only succeeds if the state's version
+    is still the stored one, so two workers can never both advance the same session.
+    """
+
+    def get(self, session_id):
+        """
+        Load a session's state.
+
+        Args:
+            session_id (str): Identifier of the session
+
+        Returns:
+            dict: The state, or None if the session does not exist
+        """
+        raise NotImplementedError
+
+    def put(self, session_id, state):
+        """
+        Save a session's state and bump its version.
+
+        Args:
+            session_id (str): Identifier of the session
+            state (dict): The state, as returned by get() (or without a version for a new session)
+
+        Returns:
+            int: The new version, also written to state["version"]
+
+        Raises:
+            StaleSessionError: If the session was saved by someone else since it was loaded
+        """
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        """
+        Forget a session.
+
+        Args:
+            session_id (str): Identifier of the session
+        """
+        raise NotImplementedError
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    A session store for a single process. States are kept as JSON strings, so a state
+    that would not survive a shared store fails here too.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def get(self, session_id):
+        with self._lock:
+            stored = self._sessions.get(session_id)
+        return json.loads(stored) if stored is not None else None
+
+    def put(self, session_id, state):
+        expected = state.get("version", 0)
+        with self._lock:
+            stored = self._sessions.get(session_id)
+            current = json.loads(stored)["version"] if stored is not None else 0
+            if current != expected:
+                raise StaleSessionError(f"Session {session_id} is at version {current}, not {expected}")
+            state["version"] = expected + 1
+            self._sessions[session_id] = json.dumps(state)
+        return state["version"]
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    A session store in a SQLite database, shared by every worker process on the host.
+    """
+
+    def __init__(self, db_path="jukebox_sessions.sqlite3"):
+        """
+        Initialize the SQLiteSessionStore and open (or create) its database.
+
+        Args:
+            db_path (str): Path to the SQLite database file
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute(SCHEMA)
+        self._conn.commit()
+
+    def get(self, session_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state, version FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        state = json.loads(row[0])
+        state["version"] = row[1]
+        return state
+
+    def put(self, session_id, state):
+        expected = state.get("version", 0)
+        state["version"] = expected + 1
+        data = json.dumps(state)
+        with self._lock:
+            if expected == 0:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO sessions (session_id, state, version, updated_at) VALUES (?, ?, ?, ?)",
+                    (session_id, data, state["version"], time.time()),
+                )
+            else:
+                # Compare-and-set on the version, so a concurrent writer cannot be overwritten
+                cursor = self._conn.execute(
+                    "UPDATE sessions SET state = ?, version = ?, updated_at = ? WHERE session_id = ? AND version = ?",
+                    (data, state["version"], time.time(), session_id, expected),
+                )
+            self._conn.commit()
+        if cursor.rowcount == 0:
+            state["version"] = expected
+            raise StaleSessionError(f"Session {session_id} changed since version {expected}")
+        return state["version"]
+
+    def delete(self, session_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    def purge(self, max_age):
+        """
+        Delete sessions that have not been saved for a while, e.g. after their worker died.
+
+        Args:
+            max_age (float): Age in seconds after which a session is deleted
+
+        Returns:
+            int: Number of sessions deleted
+        """
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - max_age,))
+            self._conn.commit()
+        return cursor.rowcount
+
+
+class RedisSessionStore(SessionStore):
+    """
+    A session store in Redis, shared by workers on any host. Requires the redis package.
+    """
+
+    def __init__(self, url="redis://localhost:6379/0", prefix="jukebox:session:", ttl=3600):
+        """
+        Initialize the RedisSessionStore.
+
+        Args:
+            url (str): Redis connection URL
+            prefix (str): Key prefix for session states
+            ttl (int): Seconds after the last save before an idle session expires
+        """
+        import redis
+
+        self._redis = redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, session_id):
+        stored = self.client.get(self.prefix + session_id)
+        return json.loads(stored) if stored is not None else None
+
+    def put(self, session_id, state):
+        key = self.prefix + session_id
+        expected = state.get("version", 0)
+        with self.client.pipeline() as pipe:
+            try:
+                # WATCH/MULTI turns the version check and the write into one atomic compare-and-set
+                pipe.watch(key)
+                stored = pipe.get(key)
+                current = json.loads(stored)["version"] if stored is not None else 0
+                if current != expected:
+                    raise StaleSessionError(f"Session {session_id} is at version {current}, not {expected}")
+                state["version"] = expected + 1
+                pipe.multi()
+                pipe.set(key, json.dumps(state), ex=self.ttl)
+                pipe.execute()
+            except self._redis.WatchError:
+                state["version"] = expected
+                raise StaleSessionError(f"Session {session_id} changed while it was being saved")
+        return state["version"]
+
+    def delete(self, session_id):
+        self.client.delete(self.prefix + session_id)
+
+
+def get_session_store(spec=None):
+    """
+    Create the session store named by spec.
+
+    Args:
+        spec (str, optional): "memory", "sqlite:<path>" or a redis:// URL.
+            Defaults to JUKEBOX_SESSION_STORE (default: "memory").
+
+    Returns:
+        SessionStore: The session store
+    """
+    spec = spec or os.getenv("JUKEBOX_SESSION_STORE", "memory")
+    if spec == "memory":
+        return InMemorySessionStore()
+    if spec.startswith("sqlite:"):
+        return SQLiteSessionStore(spec[len("sqlite:"):] or "jukebox_sessions.sqlite3")
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisSessionStore(spec, ttl=int(os.getenv("JUKEBOX_SESSION_TTL_SECONDS", "3600")))
+    raise ValueError(f"Unknown session store '{spec}'")
@@ -0,0 +1,282 @@
+import os
+import math
+import time
+import sqlite3
+import hashlib
+import threading
+from multiprocessing import Pool
+import numpy as np
+import soundfile as sf
+from startup import load_environment
+
+# Load environment variables
+load_environment()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    duration REAL,
+    sample_rate INTEGER,
+    channels INTEGER,
+    rms_db REAL,
+    peak_db REAL
+)
+"""
+
+# Floor used for silent tracks so the dB values stay finite
+_SILENCE_DB = -120.0
+
+
+def _to_db(amplitude):
+    """
+    Convert a linear amplitude (full scale = 1.0) to dBFS.
+
+    Args:
+        amplitude (float): Linear amplitude
+
+    Returns:
+        float: Level in dBFS
+    """
+    return 20.0 * math.log10(amplitude) if amplitude > 0 else _SILENCE_DB
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """
+    Hash the content of a file.
+
+    Args:
+        path (str): Path to the file
+        chunk_size (int): Number of bytes read at a time
+
+    Returns:
+        str: Hex digest of the file content
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def analyze_song(job):
+    """
+    Decode a song and measure its duration and loudness. Runs in a worker process.
+
+    Args:
+        job (tuple): (path, known_hash) where known_hash is the catalogued hash or None
+
+    Returns:
+        dict: The measured track row, {"path", "unchanged": True} if the content hash
+            matches known_hash, or {"path", "error"} if the file could not be decoded
+    """
+    path, known_hash = job
+    try:
+        stat_result = os.stat(path)
+        content_hash = hash_file(path)
+        if content_hash == known_hash:
+            return {"path": path, "mtime": stat_result.st_mtime, "size": stat_result.st_size,
+                    "unchanged": True}
+
+        info = sf.info(path)
+        sum_squares = 0.0
+        peak = 0.0
+        samples = 0
+        for block in sf.blocks(path, blocksize=65536, dtype="float32", always_2d=True):
+            sum_squares += float(np.square(block, dtype=np.float64).sum())
+            peak = max(peak, float(np.abs(block).max()))
+            samples += block.size
+        rms = math.sqrt(sum_squares / samples) if samples else 0.0
+
+        return {
+            "path": path,
+            "mtime": stat_result.st_mtime,
+            "size": stat_result.st_size,
+            "content_hash": content_hash,
+            "duration": info.frames / float(info.samplerate),
+            "sample_rate": info.samplerate,
+            "channels": info.channels,
+            "rms_db": _to_db(rms),
+            "peak_db": _to_db(peak),
+        }
+    except Exception as e:
+        return {"path": path, "error": str(e)}
+
+
+class SongCatalog:
+    """
+    A local SQLite index of per-track metadata (duration, sample rate, loudness, content hash).
+    The catalog is built once with a process pool and then updated incrementally:
+    files whose mtime and size are unchanged are skipped, and files whose content
+    hash is unchanged are not decoded again.
+    """
+
+    def __init__(self, db_path="song_catalog.sqlite3"):
+        """
+        Initialize the SongCatalog and open (or create) its database.
+
+        Args:
+            db_path (str): Path to the SQLite database file
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(SCHEMA)
+        self._conn.commit()
+
+    @staticmethod
+    def _key(path):
+        """
+        Build the catalog key for a path.
+
+        Args:
+            path (str): Path to a song file
+
+        Returns:
+            str: The absolute, normalized path
+        """
+        return os.path.normpath(os.path.abspath(path))
+
+    def get(self, path):
+        """
+        Get the catalogued metadata of a track.
+
+        Args:
+            path (str): Path to the song file
+
+        Returns:
+            dict: The track row, or None if the track is not catalogued
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM tracks WHERE path = ?", (self._key(path),)).fetchone()
+        return dict(row) if row else None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+
+    def update(self, paths, workers=None):
+        """
+        Bring the catalog up to date for a set of song files.
+
+        Args:
+            paths (iterable): Paths of every song in the library
+            workers (int, optional): Number of worker processes, defaults to the CPU count
+
+        Returns:
+            dict: Counts of analyzed, touched (hash unchanged), skipped, removed and failed tracks
+        """
+        start = time.perf_counter()
+        keys = {self._key(path) for path in paths}
+        with self._lock:
+            known = {row["path"]: row for row in self._conn.execute(
+                "SELECT path, mtime, size, content_hash FROM tracks")}
+
+        jobs = []
+        skipped = 0
+        for key in sorted(keys):
+            row = known.get(key)
+            try:
+                stat_result = os.stat(key)
+            except OSError:
+                continue
+            if row and row["mtime"] == stat_result.st_mtime and row["size"] == stat_result.st_size:
+                skipped += 1
+                continue
+            jobs.append((key, row["content_hash"] if row else None))
+        removed = [key for key in known if key not in keys]
+
+        counts = {"analyzed": 0, "touched": 0, "skipped": skipped, "removed": len(removed), "failed": 0}
+        results = []
+        if jobs:
+            with Pool(processes=workers) as pool:
+                results = list(pool.imap_unordered(analyze_song, jobs, chunksize=4))
+
+        with self._lock:
+            for result in results:
+                if "error" in result:
+                    counts["failed"] += 1
+                    print(f"Could not analyze {result['path']}: {result['error']}")
+                elif result.get("unchanged"):
+                    counts["touched"] += 1
+                    self._conn.execute("UPDATE tracks SET mtime = ?, size = ? WHERE path = ?",
+                                       (result["mtime"], result["size"], result["path"]))
+                else:
+                    counts["analyzed"] += 1
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO tracks (path, mtime, size, content_hash, duration, "
+                        "sample_rate, channels, rms_db, peak_db) VALUES (:path, :mtime, :size, "
+                        ":content_hash, :duration, :sample_rate, :channels, :rms_db, :peak_db)",
+                        result,
+                    )
+            self._conn.executemany("DELETE FROM tracks WHERE path = ?", [(key,) for key in removed])
+            self._conn.commit()
+
+        elapsed = time.perf_counter() - start
+        print(f"Song catalog updated in {elapsed:.1f} s: {counts['analyzed']} analyzed, "
+              f"{counts['touched']} touched, {counts['skipped']} unchanged, "
+              f"{counts['removed']} removed, {counts['failed']} failed")
+        return counts
+
+    def volume_for(self, path, target_db=-20.0):
+        """
+        Get the playback volume that brings a track to the target loudness.
+        Tracks are only ever turned down (pygame cannot amplify), and unknown
+        tracks play at full volume.
+
+        Args:
+            path (str): Path to the song file
+            target_db (float): Target RMS loudness in dBFS
+
+        Returns:
+            float: Volume between 0.0 and 1.0
+        """
+        track = self.get(path)
+        if not track or track["rms_db"] is None or track["rms_db"] <= _SILENCE_DB:
+            return 1.0
+        return max(0.0, min(1.0, 10 ** ((target_db - track["rms_db"]) / 20.0)))
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        with self._lock:
+            self._conn.close()
+
+
+# The process-wide catalog read by the song player and the main loop
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_song_catalog():
+    """
+    Get the process-wide SongCatalog stored at SONG_CATALOG_PATH.
+
+    Returns:
+        SongCatalog: The shared song catalog
+    """
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = SongCatalog(os.getenv("SONG_CATALOG_PATH", "song_catalog.sqlite3"))
+        return _catalog
+
+
+if __name__ == "__main__":
+    # Build or incrementally update the catalog for the song library
+    import argparse
+    from song_library import get_song_library
+
+    parser = argparse.ArgumentParser(description="Build the song catalog (durations and loudness).")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    os.environ.setdefault("SONG_LIBRARY_REFRESH_SECONDS", "0")
+    library = get_song_library()
+    catalog = get_song_catalog()
+    catalog.update([entry.path for entry in library.entries()], workers=args.workers)
+    print(f"{len(catalog)} tracks in {catalog.db_path}")
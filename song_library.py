@@ -0,0 +1,313 @@
+import os
+import math
+import time
+import fnmatch
+import threading
+import soundfile as sf
+from titles import normalize_title, trigrams
+
+SONG_EXTENSIONS = (".wav", ".mp3", ".ogg", ".flac")
+EXCLUDED_DIRS = {"static_audio", "custom_songs", "__pycache__", "venv", ".venv", "node_modules"}
+# Microphone recordings and custom song intake answers are never songs
+EXCLUDED_FILES = ("recorded_audio.wav", "custom_*.wav")
+# Default library root, relative to the working directory
+DEFAULT_SONG_DIR = "songs"
+
+
+class SongEntry:
+    """
+    One playable file in the song library.
+    """
+
+    def __init__(self, path, stat_result):
+        """
+        Initialize the SongEntry from a file path and its stat result.
+
+        Args:
+            path (str): Path to the song file
+            stat_result (os.stat_result): Result of os.stat() for the file
+        """
+        self.path = path
+        self.title = os.path.splitext(os.path.basename(path))[0]
+        self.normalized = normalize_title(self.title)
+        self.grams = trigrams(self.normalized)
+        self.format = os.path.splitext(path)[1].lstrip(".").lower()
+        self.size = stat_result.st_size
+        self.mtime = stat_result.st_mtime
+        self.duration = None
+        self.sample_rate = None
+        try:
+            info = sf.info(path)
+            self.duration = info.duration
+            self.sample_rate = info.samplerate
+        except Exception:
+            # Unreadable headers are still indexed; the player reports the error on load
+            pass
+
+
+class SongLibrary:
+    """
+    An in-memory index of the playable songs on disk with ranked fuzzy title lookup.
+    Titles are matched through a trigram inverted index, so a lookup only scores the
+    songs that share rare trigrams with the query instead of scanning the whole library.
+    """
+
+    def __init__(self, root=DEFAULT_SONG_DIR, extensions=SONG_EXTENSIONS, excluded_dirs=EXCLUDED_DIRS,
+                 excluded_files=EXCLUDED_FILES):
+        """
+        Initialize the SongLibrary. Call refresh() to scan the disk.
+
+        Args:
+            root (str): Directory that is scanned recursively for songs
+            extensions (tuple): File extensions treated as songs
+            excluded_dirs (set): Directory names that are never scanned
+            excluded_files (tuple): File name patterns that are never indexed, e.g. recordings
+        """
+        self.root = root
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.excluded_dirs = set(excluded_dirs)
+        self.excluded_files = tuple(excluded_files)
+        self._entries = {}
+        self._by_title = {}
+        self._postings = {}
+        self._lock = threading.RLock()
+        self._watcher = None
+        self._stop_watching = threading.Event()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def entries(self):
+        """
+        List every indexed song.
+
+        Returns:
+            list: The SongEntry objects in the index
+        """
+        with self._lock:
+            return list(self._entries.values())
+
+    def _scan(self):
+        """
+        Walk the library root and stat every song file.
+
+        Returns:
+            dict: Mapping of file path to os.stat_result
+        """
+        found = {}
+        for directory, subdirs, files in os.walk(self.root):
+            subdirs[:] = [d for d in subdirs if d not in self.excluded_dirs and not d.startswith(".")]
+            for name in files:
+                if any(fnmatch.fnmatch(name, pattern) for pattern in self.excluded_files):
+                    continue
+                if name.lower().endswith(self.extensions):
+                    path = os.path.normpath(os.path.join(directory, name))
+                    try:
+                        found[path] = os.stat(path)
+                    except OSError:
+                        continue
+        return found
+
+    def _add(self, entry):
+        """
+        Add an entry to the index. Call with the lock held.
+
+        Args:
+            entry (SongEntry): The entry to add
+        """
+        self._entries[entry.path] = entry
+        self._by_title.setdefault(entry.normalized, []).append(entry)
+        for gram in entry.grams:
+            self._postings.setdefault(gram, set()).add(entry.path)
+
+    def _remove(self, path):
+        """
+        Remove an entry from the index. Call with the lock held.
+
+        Args:
+            path (str): Path of the entry to remove
+        """
+        entry = self._entries.pop(path, None)
+        if entry is None:
+            return
+        same_title = self._by_title.get(entry.normalized, [])
+        same_title[:] = [e for e in same_title if e.path != path]
+        if not same_title:
+            self._by_title.pop(entry.normalized, None)
+        for gram in entry.grams:
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.discard(path)
+                if not posting:
+                    del self._postings[gram]
+
+    def refresh(self):
+        """
+        Bring the index up to date with the disk, touching only files that were
+        added, removed or modified since the last refresh.
+
+        Returns:
+            dict: Counts of added, updated and removed songs
+        """
+        start = time.perf_counter()
+        found = self._scan()
+        counts = {"added": 0, "updated": 0, "removed": 0}
+
+        with self._lock:
+            known = dict(self._entries)
+
+        changed = []
+        for path, stat_result in found.items():
+            entry = known.get(path)
+            if entry is None:
+                changed.append((path, stat_result))
+                counts["added"] += 1
+            elif entry.mtime != stat_result.st_mtime or entry.size != stat_result.st_size:
+                changed.append((path, stat_result))
+                counts["updated"] += 1
+        removed = [path for path in known if path not in found]
+        counts["removed"] = len(removed)
+
+        # Read headers outside the lock so lookups are never blocked on disk I/O
+        new_entries = [SongEntry(path, stat_result) for path, stat_result in changed]
+
+        with self._lock:
+            for path in removed:
+                self._remove(path)
+            for entry in new_entries:
+                self._remove(entry.path)
+                self._add(entry)
+            total = len(self._entries)
+
+        if any(counts.values()):
+            elapsed = time.perf_counter() - start
+            print(f"Song library refreshed in {elapsed * 1000:.0f} ms: {total} songs "
+                  f"({counts['added']} added, {counts['updated']} updated, {counts['removed']} removed)")
+        return counts
+
+    def lookup(self, query, limit=5, min_score=0.3):
+        """
+        Find the songs whose titles best match a query.
+
+        Args:
+            query (str): The title to search for, e.g. a transcription
+            limit (int): Maximum number of matches to return
+            min_score (float): Minimum similarity (0 to 1) for a match
+
+        Returns:
+            list: (SongEntry, score) tuples sorted from best to worst match
+        """
+        normalized = normalize_title(query)
+        if not normalized:
+            return []
+
+        with self._lock:
+            exact = self._by_title.get(normalized)
+            if exact:
+                return [(entry, 1.0) for entry in exact[:limit]]
+
+            query_grams = trigrams(normalized)
+            # A title scoring at least min_score must share this many trigrams with the query
+            needed = max(1, math.ceil(min_score * len(query_grams) / 2))
+
+            # By pigeonhole, such a title appears in at least one of the rarest
+            # (len - needed + 1) postings, so the most common trigrams are never walked
+            postings = sorted((self._postings.get(g, ()) for g in query_grams), key=len)
+            candidates = set()
+            for posting in postings[:len(postings) - needed + 1]:
+                candidates.update(posting)
+
+            matches = []
+            for path in candidates:
+                entry = self._entries[path]
+                common = len(entry.grams & query_grams)
+                score = 2.0 * common / (len(query_grams) + len(entry.grams))
+                if score >= min_score:
+                    matches.append((entry, score))
+
+        matches.sort(key=lambda match: (-match[1], match[0].title))
+        return matches[:limit]
+
+    def best_match(self, query, min_score=0.5):
+        """
+        Get the single best match for a query.
+
+        Args:
+            query (str): The title to search for
+            min_score (float): Minimum similarity (0 to 1) for a match
+
+        Returns:
+            tuple: (SongEntry, score), or None if nothing matches well enough
+        """
+        matches = self.lookup(query, limit=1, min_score=min_score)
+        return matches[0] if matches else None
+
+    def start_watching(self, interval=30.0):
+        """
+        Refresh the index in the background at a fixed interval.
+
+        Args:
+            interval (float): Seconds between refreshes
+        """
+        if self._watcher is not None:
+            return
+
+        def watch():
+            while not self._stop_watching.wait(interval):
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Error refreshing song library: {e}")
+
+        self._watcher = threading.Thread(target=watch, daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        """
+        Stop the background refresh thread.
+        """
+        self._stop_watching.set()
+
+
+# The process-wide library shared by the song player and the song pickers
+_library = None
+_library_lock = threading.Lock()
+
+
+def get_song_library():
+    """
+    Get the process-wide SongLibrary, building the index on first use.
+    The library root is SONG_LIBRARY_DIR (default: ./songs) and it is re-scanned
+    every SONG_LIBRARY_REFRESH_SECONDS (default: 30, 0 disables). The working directory
+    itself is never the default: recordings are written there.
+
+    Returns:
+        SongLibrary: The shared song library
+    """
+    global _library
+    with _library_lock:
+        if _library is None:
+            root = os.getenv("SONG_LIBRARY_DIR", DEFAULT_SONG_DIR)
+            if not os.path.isdir(root):
+                print(f"Song library directory '{root}' does not exist; the library is empty")
+            _library = SongLibrary(root)
+            _library.refresh()
+            interval = float(os.getenv("SONG_LIBRARY_REFRESH_SECONDS", "30"))
+            if interval > 0:
+                _library.start_watching(interval)
+        return _library
+
+
+if __name__ == "__main__":
+    import sys
+
+    library = get_song_library()
+    print(f"Indexed {len(library)} songs")
+    for query in sys.argv[1:]:
+        start = time.perf_counter()
+        matches = library.lookup(query)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"\n'{query}' ({elapsed:.3f} ms):")
+        for entry, score in matches:
+            print(f"  {score:.2f}  {entry.title}  [{entry.format}, {entry.size} bytes, {entry.duration} s]")
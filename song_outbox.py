@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+from bson import json_util
+
+
+class SongOutbox:
+    """
+    A durable, append-only local log of song records waiting to be replicated.
+    Records are written as JSON lines and fsynced in groups: every append waits for
+    the next fsync, and appends that arrive while an fsync is running share the next one.
+    Replicated records are acknowledged through a checkpoint file, and the log is
+    truncated once everything in it has been acknowledged.
+    """
+
+    def __init__(self, path="song_outbox.jsonl", max_in_memory=1000, compact_bytes=1 << 20):
+        """
+        Initialize the SongOutbox, recovering unacknowledged records from disk.
+
+        Args:
+            path (str): Path to the JSON lines log
+            max_in_memory (int): Maximum number of pending records kept in memory;
+                the rest stay on disk and are read back as the backlog drains
+            compact_bytes (int): Truncate the log once it is fully acknowledged and at least this large
+        """
+        self.path = path
+        self.checkpoint_path = f"{path}.ack"
+        self.max_in_memory = max_in_memory
+        self.compact_bytes = compact_bytes
+
+        self._changed = threading.Condition()
+        self._pending = deque()  # (seq, document, appended_at) not yet acknowledged
+        self._spilled = False  # True when pending records exist on disk only
+        self._closing = False
+
+        self._acked_seq, self._next_seq = self._read_checkpoint()
+        self._loaded_through = self._acked_seq
+        self._recover()
+
+        self._written_seq = self._next_seq - 1
+        self._synced_seq = self._written_seq
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._syncer = threading.Thread(target=self._sync_loop, daemon=True)
+        self._syncer.start()
+
+    def _read_checkpoint(self):
+        """
+        Read the acknowledged sequence number and the next sequence number.
+
+        Returns:
+            tuple: (acked_seq, next_seq)
+        """
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+            return checkpoint["acked"], checkpoint["next"]
+        except (OSError, ValueError, KeyError):
+            return 0, 1
+
+    def _write_checkpoint(self):
+        """
+        Atomically persist the checkpoint. Call with the lock held.
+        """
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"acked": self._acked_seq, "next": self._next_seq}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _iter_log(self, after_seq):
+        """
+        Read records from the log.
+
+        Args:
+            after_seq (int): Only records with a higher sequence number are returned
+
+        Yields:
+            tuple: (seq, document)
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json_util.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-write was never acknowledged as durable
+                    continue
+                if record["seq"] > after_seq:
+                    yield record["seq"], record["doc"]
+
+    def _recover(self):
+        """
+        Load unacknowledged records from the log after a restart.
+        """
+        now = time.monotonic()
+        for seq, document in self._iter_log(self._acked_seq):
+            self._next_seq = max(self._next_seq, seq + 1)
+            if len(self._pending) < self.max_in_memory:
+                self._pending.append((seq, document, now))
+                self._loaded_through = seq
+            else:
+                self._spilled = True
+        if self._pending or self._spilled:
+            print(f"Recovered {self.backlog()} unreplicated song records from {self.path}")
+
+    def append(self, document, durable=True):
+        """
+        Append a record to the log.
+
+        Args:
+            document (dict): The song document (must be serializable with bson.json_util)
+            durable (bool): Whether to wait until the record has been fsynced
+
+        Returns:
+            int: The record's sequence number
+        """
+        with self._changed:
+            if self._closing:
+                raise RuntimeError("Song outbox is closed")
+            seq = self._next_seq
+            self._next_seq += 1
+            self._file.write(json_util.dumps({"seq": seq, "doc": document}) + "\n")
+            self._written_seq = seq
+            if not self._spilled and len(self._pending) < self.max_in_memory:
+                self._pending.append((seq, document, time.monotonic()))
+                self._loaded_through = seq
+            else:
+                self._spilled = True
+            self._changed.notify_all()
+
+            if durable:
+                self._changed.wait_for(lambda: self._synced_seq >= seq)
+        return seq
+
+    def _sync_loop(self):
+        """
+        Syncer loop: fsync the log whenever there are unsynced writes.
+        """
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self._written_seq > self._synced_seq or self._closing)
+                if self._closing and self._written_seq <= self._synced_seq:
+                    return
+                target = self._written_seq
+                self._file.flush()
+                fd = self._file.fileno()
+
+            # fsync outside the lock so new appends can queue up for the next group
+            os.fsync(fd)
+
+            with self._changed:
+                self._synced_seq = max(self._synced_seq, target)
+                self._changed.notify_all()
+
+    def take(self, max_count, max_wait):
+        """
+        Wait for a batch of pending records without removing them.
+        Returns as soon as max_count records are pending or the oldest pending
+        record has waited max_wait seconds.
+
+        Args:
+            max_count (int): Maximum number of records to return
+            max_wait (float): Maximum age of the oldest record before a partial batch is returned
+
+        Returns:
+            list: (seq, document) tuples in log order; empty if the outbox is closing
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._pending or self._closing)
+            if self._pending:
+                deadline = self._pending[0][2] + max_wait
+                self._changed.wait_for(
+                    lambda: len(self._pending) >= max_count or self._closing,
+                    max(0.0, deadline - time.monotonic()),
+                )
+            return [(seq, document) for seq, document, _ in list(self._pending)[:max_count]]
+
+    def ack(self, seq):
+        """
+        Acknowledge every record up to and including seq as replicated.
+
+        Args:
+            seq (int): Highest replicated sequence number
+        """
+        with self._changed:
+            while self._pending and self._pending[0][0] <= seq:
+                self._pending.popleft()
+            self._acked_seq = max(self._acked_seq, seq)
+            self._write_checkpoint()
+
+            # After close() the log file is gone; spilled records are recovered on the next start
+            if self._closing:
+                pass
+            elif self._spilled and len(self._pending) < self.max_in_memory // 2:
+                self._reload_spilled()
+            elif not self._pending and not self._spilled:
+                self._compact()
+            self._changed.notify_all()
+
+    def _reload_spilled(self):
+        """
+        Read records that only exist on disk back into memory. Call with the lock held.
+        """
+        self._file.flush()
+        now = time.monotonic()
+        self._spilled = False
+        for seq, document in self._iter_log(self._loaded_through):
+            if len(self._pending) >= self.max_in_memory:
+                self._spilled = True
+                break
+            self._pending.append((seq, document, now))
+            self._loaded_through = seq
+
+    def _compact(self):
+        """
+        Truncate a fully acknowledged log once it is large enough. Call with the lock held.
+        """
+        if self._written_seq > self._synced_seq or self._file.tell() < self.compact_bytes:
+            return
+        self._file.truncate(0)
+        self._file.seek(0)
+        os.fsync(self._file.fileno())
+
+    def backlog(self):
+        """
+        Get the number of records not yet acknowledged.
+
+        Returns:
+            int: Number of unreplicated records
+        """
+        return (self._next_seq - 1) - self._acked_seq
+
+    def close(self):
+        """
+        Sync outstanding writes, stop the syncer and close the log.
+        Unacknowledged records stay on disk and are recovered on the next start.
+        """
+        with self._changed:
+            if self._closing:
+                return
+            self._closing = True
+            self._changed.notify_all()
+        self._syncer.join()
+        with self._changed:
+            self._file.close()
@@ -1,124 +1,407 @@
+import os
 import threading
 import time
-import pygame
-import os
-from status import Status
+from collections import deque
+from status import Status, State, InvalidTransitionError
+from audio_engine import get_audio_engine, MUSIC_CHANNEL
+from song_library import get_song_library
+from song_catalog import get_song_catalog
+from metrics import counter, histogram
+
+DEMO_SONG = "DemoSong.wav"
+
+SONG_PLAYS = counter("jukebox_song_plays_total", "Songs started or queued for gapless playback", ("kind",))
+SONG_LOAD_SECONDS = histogram("jukebox_song_load_seconds", "Time to decode a song before it can play")
+
+
+class SongRequest:
+    """
+    A song waiting in, or playing from, the SongPlayer queue.
+    """
+
+    def __init__(self, song_path, label, custom=False, duration=None):
+        """
+        Initialize the SongRequest.
+
+        Args:
+            song_path (str): Path to the song file
+            label (str): Description of the song used in log messages
+            custom (bool): Whether the song is a custom song
+            duration (float, optional): Length of the song in seconds, if known
+        """
+        self.song_path = song_path
+        self.label = label
+        self.custom = custom
+        self.duration = duration
+        self.load_seconds = None
+        self.playback = None
+        self.cancelled = False
+        self._finished = threading.Event()
+
+    def done(self):
+        """
+        Check whether the song has finished, was skipped or was dropped from the queue.
+
+        Returns:
+            bool: True if the request is over, False otherwise
+        """
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Block until the song has finished, was skipped or was dropped from the queue.
+
+        Args:
+            timeout (float, optional): Maximum number of seconds to wait
+
+        Returns:
+            bool: True if the request is over, False if the timeout expired first
+        """
+        return self._finished.wait(timeout)
+
 
 class SongPlayer:
     """
     A class to handle playing songs and managing the status during playback.
     This follows the Single Responsibility Principle by focusing only on song playing.
+
+    Songs are played by a dedicated worker thread from an ordered queue. While one
+    song plays, the next one is decoded and queued on the mixer channel so the
+    transition between them is gapless.
     """
-    
-    def __init__(self, status: Status):
+
+    def __init__(self, status: Status, library=None, catalog=None):
         """
-        Initialize the SongPlayer with a Status instance.
-        
+        Initialize the SongPlayer with a Status instance and start the playback worker.
+
         Args:
             status (Status): The status instance to manage during song playback.
+            library (SongLibrary, optional): Index used to resolve song names. Defaults to the shared library.
+            catalog (SongCatalog, optional): Durations and loudness per track. Defaults to the shared catalog.
         """
         self.status = status
-        # Initialize pygame mixer for audio playback
-        pygame.mixer.init()
-    
-    def play_song(self, song_name="DemoSong.wav"):
+        # Both define __len__, so an empty library or catalog is falsy but still the one to use
+        self.library = library if library is not None else get_song_library()
+        self.catalog = catalog if catalog is not None else get_song_catalog()
+        # Tracks are turned down to this RMS loudness so volume does not jump between songs
+        self.target_loudness_db = float(os.getenv("SONG_TARGET_LOUDNESS_DB", "-20"))
+        # Share the process-wide mixer with prompts and speech
+        self.audio_engine = get_audio_engine()
+
+        # Requests not loaded yet, the one being decoded, the one playing now and the one preloaded behind it
+        self._pending = deque()
+        self._loading = None
+        self._playing = None
+        self._queued = None
+        self._queue_changed = threading.Condition()
+
+        self._worker = threading.Thread(target=self._run_queue, daemon=True)
+        self._worker.start()
+
+    def resolve_song_path(self, song_name):
+        """
+        Turn a song name into the path of a playable file.
+
+        Args:
+            song_name (str): Name of the song to play
+
+        Returns:
+            str: Path to the song file, or the demo song if no file matches
+        """
+        # Rank library titles against the (possibly noisy) transcription
+        start = time.perf_counter()
+        match = self.library.best_match(song_name)
+        elapsed = (time.perf_counter() - start) * 1000
+
+        # If no title matches well enough, use the demo song as fallback
+        if match is None:
+            print(f"Song '{song_name}' not found, using demo song instead.")
+            return DEMO_SONG
+        entry, score = match
+        print(f"Matched '{song_name}' to '{entry.title}' (score {score:.2f}, {elapsed:.2f} ms)")
+        return entry.path
+
+    def enqueue(self, song_path, label=None, custom=False):
         """
-        Play a song and manage the status flags during playback.
+        Add a song file to the end of the play queue.
+
+        Args:
+            song_path (str): Path to the song file
+            label (str, optional): Description of the song used in log messages
+            custom (bool): Whether the song is a custom song
+
+        Returns:
+            SongRequest: The queued request, which can be waited on
+        """
+        track = self.catalog.get(song_path)
+        request = SongRequest(song_path, label or song_path, custom=custom,
+                              duration=track["duration"] if track else None)
+        with self._queue_changed:
+            # Claim the status right away so callers see the song as active immediately
+            if self._is_idle():
+                self._set_status(State.LOADING, custom)
+            self._pending.append(request)
+            self._queue_changed.notify()
+        print(f"Queued {request.label}")
+        return request
+
+    def play_song(self, song_name=DEMO_SONG):
+        """
+        Play a song and manage the status during playback.
         This method will block until the song finishes playing.
-        
+
         Args:
             song_name (str): Name of the song to play. Defaults to "DemoSong.wav".
         """
-        # Clean up the song name by removing trailing punctuation
-        cleaned_song_name = song_name.rstrip('. ')
-        song_path = f"{cleaned_song_name}.wav"
-        
-        # If the cleaned song file doesn't exist, use the demo song as fallback
-        if not os.path.exists(song_path):
-            song_path = "DemoSong.wav"
-            print(f"Song '{cleaned_song_name}' not found, using demo song instead.")
-        
-        # Set loading status
-        self.status.loading_song = True
-        print(f"Loading song: {song_path}")
-        
-        try:
-            # Load the song
-            pygame.mixer.music.load(song_path)
-            
-            # Set playing status and clear loading status
-            self.status.loading_song = False
-            self.status.playing_song = True
-            print(f"Playing song: {song_path}")
-            
-            # Start playback
-            pygame.mixer.music.play()
-            
-            # Wait until the song finishes playing
-            while pygame.mixer.music.get_busy():
-                time.sleep(0.1)
-            
-            # Clear playing status when finished
-            self.status.playing_song = False
-            print(f"Finished playing song: {song_path}")
-            
-        except Exception as e:
-            print(f"Error playing song: {e}")
-            # Clear both status flags in case of error
-            self.status.loading_song = False
-            self.status.playing_song = False
-    
-    def play_song_async(self, song_path="DemoSong.wav"):
-        """
-        Play a song asynchronously without blocking the calling thread.
-        This method returns immediately after starting playback.
-        
+        self.play_song_async(song_name).wait()
+
+    def play_song_async(self, song_name=DEMO_SONG):
+        """
+        Queue a song without blocking the calling thread.
+
         Args:
-            song_path (str): Path to the song file to play. Defaults to "DemoSong.wav".
+            song_name (str): Name of the song to play. Defaults to "DemoSong.wav".
+
+        Returns:
+            SongRequest: The queued request, which can be waited on
         """
-        # Create and start a new thread for song playback
-        playback_thread = threading.Thread(target=self.play_song, args=(song_path,))
-        playback_thread.daemon = True  # Thread will die when main program exits
-        playback_thread.start()
-    
+        song_path = self.resolve_song_path(song_name)
+        return self.enqueue(song_path, song_path)
+
     def play_custom_song(self, song_details):
         """
-        Play a custom song and manage the status flags during playback.
+        Play a custom song and manage the status during playback.
         This method will block until the song finishes playing.
-        
+
+        Args:
+            song_details (dict): Dictionary containing details about the custom song.
+        """
+        self.play_custom_song_async(song_details).wait()
+
+    def play_custom_song_async(self, song_details):
+        """
+        Queue a custom song without blocking the calling thread.
+        Songs are generated in the background by CustomSongJobManager; details
+        without a generated "audio_path" play the demo song instead.
+
         Args:
             song_details (dict): Dictionary containing details about the custom song.
+
+        Returns:
+            SongRequest: The queued request, which can be waited on
+        """
+        song_label = song_details.get('song_name', 'Unknown')
+        song_path = song_details.get('audio_path') or DEMO_SONG
+        return self.enqueue(song_path, f"custom song {song_label}", custom=True)
+
+    def skip(self):
+        """
+        Skip the current song. The next queued song starts immediately.
+        """
+        self.audio_engine.skip(MUSIC_CHANNEL)
+
+    def stop(self):
+        """
+        Stop the current song and drop everything waiting in the queue.
+        A song being decoded is discarded once its decode finishes.
+        """
+        with self._queue_changed:
+            dropped = list(self._pending)
+            self._pending.clear()
+            if self._loading is not None:
+                self._loading.cancelled = True
+        for request in dropped:
+            request._finished.set()
+        self.audio_engine.stop(MUSIC_CHANNEL)
+
+        # Release the status claimed by enqueue() if nothing had started yet.
+        # While a song is decoding, the worker releases it after discarding the song.
+        with self._queue_changed:
+            if self._is_idle():
+                self._set_status(State.IDLE)
+            self._queue_changed.notify_all()
+
+    def queued_songs(self):
+        """
+        List the songs that are playing or waiting to play, in order.
+
+        Returns:
+            list: The SongRequest objects in play order
+        """
+        with self._queue_changed:
+            current = [r for r in (self._playing, self._queued, self._loading) if r is not None]
+            return current + list(self._pending)
+
+    def remaining_seconds(self):
+        """
+        Estimate how long until the queue has been played out, using catalogued durations.
+        Songs whose duration is unknown are not counted.
+
+        Returns:
+            float: Estimated seconds of music left
+        """
+        now = time.monotonic()
+        remaining = 0.0
+        for request in self.queued_songs():
+            if request.duration is None:
+                continue
+            if request is self._playing and request.playback is not None:
+                remaining += max(0.0, request.duration - (now - request.playback.started_at))
+            else:
+                remaining += request.duration
+        return remaining
+
+    def wait_until_finished(self, timeout=None):
+        """
+        Block until the queue has been played out.
+
+        Args:
+            timeout (float, optional): Maximum number of seconds to wait
+
+        Returns:
+            bool: True if no song is playing anymore, False if the timeout expired first
+        """
+        with self._queue_changed:
+            return self._queue_changed.wait_for(self._is_idle, timeout)
+
+    def _is_idle(self):
+        """
+        Check whether nothing is playing, preloaded, decoding or waiting. Call with the queue lock held.
+
+        Returns:
+            bool: True if the player is idle, False otherwise
+        """
+        return (self._playing is None and self._queued is None and self._loading is None
+                and not self._pending)
+
+    def _has_work(self):
         """
-        # Set loading status for custom song
-        self.status.loading_custom_song = True
-        print(f"Loading custom song: {song_details.get('song_name', 'Unknown')}")
-        
+        Check whether the worker has something to do. Call with the queue lock held.
+
+        Returns:
+            bool: True if the current song ended or the next song can be loaded
+        """
+        current_finished = self._playing is not None and self._playing.playback.done()
+        can_preload = bool(self._pending) and self._queued is None
+        return current_finished or can_preload
+
+    def _wake(self, _playback=None):
+        """
+        Wake the worker, e.g. when the engine reports that a song ended.
+        """
+        with self._queue_changed:
+            self._queue_changed.notify_all()
+
+    def _run_queue(self):
+        """
+        Worker loop: retire finished songs and load the next song as soon as there is room.
+        """
+        while True:
+            with self._queue_changed:
+                self._queue_changed.wait_for(self._has_work)
+                finished = None
+                if self._playing is not None and self._playing.playback.done():
+                    finished = self._playing
+                    self._playing, self._queued = self._queued, None
+                request = None
+                if self._pending and self._queued is None:
+                    request = self._pending.popleft()
+                    # Tracked while it decodes, so the player does not look idle in between
+                    self._loading = request
+
+            if finished is not None:
+                self._retire(finished, has_next=request is not None)
+            if request is not None:
+                self._load_and_start(request)
+
+    def _load_and_start(self, request):
+        """
+        Decode a song and either start it or queue it behind the current song.
+
+        Args:
+            request (SongRequest): The request to load
+        """
+        starts_now = self._playing is None
+        if starts_now:
+            self._set_status(State.LOADING, request.custom)
+        print(f"Loading {request.label}")
+
         try:
-            # For now, we'll play the demo song as a placeholder
-            # In a real implementation, this would generate and play the custom song
-            song_path = "DemoSong.wav"
-            
-            # Load the song
-            pygame.mixer.music.load(song_path)
-            
-            # Set playing status and clear loading status
-            self.status.loading_custom_song = False
-            self.status.playing_custom_song = True
-            print(f"Playing custom song: {song_details.get('song_name', 'Unknown')}")
-            
-            # Start playback
-            pygame.mixer.music.play()
-            
-            # Wait until the song finishes playing
-            while pygame.mixer.music.get_busy():
-                time.sleep(0.1)
-            
-            # Clear playing status when finished
-            self.status.playing_custom_song = False
-            print(f"Finished playing custom song: {song_details.get('song_name', 'Unknown')}")
-            
+            start = time.perf_counter()
+            sound = self.audio_engine.load_sound(request.song_path)
+            request.load_seconds = time.perf_counter() - start
+            SONG_LOAD_SECONDS.observe(request.load_seconds)
+            request.duration = sound.get_length()
+            sound.set_volume(self.catalog.volume_for(request.song_path, self.target_loudness_db))
+            print(f"Loaded {request.label} in {request.load_seconds * 1000:.0f} ms "
+                  f"({request.duration:.0f} s, volume {sound.get_volume():.2f})")
+
+            with self._queue_changed:
+                self._loading = None
+                if request.cancelled:
+                    print(f"Dropped {request.label}; the player was stopped while it loaded")
+                    request._finished.set()
+                    if self._is_idle():
+                        self._set_status(State.IDLE)
+                    self._queue_changed.notify_all()
+                    return
+                if self._playing is None:
+                    request.playback = self.audio_engine.play_sound(sound, channel=MUSIC_CHANNEL, block=False)
+                    self._playing = request
+                else:
+                    request.playback = self.audio_engine.play_sound(sound, channel=MUSIC_CHANNEL,
+                                                                    block=False, queue=True)
+                    self._queued = request
+            request.playback.add_done_callback(self._wake)
+            SONG_PLAYS.labels("custom" if request.custom else "library").inc()
+
+            if starts_now:
+                self._set_status(State.PLAYING, request.custom)
+                print(f"Playing {request.label}")
+            else:
+                print(f"Preloaded {request.label} for gapless playback")
         except Exception as e:
-            print(f"Error playing custom song: {e}")
-            # Clear both status flags in case of error
-            self.status.loading_custom_song = False
-            self.status.playing_custom_song = False
+            print(f"Error playing {request.label}: {e}")
+            request._finished.set()
+            with self._queue_changed:
+                self._loading = None
+                if self._is_idle():
+                    self._set_status(State.IDLE)
+                self._queue_changed.notify_all()
+
+    def _retire(self, request, has_next=False):
+        """
+        Mark a song as over and move the status on to whatever plays next.
+
+        Args:
+            request (SongRequest): The request that finished or was skipped
+            has_next (bool): Whether the worker is about to load another song
+        """
+        if request.playback.interrupted:
+            print(f"Skipped {request.label}")
+        else:
+            print(f"Finished playing {request.label}")
+        request._finished.set()
+
+        with self._queue_changed:
+            following = self._playing
+            if following is not None and not following.playback.done():
+                self._set_status(State.PLAYING, following.custom)
+            elif has_next or self._pending:
+                self._set_status(State.LOADING)
+            elif following is None:
+                self._set_status(State.IDLE)
+            self._queue_changed.notify_all()
+
+    def _set_status(self, state, custom=False):
+        """
+        Move the shared status, logging instead of failing if the move is not allowed.
+
+        Args:
+            state (State): The state to move to
+            custom (bool): Whether the state concerns a custom song
+        """
+        try:
+            self.status.transition(state, custom=custom)
+        except InvalidTransitionError as e:
+            print(f"Status not updated: {e}")
@@ -1,22 +1,143 @@
-import sys
 import os
 import json
+import random
+import threading
+from collections import deque
 from LLM import LLMClient
-from STT import record_audio, transcribe_audio_with_elevenlabs
-from TTS import speak_text
-from mongodb_handler import MongoDBHandler
 from json_parser import JSONResponseParser
 from static_messages import StaticMessages
 from confirmation import Confirmation
+from dialog import DialogEngine, run_dialog
+from song_library import get_song_library
+from speculation import SpeculativeEvaluator
+from metrics import CACHE_REQUESTS
+
+# Canned roasts used until the LLM has filled the pool
+DEFAULT_ROASTS = [
+    "Oh look, a song people actually like. How brave of you.",
+    "Fine, that one's in the jukebox. Your taste is tolerable. Barely.",
+    "A real song! I was ready to be disappointed and you ruined it.",
+    "Solid pick. Don't let it go to your head, it's still a jukebox.",
+]
+
+
+class RoastPool:
+    """
+    A pool of ready-made roasts for songs we already know are playable.
+    The pool is refilled in the background with one LLM call per batch, so taking a
+    roast never waits on the network.
+    """
+    
+    def __init__(self, llm_client, json_parser, batch_size=8, low_water=3):
+        """
+        Initialize the RoastPool with the canned roasts.
+        
+        Args:
+            llm_client (LLMClient): Client used to generate new roasts
+            json_parser (JSONResponseParser): Parser for the LLM response
+            batch_size (int): Number of roasts requested per LLM call
+            low_water (int): Refill when fewer roasts than this are left
+        """
+        self.llm_client = llm_client
+        self.json_parser = json_parser
+        self.batch_size = batch_size
+        self.low_water = low_water
+        self._roasts = deque(DEFAULT_ROASTS)
+        self._lock = threading.Lock()
+        self._refilling = False
+    
+    def take(self):
+        """
+        Take a roast from the pool and trigger a background refill when it runs low.
+        
+        Returns:
+            str: A roast that fits any acceptable song choice
+        """
+        with self._lock:
+            hit = bool(self._roasts)
+            roast = self._roasts.popleft() if hit else random.choice(DEFAULT_ROASTS)
+            needs_refill = len(self._roasts) < self.low_water and not self._refilling
+            if needs_refill:
+                self._refilling = True
+        CACHE_REQUESTS.labels("roast_pool", "hit" if hit else "miss").inc()
+        if needs_refill:
+            threading.Thread(target=self._refill, daemon=True).start()
+        return roast
+    
+    def _refill(self):
+        """
+        Ask the LLM for a batch of roasts and add them to the pool.
+        """
+        prompt = f"""
+        You are an ENTP personality with dark humor and a raunchy style working a jukebox.
+        Write {self.batch_size} different short roasts for someone who just picked a decent song that is in the jukebox.
+        The roasts must not mention any song title, so they fit any choice.
+
+        Respond with a JSON object containing:
+        1. "roasts" (list of strings): The roasts
+
+        Be witty, playful, random funny like a ENTP comedian. Do not use violence or drug themes. ONLY Respond in JSON no Markdown.
+        """
+        CleanJsonPrompt = "Please return only a valid JSON object. Do not include markdown formatting, code blocks, comments, or any extra text. The JSON must contain the key roasts (list of strings). Ensure all quotation marks are straight quotes, and escape any special characters properly. Do not wrap the response in triple backticks or label it as JSON. Just return the raw JSON object. If the input is malformed, fix it silently and return only the corrected JSON."
+        try:
+            response = self.llm_client.call_llm(prompt, task="roast_pool")
+            result = self.json_parser.parse_roast_pool_json(response, CleanJsonPrompt)
+            if result:
+                with self._lock:
+                    self._roasts.extend(roast.strip() for roast in result["roasts"] if roast.strip())
+        except Exception as e:
+            print(f"Error refilling roast pool: {e}")
+        finally:
+            with self._lock:
+                self._refilling = False
+
 
 class SongPicker:
-    def __init__(self):
+    def __init__(self, library=None, llm_client=None, static_msgs=None):
         """
         Initialize the SongPicker with an LLM client.
+        
+        Args:
+            library (SongLibrary, optional): Index of playable songs. Defaults to the shared library.
+            llm_client (LLMClient, optional): Client to share instead of creating one
+            static_msgs (StaticMessages, optional): Static messages to share instead of creating them
         """
-        self.llm_client = LLMClient()
+        self.llm_client = llm_client or LLMClient()
         self.json_parser = JSONResponseParser(self.llm_client)
-        self.static_msgs = StaticMessages()
+        self.static_msgs = static_msgs or StaticMessages()
+        self.library = library if library is not None else get_song_library()
+        self.roast_pool = RoastPool(self.llm_client, self.json_parser)
+        # Titles matching the library at least this well are treated as known and playable
+        self.known_song_score = float(os.getenv("KNOWN_SONG_MIN_SCORE", "0.85"))
+        # Titles matching at least this well are offered as "did you mean" suggestions
+        self.suggestion_score = float(os.getenv("SONG_SUGGESTION_MIN_SCORE", "0.4"))
+        # Starts the LLM verdict on partial transcripts, before the user has finished talking
+        self.speculator = None
+        if os.getenv("SPECULATIVE_EVALUATION", "1") == "1":
+            self.speculator = SpeculativeEvaluator(self.evaluate_song)
+    
+    def check_library(self, song_choice):
+        """
+        Look a song choice up in the library before asking the LLM about it.
+        
+        Args:
+            song_choice (str): The user's song selection
+            
+        Returns:
+            tuple: (verdict, title, suggestions) where verdict is "known" (title is the
+                library title), "suggest" (suggestions lists close titles), "unknown"
+                (nothing close in the library) or "unchecked" (the library is empty).
+                Unknown and unchecked choices are evaluated by the LLM.
+        """
+        if len(self.library) == 0:
+            return "unchecked", None, []
+        
+        matches = self.library.lookup(song_choice, limit=3, min_score=self.suggestion_score)
+        if matches and matches[0][1] >= self.known_song_score:
+            return "known", matches[0][0].title, []
+        if matches:
+            return "suggest", None, [entry.title for entry, _ in matches]
+        return "unknown", None, []
     
     def evaluate_song(self, song_choice):
         """
@@ -51,7 +172,7 @@ class SongPicker:
         CleanJsonPrompt = "Please return only a valid JSON object. Do not include markdown formatting, code blocks, comments, or any extra text. The JSON must contain the following keys: acceptable (boolean) and roast (string). Ensure all quotation marks are straight quotes, and escape any special characters properly. Do not wrap the response in triple backticks or label it as JSON. Just return the raw JSON object.If the input is malformed, fix it silently and return only the corrected JSON."
         
         try:
-            response = self.llm_client.call_llm(prompt)
+            response = self.llm_client.call_llm(prompt, task="song_evaluation")
             print("LLM Response:", response)
             
             # Use JSONResponseParser to parse the response
@@ -69,94 +190,79 @@ class SongPicker:
                 "roast": f"Nice try, but I can't even process your song choice: {str(e)}"
             }
     
+    def speculate(self, partial_choice, session_id=None):
+        """
+        Start evaluating a partial transcript of the song choice in the background,
+        if the final choice would need the LLM (the library does not have it or is empty).
+        
+        Args:
+            partial_choice (str): The song choice heard so far
+            session_id (str, optional): The session the user talks in
+        """
+        if self.speculator is not None and self.check_library(partial_choice)[0] in ("unknown", "unchecked"):
+            self.speculator.launch(partial_choice, session_id)
+    
+    def evaluate_song_choice(self, song_choice, session_id=None):
+        """
+        Evaluate the final song choice, reusing a speculative evaluation of a partial
+        transcript of the same session when it normalizes to the same text.
+        
+        Args:
+            song_choice (str): The user's song selection
+            session_id (str, optional): The session the user talks in
+            
+        Returns:
+            dict: JSON response with evaluation results
+        """
+        if self.speculator is None:
+            return self.evaluate_song(song_choice)
+        return self.speculator.resolve(song_choice, session_id)
+    
+    def end_session(self, session_id):
+        """
+        Drop a finished session's speculative evaluations.
+        
+        Args:
+            session_id (str): The session
+        """
+        if self.speculator is not None:
+            self.speculator.forget(session_id)
+    
     def pick_song(self):
         """
         Main method to run the song picking loop with user input.
+        The dialog itself is the "song" dialog of DialogEngine.
         
         Returns:
-            dict: Final JSON response when an acceptable song is selected
+            tuple: (result, song_choice) when an acceptable song is confirmed,
+                or (None, None) if the selection was cancelled
         """
-        self.static_msgs.play_static_message("roast_intro")
-        
-        while True:
-            print("\nPlease say your song choice...")
-            self.static_msgs.play_static_message("song_choice_prompt")
-            
-            # Record audio from microphone (5 seconds)
-            audio_filename = record_audio(record_seconds=5)
-            
-            # Transcribe using ElevenLabs
-            transcription = transcribe_audio_with_elevenlabs(audio_filename)
-            song_choice = transcription.text.strip()
-            
-            print(f"You said: {song_choice}")
-            
-            if song_choice.lower() == 'quit':
-                self.static_msgs.play_static_message("giving_up")
-                self.static_msgs.play_static_message("try_again")
-                sys.exit(0)
-            
-            if not song_choice:
-                self.static_msgs.play_static_message("silence_not_song")
-                self.static_msgs.play_static_message("try_again")
-                continue
-            
-            # Evaluate the song choice
-            result = self.evaluate_song(song_choice)
-            
-            # Display the roast regardless of acceptability
-            print(f"\nRoast: {result['roast']}")
-            speak_text(result['roast'])
-            
-           
-            
-            # Check if the song is acceptable
-            if result['acceptable']:
-                print("\nFinally! You picked an acceptable song.")
-                self.static_msgs.play_static_message("acceptable_song")
-                
-                # Ask for confirmation
-                confirmation = Confirmation()
-                action = confirmation.confirm_song_choice(song_choice)
-                
-                if action == "confirmed":
-                    print("Song confirmed!")
-                    # Save to MongoDB
-                    self.save_to_mongo(song_choice, result)
-                    return result, song_choice
-                elif action == "change_song":
-                    print("Let's pick a different song.")
-                    self.static_msgs.play_static_message("try_again")
-                    continue
-                elif action == "cancel":
-                    print("Song selection cancelled.")
-                    self.static_msgs.play_static_message("try_again")
-                    return None, None
-            else:
-                print("Try again, oh master of terrible music choices.")
-                self.static_msgs.play_static_message("try_again")
+        engine = DialogEngine(song_picker=self, confirmation=Confirmation(self.llm_client, self.static_msgs))
+        state, actions = engine.start("song")
+        outcome = run_dialog(engine, state, actions, self.static_msgs)
+        return outcome["result"], outcome["choice"]
 
     def save_to_mongo(self, song_choice, result):
         """
-        Save song data to MongoDB after confirmation.
+        Queue song data for MongoDB after confirmation. The write happens in the
+        background, so a slow database never delays the conversation.
         
         Args:
             song_choice (str): The confirmed song selection
             result (dict): The evaluation result from the LLM
         """
+        # pymongo is slow to import, so the writer is only loaded once a song is confirmed
+        from mongo_writer import get_song_writer
         try:
-            mongo_handler = MongoDBHandler()
             song_data = {
                 "song_name": song_choice,
                 "acceptable": result['acceptable'],
                 "roast": result['roast']
             }
-            success = mongo_handler.insert_song_data(song_data)
-            if success:
-                print("\nSong data successfully saved to MongoDB!")
+            if get_song_writer().submit(song_data):
+                print("\nSong data queued for MongoDB.")
             else:
-                print("\nFailed to save song data to MongoDB.")
-            mongo_handler.close_connection()
+                print("\nFailed to queue song data for MongoDB.")
         except Exception as e:
             print(f"\nError saving to MongoDB: {e}")
 
@@ -171,7 +277,8 @@ if __name__ == "__main__":
     
     # Save to MongoDB
     try:
-        mongo_handler = MongoDBHandler()
+        from mongodb_handler import get_mongo_handler
+        mongo_handler = get_mongo_handler()
         song_data = {
             "song_name": song_choice,
             "acceptable": final_result['acceptable'],
@@ -182,6 +289,5 @@ if __name__ == "__main__":
             print("\nSong data successfully saved to MongoDB!")
         else:
             print("\nFailed to save song data to MongoDB.")
-        mongo_handler.close_connection()
     except Exception as e:
         print(f"\nError saving to MongoDB: {e}")
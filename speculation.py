@@ -0,0 +1,191 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from titles import normalize_title
+from tracing import bind
+from metrics import CACHE_REQUESTS
+
+
+class Speculation:
+    """
+    One evaluation started ahead of time on a partial transcript.
+    """
+
+    def __init__(self, text, future):
+        """
+        Initialize the Speculation.
+
+        Args:
+            text (str): The partial transcript being evaluated
+            future (Future): The running evaluation
+        """
+        self.text = text
+        self.future = future
+        self.launched_at = time.perf_counter()
+        self.finished_at = None
+
+
+class SpeculativeEvaluator:
+    """
+    Starts an expensive evaluation (e.g. the LLM verdict on a song choice) on a stable
+    partial transcript, before the final transcript is known. When the final transcript
+    arrives, the speculative result is used if both normalize to the same text; otherwise
+    the speculation is cancelled and the evaluation is reissued for the final transcript.
+
+    Speculations belong to a session (e.g. one terminal of the server), so resolving one
+    session's transcript never cancels or reuses another session's speculations.
+    """
+
+    def __init__(self, evaluate, executor=None, normalize=normalize_title, max_age=30.0):
+        """
+        Initialize the SpeculativeEvaluator.
+
+        Args:
+            evaluate (callable): The blocking evaluation, called with the transcript text
+            executor (ThreadPoolExecutor, optional): Pool the speculations run on. Defaults to a small private pool.
+            normalize (callable): Maps a transcript to the key compared between partial and final
+            max_age (float): Seconds after which an unused speculation is dropped
+        """
+        self.evaluate = evaluate
+        self.executor = executor or ThreadPoolExecutor(max_workers=2, thread_name_prefix="speculate")
+        self.normalize = normalize
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._pending = {}  # session -> {normalized text -> Speculation}
+        self._stats = {None: self._new_stats()}  # session -> counters; None counts every session
+
+    @staticmethod
+    def _new_stats():
+        return {"launched": 0, "turns": 0, "hits": 0, "misses": 0, "saved_seconds": 0.0}
+
+    def _count(self, session, name, amount=1):
+        """
+        Add to a counter of a session and of the totals. Call with the lock held.
+        """
+        self._stats[None][name] += amount
+        if session is not None:
+            self._stats.setdefault(session, self._new_stats())[name] += amount
+
+    def launch(self, text, session=None):
+        """
+        Start evaluating a partial transcript in the background.
+        A speculation for the same normalized text is reused rather than started twice.
+
+        Args:
+            text (str): The partial transcript
+            session (str, optional): The session the transcript belongs to
+        """
+        key = self.normalize(text or "")
+        if not key:
+            return
+        with self._lock:
+            self._expire()
+            pending = self._pending.setdefault(session, {})
+            if key in pending:
+                return
+            speculation = Speculation(text, None)
+            speculation.future = self.executor.submit(bind(self._run, speculation))
+            pending[key] = speculation
+            self._count(session, "launched")
+        print(f"Speculatively evaluating '{text}'")
+
+    def _run(self, speculation):
+        try:
+            return self.evaluate(speculation.text)
+        finally:
+            speculation.finished_at = time.perf_counter()
+
+    def _expire(self):
+        """
+        Drop speculations nobody resolved in time. Call with the lock held.
+        """
+        now = time.perf_counter()
+        for session, pending in list(self._pending.items()):
+            for key, speculation in list(pending.items()):
+                if now - speculation.launched_at > self.max_age:
+                    speculation.future.cancel()
+                    del pending[key]
+            if not pending:
+                del self._pending[session]
+
+    def resolve(self, text, session=None):
+        """
+        Evaluate a final transcript, reusing a matching speculation of the same session.
+        The session's speculations that do not match are cancelled (or, if already running, discarded).
+
+        Args:
+            text (str): The final transcript
+            session (str, optional): The session the transcript belongs to
+
+        Returns:
+            The evaluation result
+        """
+        key = self.normalize(text or "")
+        with self._lock:
+            pending = self._pending.pop(session, {})
+            speculation = pending.pop(key, None)
+            stale = list(pending.values())
+            self._count(session, "turns")
+        for other in stale:
+            other.future.cancel()
+
+        resolved_at = time.perf_counter()
+        if speculation is not None and not speculation.future.cancelled():
+            try:
+                result = speculation.future.result()
+            except Exception as e:
+                print(f"Speculative evaluation failed: {e}")
+            else:
+                # The evaluation ran while the final transcript was still being produced
+                finished_at = speculation.finished_at or resolved_at
+                saved = min(finished_at, resolved_at) - speculation.launched_at
+                with self._lock:
+                    self._count(session, "hits")
+                    self._count(session, "saved_seconds", saved)
+                CACHE_REQUESTS.labels("speculation", "hit").inc()
+                print(f"Speculative evaluation hit for '{text}', saved {saved * 1000:.0f} ms")
+                return result
+
+        if speculation is not None or stale:
+            with self._lock:
+                self._count(session, "misses")
+            CACHE_REQUESTS.labels("speculation", "miss").inc()
+            print(f"Speculative evaluation missed for '{text}', evaluating again")
+        return self.evaluate(text)
+
+    def forget(self, session):
+        """
+        Cancel a session's speculations and drop its statistics, e.g. when it disconnects.
+
+        Args:
+            session (str): The session
+        """
+        with self._lock:
+            pending = self._pending.pop(session, {})
+            if session is not None:
+                self._stats.pop(session, None)
+        for speculation in pending.values():
+            speculation.future.cancel()
+
+    def metrics(self, session=None):
+        """
+        Get speculation statistics.
+
+        Args:
+            session (str, optional): Only count this session. Defaults to every session.
+
+        Returns:
+            dict: Speculations launched, turns resolved, hits, misses, hit rate and
+                milliseconds saved in total, per hit and per turn
+        """
+        with self._lock:
+            stats = dict(self._stats.get(session) or self._new_stats())
+        resolved = stats["hits"] + stats["misses"]
+        saved_ms = stats.pop("saved_seconds") * 1000
+        return dict(
+            stats,
+            hit_rate=stats["hits"] / resolved if resolved else 0.0,
+            saved_ms=saved_ms,
+            saved_ms_per_hit=saved_ms / stats["hits"] if stats["hits"] else 0.0,
+            saved_ms_per_turn=saved_ms / stats["turns"] if stats["turns"] else 0.0,
+        )
@@ -0,0 +1,164 @@
+import os
+import time
+import threading
+from startup import load_environment
+
+load_environment()
+
+ELEVENLABS_BASE_URL = "https://api.elevenlabs.io"
+
+
+class SpeechClient:
+    """
+    The process-wide ElevenLabs client. STT, TTS and static message recording all go
+    through one keep-alive connection pool, so TLS is set up once rather than per module
+    and per StaticMessages instance.
+
+    Connections the pool has not used for keepalive_expiry seconds are closed, so the
+    first request after a long idle period pays for a new handshake. preconnect() opens
+    connections ahead of time, and keep_warm() does so in the background whenever the
+    pool has been idle for a while.
+    """
+
+    def __init__(self, api_key=None, base_url=None, max_connections=None, max_keepalive=None,
+                 keepalive_expiry=None, timeout=None, http2=None):
+        """
+        Initialize the SpeechClient. Every setting defaults to its ELEVENLABS_* env var.
+
+        Args:
+            api_key (str, optional): ElevenLabs API key (ELEVENLABS_API_KEY)
+            base_url (str, optional): API base URL (ELEVENLABS_BASE_URL, default: the public API)
+            max_connections (int, optional): Most connections open at once (ELEVENLABS_MAX_CONNECTIONS, default: 10)
+            max_keepalive (int, optional): Idle connections kept open (ELEVENLABS_MAX_KEEPALIVE, default: 5)
+            keepalive_expiry (float, optional): Seconds an idle connection is kept (ELEVENLABS_KEEPALIVE_SECONDS, default: 120)
+            timeout (float, optional): Seconds to wait for a response (ELEVENLABS_TIMEOUT_SECONDS, default: 60)
+            http2 (bool, optional): Multiplex requests over HTTP/2; needs the h2 package (ELEVENLABS_HTTP2, default: off)
+        """
+        # Both are slow to import, so they are only loaded once speech is needed
+        import httpx
+        from elevenlabs.client import ElevenLabs
+
+        self.base_url = (base_url or os.getenv("ELEVENLABS_BASE_URL", ELEVENLABS_BASE_URL)).rstrip("/")
+        self.keepalive_expiry = keepalive_expiry or float(os.getenv("ELEVENLABS_KEEPALIVE_SECONDS", "120"))
+        if http2 is None:
+            http2 = os.getenv("ELEVENLABS_HTTP2", "0") == "1"
+        limits = httpx.Limits(
+            max_connections=max_connections or int(os.getenv("ELEVENLABS_MAX_CONNECTIONS", "10")),
+            max_keepalive_connections=max_keepalive or int(os.getenv("ELEVENLABS_MAX_KEEPALIVE", "5")),
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        timeout = timeout or float(os.getenv("ELEVENLABS_TIMEOUT_SECONDS", "60"))
+        self.http = httpx.Client(
+            limits=limits,
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            http2=http2,
+            event_hooks={"request": [self._touch]},
+        )
+        self.client = ElevenLabs(
+            api_key=api_key or os.getenv("ELEVENLABS_API_KEY"),
+            base_url=self.base_url,
+            httpx_client=self.http,
+            timeout=timeout,
+        )
+
+        self.last_used = time.monotonic()
+        self.preconnects = 0
+        self._keep_warm_stop = None
+
+    @property
+    def speech_to_text(self):
+        return self.client.speech_to_text
+
+    @property
+    def text_to_speech(self):
+        return self.client.text_to_speech
+
+    def _touch(self, request):
+        self.last_used = time.monotonic()
+
+    def _open_connection(self):
+        # Any response (even an error status) leaves a warm connection in the pool
+        try:
+            self.http.head(self.base_url, timeout=5.0)
+        except Exception as e:
+            print(f"Could not pre-open speech service connection: {e}")
+
+    def preconnect(self, connections=1):
+        """
+        Open connections to the speech service ahead of time, so the next requests
+        skip the TCP and TLS handshakes. No API credits are used.
+
+        Args:
+            connections (int): Connections to open; concurrent requests each get their own
+        """
+        threads = [threading.Thread(target=self._open_connection, daemon=True) for _ in range(connections)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.preconnects += connections
+
+    def keep_warm(self, connections=1, idle_seconds=None):
+        """
+        Keep connections open during idle time, e.g. while a song plays, by re-opening
+        them in the background shortly before the pool would expire them.
+
+        Args:
+            connections (int): Connections to keep open
+            idle_seconds (float, optional): Idle time after which connections are refreshed.
+                Defaults to 80% of the keep-alive expiry.
+        """
+        if self._keep_warm_stop is not None:
+            return
+        idle_seconds = idle_seconds or self.keepalive_expiry * 0.8
+        self._keep_warm_stop = threading.Event()
+
+        def refresh(stop):
+            while not stop.wait(min(idle_seconds, 5.0)):
+                if time.monotonic() - self.last_used >= idle_seconds:
+                    self.preconnect(connections)
+
+        threading.Thread(target=refresh, args=(self._keep_warm_stop,), name="speech-keep-warm", daemon=True).start()
+
+    def close(self):
+        """
+        Stop keeping connections warm and close the pool.
+        """
+        if self._keep_warm_stop is not None:
+            self._keep_warm_stop.set()
+            self._keep_warm_stop = None
+        self.http.close()
+
+
+# The process-wide speech client used by STT, TTS and StaticMessages
+_speech_client = None
+_speech_client_lock = threading.Lock()
+
+
+def get_speech_client():
+    """
+    Get the process-wide SpeechClient, creating it on first use. Connections are kept
+    warm during idle time if ELEVENLABS_KEEP_WARM is "1".
+
+    Returns:
+        SpeechClient: The shared speech client
+    """
+    global _speech_client
+    with _speech_client_lock:
+        if _speech_client is None:
+            _speech_client = SpeechClient()
+            if os.getenv("ELEVENLABS_KEEP_WARM", "0") == "1":
+                _speech_client.keep_warm(int(os.getenv("ELEVENLABS_WARM_CONNECTIONS", "1")))
+        return _speech_client
+
+
+def set_speech_client(client):
+    """
+    Replace the process-wide speech client, e.g. with one pointed at another endpoint.
+
+    Args:
+        client (SpeechClient): The client STT, TTS and StaticMessages should use from now on
+    """
+    global _speech_client
+    with _speech_client_lock:
+        _speech_client = client
@@ -0,0 +1,108 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_env_loaded = False
+_env_lock = threading.Lock()
+
+
+def load_environment():
+    """
+    Load the .env file once per process. Modules call this instead of load_dotenv()
+    so the file is read (and python-dotenv imported) only on the first call.
+    """
+    global _env_loaded
+    with _env_lock:
+        if not _env_loaded:
+            from dotenv import load_dotenv
+            load_dotenv()
+            _env_loaded = True
+
+
+class StartupReport:
+    """
+    Timings of the startup phases, which may run concurrently.
+    Every phase is recorded with its start offset and duration from the moment the
+    report was created, along with milestones such as the first audio playing.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self._lock = threading.Lock()
+        self.phases = []  # (name, start offset, duration, error)
+        self.running = {}  # name -> start offset of phases still in progress
+        self.milestones = []  # (name, offset)
+
+    def timed(self, name, func, *args, **kwargs):
+        """
+        Run a function as a named phase.
+
+        Args:
+            name (str): Name of the phase
+            func (callable): The function to run
+            *args: Positional arguments for the function
+            **kwargs: Keyword arguments for the function
+
+        Returns:
+            The function's return value (exceptions are recorded and re-raised)
+        """
+        start = time.perf_counter()
+        with self._lock:
+            self.running[name] = start - self.started_at
+        error = None
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                del self.running[name]
+                self.phases.append((name, start - self.started_at, end - start, error))
+
+    def mark(self, name):
+        """
+        Record a milestone, e.g. the welcome message starting to play.
+
+        Args:
+            name (str): Name of the milestone
+        """
+        with self._lock:
+            self.milestones.append((name, time.perf_counter() - self.started_at))
+
+    def warm_up(self, tasks, max_workers=None):
+        """
+        Run independent startup phases in parallel.
+
+        Args:
+            tasks (dict): Phase name -> callable taking no arguments
+            max_workers (int, optional): Threads to use. Defaults to one per task.
+
+        Returns:
+            dict: Phase name -> Future of the callable's result
+        """
+        pool = ThreadPoolExecutor(max_workers=max_workers or max(1, len(tasks)), thread_name_prefix="warm-up")
+        futures = {name: pool.submit(self.timed, name, func) for name, func in tasks.items()}
+        # The threads exit once their phase is done; nothing waits for them here
+        pool.shutdown(wait=False)
+        return futures
+
+    def print_report(self):
+        """
+        Print the phases in start order with their offsets and durations, then the milestones.
+        Phases still in progress (e.g. a slow database connection) are listed as running.
+        """
+        now = time.perf_counter() - self.started_at
+        with self._lock:
+            phases = list(self.phases) + [(name, offset, None, None) for name, offset in self.running.items()]
+            milestones = list(self.milestones)
+        print(f"Startup timing ({now * 1000:.0f} ms total):")
+        for name, offset, duration, error in sorted(phases, key=lambda phase: phase[1]):
+            if duration is None:
+                print(f"  {name:<24} +{offset * 1000:7.0f} ms  still running")
+                continue
+            status = f"  FAILED: {error}" if error else ""
+            print(f"  {name:<24} +{offset * 1000:7.0f} ms  {duration * 1000:7.0f} ms{status}")
+        for name, offset in milestones:
+            print(f"  {name:<24} at {offset * 1000:6.0f} ms")
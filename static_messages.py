@@ -1,26 +1,49 @@
 import os
-from dotenv import load_dotenv
-from elevenlabs.client import ElevenLabs
-import soundfile as sf
-import numpy as np
+from startup import load_environment
+from audio_bank import get_audio_bank
+from audio_engine import get_audio_engine, PROMPT_CHANNEL
+from speech_client import get_speech_client
+from tracing import span
+from TTS import TTS_CHARACTERS
 
 # Load environment variables
-load_dotenv()
+load_environment()
 
 class StaticMessages:
-    def __init__(self, audio_dir="static_audio"):
+    def __init__(self, audio_dir="static_audio", speech_client=None):
         """
         Initialize the StaticMessages class.
         
         Args:
             audio_dir (str): Directory to store static audio files
+            speech_client (SpeechClient, optional): Client used to record new messages.
+                Defaults to the process-wide client, fetched on first use.
         """
         self.audio_dir = audio_dir
-        self.elevenlabs = ElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"))
+        self._speech_client = speech_client
         
         # Create audio directory if it doesn't exist
         if not os.path.exists(self.audio_dir):
             os.makedirs(self.audio_dir)
+        
+        # Decoded clips are shared by every StaticMessages instance using this directory
+        self.audio_bank = get_audio_bank(self.audio_dir)
+    
+    @property
+    def speech_client(self):
+        """
+        Get the speech client used to record static messages.
+        """
+        return self._speech_client or get_speech_client()
+    
+    def preload(self):
+        """
+        Decode all static messages into memory so playback never touches the disk.
+        
+        Returns:
+            dict: Preload statistics with clip count, elapsed seconds and memory in bytes
+        """
+        return self.audio_bank.preload()
     
     def create_static_message(self, text, message_id, voice_id="JBFqnCBsd6RMkjVDRZzb", model_id="eleven_multilingual_v2"):
         """
@@ -37,7 +60,8 @@ class StaticMessages:
         """
         try:
             # Generate audio using ElevenLabs
-            audio = self.elevenlabs.text_to_speech.convert(
+            TTS_CHARACTERS.labels("static").inc(len(text))
+            audio = self.speech_client.text_to_speech.convert(
                 text=text,
                 voice_id=voice_id,
                 model_id=model_id,
@@ -52,40 +76,41 @@ class StaticMessages:
                 for chunk in audio:
                     f.write(chunk)
             
+            # Make sure the next playback decodes the new recording
+            self.audio_bank.invalidate(message_id)
+            
             print(f"Static message '{message_id}' created and saved to {file_path}")
             return file_path
         except Exception as e:
             print(f"Error creating static message '{message_id}': {e}")
             return None
     
-    def play_static_message(self, message_id):
+    def play_static_message(self, message_id, block=True):
         """
         Play a pre-recorded static message.
         
         Args:
             message_id (str): Unique identifier for the message
+            block (bool): Whether to wait until the message finishes playing
             
         Returns:
-            bool: True if message was played successfully, False otherwise
+            PlaybackHandle: Completion handle if the message was played, None otherwise
         """
         try:
-            from elevenlabs import play
-            
-            file_path = os.path.join(self.audio_dir, f"{message_id}.mp3")
-            
-            # Check if file exists
-            if not os.path.exists(file_path):
-                print(f"Static message '{message_id}' not found at {file_path}")
-                return False
-            
-            # Play the audio file
-            with open(file_path, "rb") as audio_file:
-                play(audio_file.read())
-            
-            return True
+            with span("play_static_message", message_id=message_id, block=block):
+                # Get the decoded clip from memory (decoded on first use if not preloaded)
+                clip = self.audio_bank.get(message_id)
+                if clip is None:
+                    file_path = os.path.join(self.audio_dir, f"{message_id}.mp3")
+                    print(f"Static message '{message_id}' not found at {file_path}")
+                    return None
+                
+                # Play the clip straight from memory on the prompt channel
+                return get_audio_engine().play_pcm(clip.samples, clip.sample_rate,
+                                                   channel=PROMPT_CHANNEL, block=block)
         except Exception as e:
             print(f"Error playing static message '{message_id}': {e}")
-            return False
+            return None
     
     def get_message_text(self, message_id):
         """
@@ -123,6 +148,7 @@ def main():
         "genre_prompt": "What's the genre of your song?",
         "styles_prompt": "Describe the musical styles of your song.",
         "lyrics_prompt": "Describe the lyrics of your song.",
+        "describe_custom_song": "What's the name of your song? What's the genre of your song? Describe the musical styles of your song. Describe the lyrics of your song.",
         "roast_intro": "Prepare to be roasted!",
         "try_again": "Try again, oh master of terrible music choices.",
         "acceptable_song": "Finally! You picked an acceptable song.",
@@ -176,8 +202,6 @@ def main():
         # Play the message
         print(f"Playing '{msg_id}' message...")
         static_msgs.play_static_message(msg_id)
-        import time
-        time.sleep(2)  # Wait for playback to finish
         
         print(f"Completed testing for '{msg_id}'")
     
@@ -1,103 +1,335 @@
+import time
+import threading
+from enum import Enum
+from metrics import counter
+
+
+class State(str, Enum):
+    """
+    The states the jukebox can be in.
+    """
+    IDLE = "idle"
+    LISTENING = "listening"
+    LOADING = "loading"
+    PLAYING = "playing"
+    CUSTOM_GENERATING = "custom_generating"
+
+
+# Allowed transitions: current state -> states it may move to
+TRANSITIONS = {
+    State.IDLE: {State.LISTENING, State.LOADING, State.CUSTOM_GENERATING},
+    State.LISTENING: {State.IDLE, State.LOADING, State.CUSTOM_GENERATING},
+    State.LOADING: {State.PLAYING, State.IDLE},
+    State.CUSTOM_GENERATING: {State.LOADING, State.IDLE},
+    State.PLAYING: {State.LOADING, State.IDLE},
+}
+
+
+STATE_SECONDS = counter("jukebox_status_seconds_total", "Time spent in each status state, counted when the state is left", ("state",))
+
+
+class InvalidTransitionError(ValueError):
+    """
+    Raised when a status change is not allowed from the current state.
+    """
+
+
 class Status:
     """
-    A class to manage the status of song loading and playing.
+    A thread-safe state machine for song loading and playing.
     This follows the Single Responsibility Principle by focusing only on status management.
+
+    Transitions are atomic, threads can block until a state is reached with wait_until(),
+    and subscribers are notified of every change.
+
+    Background custom song jobs are tracked next to the state machine, so their
+    progress is visible without holding the kiosk in CUSTOM_GENERATING.
     """
-    
+
     def __init__(self):
         """
-        Initialize the status flags.
+        Initialize the status in the idle state.
         """
-        self._loading_song = False
-        self._playing_song = False
-        self._loading_custom_song = False
-        self._playing_custom_song = False
-    
+        self._state = State.IDLE
+        self._entered_at = time.monotonic()
+        self._custom = False
+        self._changed = threading.Condition()
+        self._subscribers = []
+        self._jobs = {}
+        self._job_subscribers = []
+
     @property
-    def loading_song(self):
+    def state(self):
         """
-        Get the loading_song status.
-        
+        Get the current state.
+
         Returns:
-            bool: True if a song is currently loading, False otherwise.
+            State: The current state
+        """
+        with self._changed:
+            return self._state
+
+    @property
+    def custom(self):
+        """
+        Get whether the current song activity concerns a custom song.
+
+        Returns:
+            bool: True if the loading or playing song is a custom song, False otherwise.
+        """
+        with self._changed:
+            return self._custom
+
+    def transition(self, new_state, custom=False, expected=None):
+        """
+        Atomically move to a new state and notify waiters and subscribers.
+
+        Args:
+            new_state (State): The state to move to
+            custom (bool): Whether the new state concerns a custom song
+            expected (State or iterable, optional): States the machine must currently be in
+
+        Returns:
+            State: The state before the transition
+
+        Raises:
+            InvalidTransitionError: If the transition is not allowed from the current state
+        """
+        new_state = State(new_state)
+        with self._changed:
+            old_state = self._state
+            if expected is not None and old_state not in self._as_set(expected):
+                raise InvalidTransitionError(
+                    f"Expected state in {sorted(s.value for s in self._as_set(expected))}, "
+                    f"but status is '{old_state.value}'"
+                )
+            if new_state != old_state and new_state not in TRANSITIONS[old_state]:
+                raise InvalidTransitionError(
+                    f"Cannot move from '{old_state.value}' to '{new_state.value}'"
+                )
+            if new_state != old_state:
+                now = time.monotonic()
+                STATE_SECONDS.labels(old_state.value).inc(now - self._entered_at)
+                self._entered_at = now
+            self._state = new_state
+            self._custom = bool(custom) and new_state != State.IDLE
+            self._changed.notify_all()
+            subscribers = list(self._subscribers)
+
+        # Run callbacks outside the lock so they can query or change the status
+        for callback in subscribers:
+            try:
+                callback(old_state, new_state, self)
+            except Exception as e:
+                print(f"Error in status subscriber: {e}")
+        return old_state
+
+    def reset(self):
+        """
+        Return to the idle state from any state, e.g. after an error.
+        """
+        with self._changed:
+            if self._state == State.IDLE:
+                return
+            current = self._state
+        try:
+            self.transition(State.IDLE, expected=current)
+        except InvalidTransitionError:
+            # Another thread changed the state first; it owns the next transition
+            pass
+
+    def wait_until(self, states, timeout=None):
+        """
+        Block until the status is in one of the given states.
+
+        Args:
+            states (State or iterable): State(s) to wait for
+            timeout (float, optional): Maximum number of seconds to wait
+
+        Returns:
+            bool: True if the state was reached, False if the timeout expired first
+        """
+        wanted = self._as_set(states)
+        with self._changed:
+            return self._changed.wait_for(lambda: self._state in wanted, timeout)
+
+    def wait_while(self, states, timeout=None):
+        """
+        Block while the status is in one of the given states.
+
+        Args:
+            states (State or iterable): State(s) to wait out
+            timeout (float, optional): Maximum number of seconds to wait
+
+        Returns:
+            bool: True if the status left the states, False if the timeout expired first
+        """
+        unwanted = self._as_set(states)
+        with self._changed:
+            return self._changed.wait_for(lambda: self._state not in unwanted, timeout)
+
+    def subscribe(self, callback):
+        """
+        Register a callback for state changes.
+
+        Args:
+            callback (callable): Function called as callback(old_state, new_state, status)
+
+        Returns:
+            callable: A function that removes the subscription
+        """
+        with self._changed:
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._changed:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+        return unsubscribe
+
+    def update_job(self, job_id, state, **info):
+        """
+        Record the progress of a background custom song job and notify job subscribers.
+
+        Args:
+            job_id (str): Identifier of the job
+            state (str): The job's state, e.g. "queued", "generating" or "ready"
+            **info: Extra details to publish, e.g. progress or song_name
         """
-        return self._loading_song
-    
-    @loading_song.setter
-    def loading_song(self, value):
+        with self._changed:
+            job = dict(self._jobs.get(job_id, {}), **info)
+            job.update(job_id=job_id, state=state)
+            self._jobs[job_id] = job
+            self._changed.notify_all()
+            subscribers = list(self._job_subscribers)
+
+        for callback in subscribers:
+            try:
+                callback(dict(job), self)
+            except Exception as e:
+                print(f"Error in job subscriber: {e}")
+
+    def forget_job(self, job_id):
         """
-        Set the loading_song status.
-        
+        Stop tracking a finished job.
+
         Args:
-            value (bool): The new loading status.
+            job_id (str): Identifier of the job
         """
-        self._loading_song = bool(value)
-    
+        with self._changed:
+            self._jobs.pop(job_id, None)
+
+    def jobs(self):
+        """
+        Get a snapshot of the tracked background jobs.
+
+        Returns:
+            list: One dictionary per job with at least job_id and state
+        """
+        with self._changed:
+            return [dict(job) for job in self._jobs.values()]
+
+    def wait_for_job(self, job_id, states, timeout=None):
+        """
+        Block until a background job reaches one of the given states.
+
+        Args:
+            job_id (str): Identifier of the job
+            states (str or iterable): Job state(s) to wait for
+            timeout (float, optional): Maximum number of seconds to wait
+
+        Returns:
+            bool: True if the state was reached, False if the timeout expired first
+        """
+        wanted = {states} if isinstance(states, str) else set(states)
+        with self._changed:
+            return self._changed.wait_for(
+                lambda: self._jobs.get(job_id, {}).get("state") in wanted, timeout)
+
+    def subscribe_jobs(self, callback):
+        """
+        Register a callback for background job updates.
+
+        Args:
+            callback (callable): Function called as callback(job, status) with the job's details
+
+        Returns:
+            callable: A function that removes the subscription
+        """
+        with self._changed:
+            self._job_subscribers.append(callback)
+
+        def unsubscribe():
+            with self._changed:
+                if callback in self._job_subscribers:
+                    self._job_subscribers.remove(callback)
+        return unsubscribe
+
+    @staticmethod
+    def _as_set(states):
+        """
+        Normalize one state or an iterable of states to a set.
+
+        Args:
+            states (State or iterable): State(s) to normalize
+
+        Returns:
+            set: The states as State members
+        """
+        if isinstance(states, (State, str)):
+            return {State(states)}
+        return {State(s) for s in states}
+
+    @property
+    def loading_song(self):
+        """
+        Get the loading_song status.
+
+        Returns:
+            bool: True if a song is currently loading, False otherwise.
+        """
+        with self._changed:
+            return self._state == State.LOADING and not self._custom
+
     @property
     def playing_song(self):
         """
         Get the playing_song status.
-        
+
         Returns:
             bool: True if a song is currently playing, False otherwise.
         """
-        return self._playing_song
-    
-    @playing_song.setter
-    def playing_song(self, value):
-        """
-        Set the playing_song status.
-        
-        Args:
-            value (bool): The new playing status.
-        """
-        self._playing_song = bool(value)
-    
+        with self._changed:
+            return self._state == State.PLAYING and not self._custom
+
     @property
     def loading_custom_song(self):
         """
         Get the loading_custom_song status.
-        
+
         Returns:
-            bool: True if a custom song is currently loading, False otherwise.
-        """
-        return self._loading_custom_song
-    
-    @loading_custom_song.setter
-    def loading_custom_song(self, value):
-        """
-        Set the loading_custom_song status.
-        
-        Args:
-            value (bool): The new loading status for custom songs.
+            bool: True if a custom song is currently being generated or loading, False otherwise.
         """
-        self._loading_custom_song = bool(value)
-    
+        with self._changed:
+            return self._state == State.CUSTOM_GENERATING or (self._state == State.LOADING and self._custom)
+
     @property
     def playing_custom_song(self):
         """
         Get the playing_custom_song status.
-        
+
         Returns:
             bool: True if a custom song is currently playing, False otherwise.
         """
-        return self._playing_custom_song
-    
-    @playing_custom_song.setter
-    def playing_custom_song(self, value):
-        """
-        Set the playing_custom_song status.
-        
-        Args:
-            value (bool): The new playing status for custom songs.
-        """
-        self._playing_custom_song = bool(value)
-    
+        with self._changed:
+            return self._state == State.PLAYING and self._custom
+
     def is_song_active(self):
         """
-        Check if any song activity is happening (loading or playing).
-        
+        Check if any song activity is happening (generating, loading or playing).
+
         Returns:
-            bool: True if a song is loading or playing, False otherwise.
+            bool: True if a song is generating, loading or playing, False otherwise.
         """
-        return self._loading_song or self._playing_song or self._loading_custom_song or self._playing_custom_song
+        with self._changed:
+            return self._state in (State.LOADING, State.PLAYING, State.CUSTOM_GENERATING)
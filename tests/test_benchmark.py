@@ -0,0 +1,33 @@
+from benchmark import compare, percentile
+
+
+def summary(**values):
+    result = {"failures": 0, "response_p50_ms": 400.0, "llm_calls_per_run": 1.0}
+    result.update(values)
+    return result
+
+
+def test_percentile_of_no_values_is_none():
+    assert percentile([], 95) is None
+    assert percentile([1.0, 2.0, 3.0], 50) == 2.0
+
+
+def test_compare_flags_increases_beyond_the_threshold():
+    baseline = {"song_picker": summary()}
+    results = {"song_picker": summary(response_p50_ms=480.0, llm_calls_per_run=1.05)}
+    regressions = compare(results, baseline, 0.10)
+    assert [(name, metric) for name, metric, _, _ in regressions] == [
+        ("song_picker", "response_p50_ms")]
+
+
+def test_compare_flags_new_failures_and_ignores_new_scenarios():
+    baseline = {"song_picker": summary()}
+    results = {"song_picker": summary(failures=1), "new_scenario": summary(failures=3)}
+    assert compare(results, baseline, 0.10) == [("song_picker", "failures", 0, 1)]
+
+
+def test_compare_skips_numbers_without_samples():
+    baseline = {"confirmation": summary(response_p50_ms=None)}
+    results = {"confirmation": summary(response_p50_ms=250.0)}
+    assert compare(results, baseline, 0.10) == []
+    assert compare(baseline, results, 0.10) == []
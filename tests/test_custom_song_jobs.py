@@ -0,0 +1,131 @@
+import os
+import threading
+import pytest
+import soundfile as sf
+from custom_song_jobs import (CustomSongJob, CustomSongJobManager, CustomSongJobStore, JobState,
+                              SongGenerator, StubSongGenerator)
+from status import Status
+
+DETAILS = {"song_name": "Ode to the Stub", "genre": "chiptune", "styles": "bleepy",
+           "lyrics_description": "unit tests"}
+
+
+class FlakyGenerator(StubSongGenerator):
+    """
+    Fails the first `failures` attempts, then generates a short stub song.
+    """
+
+    def __init__(self, failures=0):
+        super().__init__(generation_seconds=0, song_seconds=1)
+        self.failures = failures
+        self.attempts = 0
+
+    def generate(self, job, output_path, progress):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise RuntimeError("backend unavailable")
+        return super().generate(job, output_path, progress)
+
+
+class FakeRequest:
+    def __init__(self):
+        self.finished = threading.Event()
+
+    def wait(self, timeout=None):
+        return self.finished.wait(timeout)
+
+
+class FakePlayer:
+    def __init__(self):
+        self.queued = []
+
+    def enqueue(self, song_path, label=None, custom=False):
+        request = FakeRequest()
+        self.queued.append((song_path, request))
+        return request
+
+
+def make_manager(tmp_path, generator, **kwargs):
+    status = Status()
+    manager = CustomSongJobManager(status, FakePlayer(), store=CustomSongJobStore(str(tmp_path / "jobs.sqlite3")),
+                                   generator=generator, output_dir=str(tmp_path / "songs"), **kwargs)
+    return manager, status
+
+
+def test_song_generator_is_abstract():
+    with pytest.raises(TypeError):
+        SongGenerator()
+
+
+def test_stub_generator_writes_a_song_and_reports_progress(tmp_path):
+    reported = []
+    job = CustomSongJob("job", DETAILS)
+    path = StubSongGenerator(generation_seconds=0, song_seconds=1).generate(job, str(tmp_path / "song"), reported.append)
+
+    assert path == str(tmp_path / "song.wav")
+    assert sf.info(path).duration == pytest.approx(2 * 0.5)
+    assert reported == sorted(reported) and reported[-1] == 1.0
+
+
+def test_ready_subscriber_can_play_the_job_right_away(tmp_path):
+    delivered = []
+    manager, status = make_manager(tmp_path, FlakyGenerator(), deliver=delivered.append)
+    played = []
+    status.subscribe_jobs(lambda job, _: played.extend(manager.play_ready()) if job["state"] == "ready" else None)
+
+    job = manager.submit(DETAILS)
+    assert status.wait_for_job(job.job_id, JobState.PLAYED, timeout=5)
+    assert played == [job] and delivered == [job]
+    assert manager.store.get(job.job_id).state == JobState.PLAYED
+
+
+def test_failed_attempts_are_retried(tmp_path):
+    generator = FlakyGenerator(failures=2)
+    manager, status = make_manager(tmp_path, generator)
+
+    job = manager.submit(DETAILS)
+    assert status.wait_for_job(job.job_id, JobState.READY, timeout=5)
+    stored = manager.store.get(job.job_id)
+    assert stored.attempts == 3 and stored.error is None
+    assert os.path.exists(stored.audio_path)
+
+
+def test_job_fails_after_max_attempts(tmp_path):
+    manager, status = make_manager(tmp_path, FlakyGenerator(failures=5), max_attempts=2)
+
+    job = manager.submit(DETAILS)
+    assert status.wait_for_job(job.job_id, JobState.FAILED, timeout=5)
+    stored = manager.store.get(job.job_id)
+    assert stored.attempts == 2 and stored.error == "backend unavailable"
+    assert manager.play_ready() == []
+
+
+def test_play_ready_queues_the_song_and_marks_it_played(tmp_path):
+    manager, status = make_manager(tmp_path, FlakyGenerator())
+    job = manager.submit(DETAILS)
+    assert status.wait_for_job(job.job_id, JobState.READY, timeout=5)
+
+    assert manager.play_ready() == [job]
+    assert manager.store.get(job.job_id).state == JobState.PLAYING
+    (song_path, request), = manager.song_player.queued
+    assert song_path == job.audio_path
+
+    request.finished.set()
+    assert status.wait_for_job(job.job_id, JobState.PLAYED, timeout=5)
+
+
+def test_unfinished_jobs_are_recovered_after_a_restart(tmp_path):
+    store = CustomSongJobStore(str(tmp_path / "jobs.sqlite3"))
+    song = tmp_path / "generated.wav"
+    sf.write(str(song), [0.0] * 100, 8000)
+    generated = CustomSongJob("generated", DETAILS, state=JobState.PLAYING, audio_path=str(song))
+    interrupted = CustomSongJob("interrupted", dict(DETAILS, song_name="Half Done"),
+                                state=JobState.GENERATING, progress=0.5, attempts=1)
+    store.add(generated)
+    store.add(interrupted)
+    store.close()
+
+    manager, status = make_manager(tmp_path, FlakyGenerator())
+    assert status.wait_for_job("interrupted", JobState.READY, timeout=5)
+    assert [job.job_id for job in manager.play_ready()] == ["generated", "interrupted"]
+    assert manager.store.get("interrupted").attempts == 2
@@ -0,0 +1,44 @@
+import pytest
+from metrics import MetricsRegistry
+
+
+def test_counter_with_labels_is_exposed():
+    registry = MetricsRegistry()
+    requests = registry.counter("cache_requests_total", "Cache lookups", ("cache", "result"))
+    requests.labels("roast_pool", "hit").inc()
+    requests.labels("roast_pool", "hit").inc(2)
+
+    exposition = registry.expose()
+    assert "# TYPE cache_requests_total counter" in exposition
+    assert 'cache_requests_total{cache="roast_pool",result="hit"} 3' in exposition
+
+
+def test_registering_a_name_twice_returns_the_same_metric():
+    registry = MetricsRegistry()
+    first = registry.counter("turns_total", "Turns")
+    assert registry.counter("turns_total", "Turns") is first
+    with pytest.raises(ValueError):
+        registry.gauge("turns_total", "Turns")
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    latency = registry.histogram("call_seconds", "Latency", buckets=(0.1, 1.0))
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    exposition = registry.expose()
+    assert 'call_seconds_bucket{le="0.1"} 1' in exposition
+    assert 'call_seconds_bucket{le="1"} 2' in exposition
+    assert 'call_seconds_bucket{le="+Inf"} 3' in exposition
+    assert "call_seconds_count 3" in exposition
+
+
+def test_cache_requests_is_shared_by_every_cache():
+    import audio_bank
+    import speculation
+    from metrics import CACHE_REQUESTS
+
+    assert audio_bank.CACHE_REQUESTS is CACHE_REQUESTS
+    assert speculation.CACHE_REQUESTS is CACHE_REQUESTS
@@ -0,0 +1,35 @@
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from server import RemoteSession
+
+
+class FakeServer:
+    executor = None
+    static_msgs = object()
+    song_picker = object()
+    custom_song_picker = object()
+    conversation = object()
+    confirmation = object()
+    dialogs = object()
+    stt_timeout = 1.0
+    llm_timeout = 2.0
+    tts_timeout = 3.0
+    listen_timeout = 4.0
+
+
+def test_remote_session_runs_the_orchestrator_initializer():
+    server = FakeServer()
+    session = RemoteSession(server, ws=None)
+
+    assert session.jukebox is None
+    assert session.dialogs is server.dialogs
+    assert session.song_picker is server.song_picker
+    # No audio is played or captured on the server
+    assert session.audio_engine is None
+    assert session.duplex is None
+    assert session.llm_timeout == 2.0
+    assert session.listen_timeout == 4.0
+    assert session._background == set()
+    assert session._next_joke is None
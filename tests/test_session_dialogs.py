@@ -0,0 +1,50 @@
+import time
+import pytest
+from dialog import DialogEngine, LISTEN_FAILED, SessionDialogs, TurnTimeoutError
+from session_store import InMemorySessionStore
+
+
+class FakeConversation:
+    def validate_user_request(self, user_input):
+        return {"relevant": False, "type": "none", "confidence": "low"}
+
+
+class SlowConversation(FakeConversation):
+    def validate_user_request(self, user_input):
+        time.sleep(0.05)
+        return super().validate_user_request(user_input)
+
+
+def make_dialogs(conversation=None):
+    store = InMemorySessionStore()
+    dialogs = SessionDialogs(DialogEngine(), conversation or FakeConversation(), store, offer_frequency=2)
+    return dialogs, store
+
+
+def test_silence_tells_jokes_and_offers(tmp_path):
+    dialogs, store = make_dialogs()
+    dialogs.begin("s1")
+    assert dialogs.turn("s1", "")[0] == {"type": "joke"}
+    actions = dialogs.turn("s1", "")
+    assert {"type": "message", "id": "offer"} in actions
+    assert store.get("s1")["joke_count"] == 2
+
+
+def test_failed_listen_outside_a_dialog_is_treated_as_silence():
+    dialogs, _ = make_dialogs()
+    dialogs.begin("s1")
+    assert dialogs.turn("s1", LISTEN_FAILED)[0] == {"type": "joke"}
+
+
+def test_turn_after_its_deadline_is_not_saved():
+    dialogs, store = make_dialogs(SlowConversation())
+    dialogs.begin("s1")
+    version = store.get("s1")["version"]
+
+    with pytest.raises(TurnTimeoutError):
+        dialogs.turn("s1", "hello", deadline=time.monotonic() + 0.01)
+    assert store.get("s1")["version"] == version
+
+    # The next turn starts from the state the abandoned turn left untouched
+    dialogs.turn("s1", "", deadline=time.monotonic() + 5)
+    assert store.get("s1")["version"] == version + 1
@@ -0,0 +1,136 @@
+import wave
+import dialog
+from dialog import DialogEngine, LISTEN_FAILED
+from song_library import SongLibrary
+from songpicker import SongPicker
+
+
+class FakeLLM:
+    """
+    Answers every song evaluation as acceptable and records the prompts.
+    """
+
+    def __init__(self):
+        self.tasks = []
+
+    def call_llm(self, prompt, task="other"):
+        self.tasks.append(task)
+        if task == "confirmation":
+            return '{"confirmed": true, "change_song": false, "cancel": false, "confidence": "high"}'
+        if task == "roast_pool":
+            return '{"roasts": ["Pooled roast."]}'
+        return '{"acceptable": true, "roast": "LLM roast."}'
+
+
+class FakeConfirmation:
+    def validate_confirmation(self, user_input):
+        return {"confirmed": True, "change_song": False, "cancel": False, "confidence": "high"}
+
+
+def make_engine(tmp_path, titles):
+    for title in titles:
+        with wave.open(str(tmp_path / f"{title}.wav"), "wb") as out:
+            out.setnchannels(1)
+            out.setsampwidth(2)
+            out.setframerate(8000)
+            out.writeframes(b"\x00\x00" * 800)
+    library = SongLibrary(str(tmp_path))
+    library.refresh()
+    llm = FakeLLM()
+    picker = SongPicker(library, llm, static_msgs=object())
+    picker.speculator = None
+    picker.save_to_mongo = lambda song_choice, result: None
+    return DialogEngine(song_picker=picker, confirmation=FakeConfirmation()), llm
+
+
+def say(engine, state, *answers):
+    for answer in answers:
+        state, actions = engine.step(state, answer)
+    return state, actions
+
+
+def test_known_song_skips_the_llm(tmp_path):
+    engine, llm = make_engine(tmp_path, ["Bohemian Rhapsody"])
+    state, _ = engine.start("song")
+    state, _ = say(engine, state, "bohemian rhapsody", "yes")
+    assert state["done"]
+    assert state["outcome"]["choice"] == "Bohemian Rhapsody"
+    assert "song_evaluation" not in llm.tasks
+
+
+def test_unknown_song_is_evaluated_by_the_llm(tmp_path):
+    engine, llm = make_engine(tmp_path, ["Bohemian Rhapsody"])
+    state, _ = engine.start("song")
+    state, _ = say(engine, state, "Never Gonna Give You Up", "yes")
+    assert state["done"]
+    assert state["outcome"]["choice"] == "Never Gonna Give You Up"
+    assert state["outcome"]["result"]["roast"] == "LLM roast."
+    assert llm.tasks.count("song_evaluation") == 1
+
+
+def test_empty_library_is_evaluated_by_the_llm(tmp_path):
+    engine, llm = make_engine(tmp_path, [])
+    state, _ = engine.start("song")
+    state, _ = say(engine, state, "Dancing Queen", "yes")
+    assert state["outcome"]["choice"] == "Dancing Queen"
+    assert llm.tasks.count("song_evaluation") == 1
+
+
+def test_close_match_offers_suggestions_then_accepts_a_repeat(tmp_path):
+    engine, llm = make_engine(tmp_path, ["Hotel California"])
+    state, _ = engine.start("song")
+
+    state, actions = say(engine, state, "Hotel Californication")
+    assert not state["done"]
+    assert any(action["type"] == "say" and "Hotel California" in action["text"] for action in actions)
+    assert "song_evaluation" not in llm.tasks
+
+    # Insisting on the same title goes to the LLM instead of suggesting again
+    state, _ = say(engine, state, "Hotel Californication", "yes")
+    assert state["outcome"]["choice"] == "Hotel Californication"
+    assert llm.tasks.count("song_evaluation") == 1
+
+
+def test_failed_listen_reports_an_error_instead_of_silence(tmp_path):
+    engine, llm = make_engine(tmp_path, ["Bohemian Rhapsody"])
+    state, _ = engine.start("song")
+
+    state, actions = engine.step(state, LISTEN_FAILED)
+    assert actions[0] == {"type": "message", "id": "confirmation_error"}
+    assert state["step"] == "choice"
+
+    state, _ = engine.step(state, "Bohemian Rhapsody")
+    state, actions = engine.step(state, LISTEN_FAILED)
+    assert [action.get("id") for action in actions[:2]] == ["confirmation_error", "try_again"]
+    assert state["step"] == "confirm" and not state["done"]
+
+
+def test_run_dialog_passes_recording_errors_to_the_dialog(tmp_path, monkeypatch):
+    engine, _ = make_engine(tmp_path, ["Bohemian Rhapsody"])
+    answers = iter([RuntimeError("microphone unplugged"), "Bohemian Rhapsody", "yes"])
+
+    def record_audio(filename, record_seconds):
+        answer = next(answers)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    class Transcription:
+        def __init__(self, text):
+            self.text = text
+
+    played = []
+
+    class StaticMessages:
+        def play_static_message(self, message_id):
+            played.append(message_id)
+
+    monkeypatch.setattr(dialog, "record_audio", record_audio)
+    monkeypatch.setattr(dialog, "transcribe_audio_with_elevenlabs", Transcription)
+    monkeypatch.setattr(dialog, "speak_text", lambda text: None)
+
+    state, actions = engine.start("song")
+    outcome = dialog.run_dialog(engine, state, actions, StaticMessages())
+    assert outcome["choice"] == "Bohemian Rhapsody"
+    assert "confirmation_error" in played
+    assert "silence_not_song" not in played
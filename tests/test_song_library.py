@@ -0,0 +1,58 @@
+import wave
+from song_library import SongLibrary
+from titles import normalize_title
+
+
+def write_wav(path, seconds=0.1, sample_rate=8000):
+    with wave.open(str(path), "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(sample_rate)
+        out.writeframes(b"\x00\x00" * int(seconds * sample_rate))
+
+
+def test_normalize_title():
+    assert normalize_title("  Beyoncé – Crazy in Love!! ") == "beyonce crazy in love"
+    assert normalize_title("Simon & Garfunkel") == "simon and garfunkel"
+
+
+def test_lookup_ranks_exact_and_fuzzy_matches(tmp_path):
+    for title in ("Bohemian Rhapsody", "Dancing Queen", "Hotel California"):
+        write_wav(tmp_path / f"{title}.wav")
+    library = SongLibrary(str(tmp_path))
+    library.refresh()
+
+    assert len(library) == 3
+    assert library.lookup("bohemian rhapsody")[0][1] == 1.0
+    entry, score = library.best_match("bohemian rapsody")
+    assert entry.title == "Bohemian Rhapsody"
+    assert score < 1.0
+    assert library.best_match("stairway to heaven") is None
+
+
+def test_recordings_are_not_songs(tmp_path):
+    write_wav(tmp_path / "Dancing Queen.wav")
+    write_wav(tmp_path / "recorded_audio.wav")
+    write_wav(tmp_path / "custom_song_name.wav")
+    library = SongLibrary(str(tmp_path))
+    library.refresh()
+
+    assert [entry.title for entry in library.entries()] == ["Dancing Queen"]
+    assert library.lookup("recorded audio") == []
+
+
+def test_refresh_tracks_changes(tmp_path):
+    write_wav(tmp_path / "Dancing Queen.wav")
+    library = SongLibrary(str(tmp_path))
+    assert library.refresh() == {"added": 1, "updated": 0, "removed": 0}
+
+    write_wav(tmp_path / "Hotel California.wav")
+    (tmp_path / "Dancing Queen.wav").unlink()
+    assert library.refresh() == {"added": 1, "updated": 0, "removed": 1}
+    assert library.best_match("dancing queen") is None
+
+
+def test_missing_root_is_an_empty_library(tmp_path):
+    library = SongLibrary(str(tmp_path / "songs"))
+    library.refresh()
+    assert len(library) == 0
@@ -0,0 +1,167 @@
+import threading
+import pytest
+import song_player
+from audio_engine import PlaybackHandle
+from status import State, Status
+
+
+class FakeSound:
+    def __init__(self, path):
+        self.path = path
+        self.volume = 1.0
+
+    def get_length(self):
+        return 60.0
+
+    def set_volume(self, volume):
+        self.volume = volume
+
+    def get_volume(self):
+        return self.volume
+
+
+class FakeEngine:
+    """
+    Plays nothing: songs run until finish(), skip() or stop(). Decoding a path in
+    `slow` blocks until `release` is set.
+    """
+
+    def __init__(self, slow=()):
+        self.slow = set(slow)
+        self.loading = threading.Event()
+        self.release = threading.Event()
+        self.active = []
+        self.started = []
+        self.lock = threading.Lock()
+
+    def load_sound(self, path):
+        if path in self.slow:
+            self.loading.set()
+            self.release.wait(5)
+        return FakeSound(path)
+
+    def play_sound(self, sound, channel=None, block=True, queue=False):
+        handle = PlaybackHandle(channel, duration=sound.get_length(), sound=sound)
+        with self.lock:
+            if queue and self.active:
+                self.active.append(handle)
+            else:
+                replaced, self.active = self.active, [handle]
+                for previous in replaced:
+                    previous._finish(interrupted=True)
+            self.started.append(sound.path)
+        return handle
+
+    def finish(self, interrupted=False):
+        with self.lock:
+            handle = self.active.pop(0)
+        handle._finish(interrupted=interrupted)
+
+    def skip(self, channel=None):
+        if self.active:
+            self.finish(interrupted=True)
+
+    def stop(self, channel=None):
+        with self.lock:
+            handles, self.active = self.active, []
+        for handle in handles:
+            handle._finish(interrupted=True)
+
+
+class FakeCatalog:
+    def get(self, path):
+        return None
+
+    def volume_for(self, path, target_db):
+        return 1.0
+
+
+@pytest.fixture
+def make_player(monkeypatch):
+    def make(engine):
+        monkeypatch.setattr(song_player, "get_audio_engine", lambda: engine)
+        return song_player.SongPlayer(Status(), library=object(), catalog=FakeCatalog())
+    return make
+
+
+def wait_for(condition, timeout=5):
+    event = threading.Event()
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return True
+        event.wait(0.01)
+    return False
+
+
+def test_queue_plays_in_order_and_preloads_the_next_song(make_player):
+    engine = FakeEngine()
+    player = make_player(engine)
+    first = player.enqueue("a.wav")
+    second = player.enqueue("b.wav")
+
+    assert wait_for(lambda: engine.started == ["a.wav", "b.wav"])
+    assert player.status.state == State.PLAYING
+    assert [r.song_path for r in player.queued_songs()] == ["a.wav", "b.wav"]
+
+    engine.finish()
+    assert first.wait(5) and not second.done()
+    engine.finish()
+    assert second.wait(5)
+    assert player.wait_until_finished(timeout=5)
+    assert player.status.state == State.IDLE
+
+
+def test_skip_moves_on_to_the_next_song(make_player):
+    engine = FakeEngine()
+    player = make_player(engine)
+    first = player.enqueue("a.wav")
+    second = player.enqueue("b.wav")
+    assert wait_for(lambda: len(engine.started) == 2)
+
+    player.skip()
+    assert first.wait(5) and first.playback.interrupted
+    assert wait_for(lambda: player.queued_songs() == [second])
+    assert player.status.state == State.PLAYING
+
+
+def test_player_is_busy_while_a_song_decodes(make_player):
+    engine = FakeEngine(slow={"a.wav"})
+    player = make_player(engine)
+    request = player.enqueue("a.wav")
+    assert engine.loading.wait(5)
+
+    assert player.queued_songs() == [request]
+    assert not player.wait_until_finished(timeout=0.05)
+    engine.release.set()
+    assert wait_for(lambda: player.status.state == State.PLAYING)
+
+
+def test_stop_while_decoding_discards_the_song(make_player):
+    engine = FakeEngine(slow={"a.wav"})
+    player = make_player(engine)
+    request = player.enqueue("a.wav")
+    later = player.enqueue("b.wav")
+    assert engine.loading.wait(5)
+
+    player.stop()
+    assert later.done()
+    engine.release.set()
+    assert request.wait(5)
+    assert player.wait_until_finished(timeout=5)
+    assert engine.started == []
+    assert player.status.state == State.IDLE
+
+
+def test_stop_during_a_preload_drops_the_preloaded_song(make_player):
+    engine = FakeEngine(slow={"b.wav"})
+    player = make_player(engine)
+    first = player.enqueue("a.wav")
+    second = player.enqueue("b.wav")
+    assert engine.loading.wait(5)
+
+    player.stop()
+    engine.release.set()
+    assert first.wait(5) and second.wait(5)
+    assert player.wait_until_finished(timeout=5)
+    assert engine.started == ["a.wav"]
+    assert player.status.state == State.IDLE
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from mongodb_handler import MongoDBHandler
+
+NOW = datetime(2026, 10, 19, 12, 30, tzinfo=timezone.utc)
+
+
+def request(i, name, hours_ago=0, genre=None, acceptable=True):
+    return {"_id": f"request-{i}", "song_name": name, "genre": genre, "acceptable": acceptable,
+            "timestamp": NOW - timedelta(hours=hours_ago)}
+
+
+@pytest.fixture
+def handler():
+    handler = MongoDBHandler(client=mongomock.MongoClient())
+    handler.upsert_song_documents([
+        request(1, "bohemian rhapsody", hours_ago=30, genre="Rock"),
+        request(2, "Bohemian Rhapsody", hours_ago=1, genre="rock"),
+        request(3, "Bohemian Rhapsody!", hours_ago=0, genre="Rock", acceptable=False),
+        request(4, "Dancing Queen", hours_ago=2, genre="Pop"),
+        request(5, "Dancing Queen", hours_ago=40, genre="Pop"),
+        request(6, "Hotel California", hours_ago=50),
+    ])
+    return handler
+
+
+def test_all_time_top_songs_come_from_the_totals(handler):
+    songs = handler.top_songs(limit=2)
+    assert [(song["title"], song["requests"]) for song in songs] == [
+        ("bohemian rhapsody", 3), ("dancing queen", 2)]
+    # The name shown is the spelling of the latest request
+    assert songs[0]["song_name"] == "Bohemian Rhapsody!"
+    assert songs[0]["acceptance_rate"] == pytest.approx(2 / 3)
+
+
+def test_all_time_top_songs_by_genre(handler):
+    assert [song["title"] for song in handler.top_songs(genre="POP")] == ["dancing queen"]
+
+
+def test_ranged_top_songs_sum_the_rollups(handler):
+    songs = handler.top_songs(since=NOW - timedelta(hours=3))
+    assert [(song["title"], song["requests"]) for song in songs] == [
+        ("bohemian rhapsody", 2), ("dancing queen", 1)]
+    assert songs[0]["song_name"] == "Bohemian Rhapsody!"
+
+
+def test_replays_do_not_count_twice(handler):
+    handler.upsert_song_documents([request(4, "Dancing Queen", hours_ago=2, genre="Pop")])
+    assert handler.top_songs(genre="pop")[0]["requests"] == 2
+
+
+def test_rebuild_totals_matches_incremental_totals(handler):
+    before = handler.top_songs(limit=10)
+    handler.get_totals_collection().delete_many({})
+    assert handler.rebuild_totals() > 0
+    assert handler.top_songs(limit=10) == before
@@ -0,0 +1,113 @@
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from mongodb_handler import MongoDBHandler
+from mongo_writer import SongWriteQueue
+from song_outbox import SongOutbox
+
+
+class RecordingHandler(MongoDBHandler):
+    """
+    A mongomock-backed handler that records batch sizes and can fail the first flushes.
+    """
+
+    def __init__(self, failures=0):
+        super().__init__(client=mongomock.MongoClient())
+        self.failures = failures
+        self.batches = []
+
+    def upsert_song_documents(self, documents):
+        if self.failures > 0:
+            self.failures -= 1
+            return False
+        self.batches.append(len(documents))
+        return super().upsert_song_documents(documents)
+
+
+def song(i, acceptable=True):
+    return {"song_name": f"Song {i}", "acceptable": acceptable, "roast": "Meh."}
+
+
+def test_documents_are_written_in_batches(tmp_path):
+    handler = RecordingHandler()
+    writer = SongWriteQueue(handler, SongOutbox(str(tmp_path / "outbox.jsonl")), batch_size=2, flush_interval=5.0)
+    for i in range(4):
+        assert writer.submit(song(i))
+    assert writer.flush(timeout=5)
+    writer.close()
+
+    assert handler.batches == [2, 2]
+    assert handler.get_collection().count_documents({}) == 4
+    assert writer.metrics()["written"] == 4
+
+
+def test_replayed_documents_are_not_duplicated(tmp_path):
+    handler = MongoDBHandler(client=mongomock.MongoClient())
+    documents = [dict(song(i), _id=f"song-{i}") for i in range(3)]
+
+    assert handler.upsert_song_documents(documents)
+    # A lost acknowledgement replays the same batch
+    assert handler.upsert_song_documents(documents)
+
+    assert handler.get_collection().count_documents({}) == 3
+    rollups = list(handler.get_rollup_collection().find())
+    assert sum(row["requests"] for row in rollups) == 3
+
+
+def test_failed_flushes_are_retried_from_the_outbox(tmp_path):
+    handler = RecordingHandler(failures=2)
+    writer = SongWriteQueue(handler, SongOutbox(str(tmp_path / "outbox.jsonl")),
+                            batch_size=10, flush_interval=0.05, retry_backoff=0.01)
+    writer.submit(song(1))
+    writer.submit(song(2))
+    assert writer.flush(timeout=5)
+    writer.close()
+
+    assert writer.metrics()["failed_attempts"] == 2
+    assert handler.get_collection().count_documents({}) == 2
+
+
+def test_unreplicated_records_are_replayed_after_a_restart(tmp_path):
+    path = str(tmp_path / "outbox.jsonl")
+    # MongoDB is down for the whole first run
+    down = RecordingHandler(failures=10 ** 6)
+    writer = SongWriteQueue(down, SongOutbox(path), flush_interval=0.01, retry_backoff=0.01)
+    writer.submit(song(1))
+    writer.submit(song(2))
+    assert not writer.close(timeout=0.2)
+
+    handler = RecordingHandler()
+    outbox = SongOutbox(path)
+    assert outbox.backlog() == 2
+    writer = SongWriteQueue(handler, outbox, flush_interval=0.01)
+    assert writer.flush(timeout=5)
+    writer.close()
+
+    names = sorted(doc["song_name"] for doc in handler.get_collection().find())
+    assert names == ["Song 1", "Song 2"]
+    assert SongOutbox(path).backlog() == 0
+
+
+def test_songs_reach_the_outbox_without_a_mongodb_uri(tmp_path, monkeypatch):
+    import mongo_writer
+    import mongodb_handler
+
+    monkeypatch.delenv("MONGODB_URI", raising=False)
+    monkeypatch.setenv("SONG_OUTBOX_PATH", str(tmp_path / "outbox.jsonl"))
+    monkeypatch.setenv("MONGODB_WRITE_FLUSH_SECONDS", "0.05")
+    monkeypatch.setattr(mongodb_handler, "_handler", None)
+    monkeypatch.setattr(mongo_writer, "_writer", None)
+
+    writer = mongo_writer.get_song_writer()
+    assert writer.submit(song(1))
+    assert not writer.flush(timeout=0.5)
+    assert writer.metrics()["failed_attempts"] >= 1
+    writer.close(timeout=0)
+
+    # The record waits in the outbox for a configured restart
+    handler = RecordingHandler()
+    writer = SongWriteQueue(handler, SongOutbox(str(tmp_path / "outbox.jsonl")), flush_interval=0.05)
+    assert writer.flush(timeout=5)
+    writer.close()
+    assert handler.get_collection().count_documents({}) == 1
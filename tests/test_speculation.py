@@ -0,0 +1,84 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from speculation import SpeculativeEvaluator
+
+
+class Evaluations:
+    """
+    Records evaluated texts. Texts in `blocked` wait until `release` is set.
+    """
+
+    def __init__(self, blocked=()):
+        self.texts = []
+        self.blocked = set(blocked)
+        self.release = threading.Event()
+
+    def __call__(self, text):
+        self.texts.append(text)
+        if text in self.blocked:
+            self.release.wait(5)
+        return {"text": text}
+
+
+def make_evaluator(evaluate, workers=4):
+    return SpeculativeEvaluator(evaluate, executor=ThreadPoolExecutor(max_workers=workers))
+
+
+def test_matching_speculation_is_reused():
+    evaluate = Evaluations()
+    evaluator = make_evaluator(evaluate)
+    evaluator.launch("Bohemian Rhapsody", "a")
+    assert evaluator.resolve("bohemian rhapsody!", "a") == {"text": "Bohemian Rhapsody"}
+    assert evaluate.texts == ["Bohemian Rhapsody"]
+    assert evaluator.metrics("a")["hits"] == 1
+
+
+def test_resolving_one_session_keeps_the_others_speculations():
+    evaluate = Evaluations()
+    evaluator = make_evaluator(evaluate)
+    evaluator.launch("Dancing Queen", "a")
+    evaluator.launch("Hotel California", "b")
+
+    assert evaluator.resolve("Something Else", "a") == {"text": "Something Else"}
+    assert evaluator.resolve("Hotel California", "b") == {"text": "Hotel California"}
+
+    assert evaluator.metrics("a")["misses"] == 1
+    assert evaluator.metrics("a")["hits"] == 0
+    assert evaluator.metrics("b")["hits"] == 1
+    assert evaluator.metrics("b")["misses"] == 0
+    assert evaluator.metrics()["turns"] == 2
+
+
+def test_speculation_of_another_session_is_not_reused():
+    evaluate = Evaluations()
+    evaluator = make_evaluator(evaluate)
+    evaluator.launch("Dancing Queen", "a")
+    evaluator.resolve("Dancing Queen", "b")
+    assert evaluator.metrics("b")["hits"] == 0
+    assert evaluator.resolve("Dancing Queen", "a") == {"text": "Dancing Queen"}
+    assert evaluator.metrics("a")["hits"] == 1
+
+
+def test_forget_cancels_a_sessions_speculations():
+    evaluate = Evaluations(blocked={"Running"})
+    evaluator = make_evaluator(evaluate, workers=1)
+    evaluator.launch("Running", "a")
+    evaluator.launch("Queued", "a")
+    evaluator.forget("a")
+    evaluate.release.set()
+    evaluator.executor.shutdown(wait=True)
+
+    assert "Queued" not in evaluate.texts
+    assert evaluator.metrics("a")["launched"] == 0
+    assert evaluator.metrics()["launched"] == 2
+
+
+def test_song_picker_speculates_on_songs_the_library_does_not_have(tmp_path):
+    from test_song_dialog import make_engine
+
+    engine, _ = make_engine(tmp_path, ["Dancing Queen"])
+    picker = engine.song_picker
+    picker.speculator = make_evaluator(Evaluations())
+    picker.speculate("Dancing Queen", "a")
+    picker.speculate("Never Gonna Give You Up", "a")
+    assert picker.speculator.metrics("a")["launched"] == 1
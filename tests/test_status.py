@@ -0,0 +1,106 @@
+import threading
+import pytest
+from status import InvalidTransitionError, State, Status, TRANSITIONS
+
+
+def test_every_state_has_transitions():
+    assert set(TRANSITIONS) == set(State)
+
+
+def test_allowed_transitions_return_the_previous_state():
+    status = Status()
+    assert status.transition(State.LOADING) == State.IDLE
+    assert status.transition(State.PLAYING, custom=True) == State.LOADING
+    assert status.playing_custom_song
+    assert status.transition(State.IDLE) == State.PLAYING
+    assert status.state == State.IDLE
+    assert not status.custom
+
+
+def test_disallowed_transition_is_rejected():
+    status = Status()
+    with pytest.raises(InvalidTransitionError):
+        status.transition(State.PLAYING)
+    assert status.state == State.IDLE
+
+
+def test_expected_state_is_checked():
+    status = Status()
+    status.transition(State.LISTENING)
+    with pytest.raises(InvalidTransitionError):
+        status.transition(State.LOADING, expected=State.IDLE)
+    assert status.transition(State.LOADING, expected=(State.IDLE, State.LISTENING)) == State.LISTENING
+
+
+def test_reset_returns_to_idle_from_any_state():
+    status = Status()
+    status.transition(State.CUSTOM_GENERATING)
+    status.reset()
+    assert status.state == State.IDLE
+    status.reset()
+    assert status.state == State.IDLE
+
+
+def test_wait_until_times_out():
+    status = Status()
+    assert not status.wait_until(State.PLAYING, timeout=0.05)
+    assert status.wait_until(State.IDLE, timeout=0)
+
+
+def test_wait_until_wakes_on_transition():
+    status = Status()
+    status.transition(State.LOADING)
+    timer = threading.Timer(0.05, status.transition, (State.PLAYING,))
+    timer.start()
+    try:
+        assert status.wait_until(State.PLAYING, timeout=5)
+    finally:
+        timer.cancel()
+    assert status.wait_while(State.LOADING, timeout=0)
+
+
+def test_subscribers_see_every_change_until_unsubscribed():
+    status = Status()
+    changes = []
+    unsubscribe = status.subscribe(lambda old, new, _: changes.append((old, new)))
+    status.transition(State.LOADING)
+    status.transition(State.IDLE)
+    unsubscribe()
+    status.transition(State.LISTENING)
+    assert changes == [(State.IDLE, State.LOADING), (State.LOADING, State.IDLE)]
+
+
+def test_failing_subscriber_does_not_stop_others():
+    status = Status()
+    seen = []
+
+    def broken(old, new, _):
+        raise RuntimeError("boom")
+
+    status.subscribe(broken)
+    status.subscribe(lambda old, new, _: seen.append(new))
+    status.transition(State.LISTENING)
+    assert seen == [State.LISTENING]
+
+
+def test_subscriber_can_change_the_status():
+    status = Status()
+    status.subscribe(lambda old, new, s: s.transition(State.IDLE) if new == State.LISTENING else None)
+    status.transition(State.LISTENING)
+    assert status.state == State.IDLE
+
+
+def test_job_updates_are_merged_and_published():
+    status = Status()
+    updates = []
+    status.subscribe_jobs(lambda job, _: updates.append(job))
+    status.update_job("job-1", "queued", song_name="Happy Birthday Sam")
+    status.update_job("job-1", "ready", progress=1.0)
+
+    assert status.wait_for_job("job-1", "ready", timeout=0)
+    assert not status.wait_for_job("job-1", "failed", timeout=0.05)
+    assert status.jobs() == [{"job_id": "job-1", "state": "ready", "song_name": "Happy Birthday Sam",
+                              "progress": 1.0}]
+    assert [job["state"] for job in updates] == ["queued", "ready"]
+    status.forget_job("job-1")
+    assert status.jobs() == []
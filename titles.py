@@ -0,0 +1,33 @@
+import re
+import unicodedata
+
+
+def normalize_title(title):
+    """
+    Normalize a song title so STT variations in casing, accents and punctuation compare equal.
+
+    Args:
+        title (str): The raw title or transcription
+
+    Returns:
+        str: Lowercase ASCII words separated by single spaces
+    """
+    title = unicodedata.normalize("NFKD", title)
+    title = title.encode("ascii", "ignore").decode("ascii").lower()
+    title = title.replace("&", " and ")
+    title = re.sub(r"[^a-z0-9]+", " ", title)
+    return " ".join(title.split())
+
+
+def trigrams(normalized):
+    """
+    Split a normalized title into padded character trigrams.
+
+    Args:
+        normalized (str): A title produced by normalize_title()
+
+    Returns:
+        frozenset: The distinct trigrams of the title
+    """
+    padded = f"  {normalized} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
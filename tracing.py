@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import atexit
+import argparse
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+from startup import load_environment
+
+load_environment()
+
+# OTLP span kind and status codes
+SPAN_KIND_INTERNAL = 1
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+# (session_id, turn_id, span_id) of the innermost active span; copied into worker threads by bind()
+_current = contextvars.ContextVar("jukebox_trace", default=(None, None, None))
+
+
+def _new_id(nbytes):
+    return os.urandom(nbytes).hex()
+
+
+def _otlp_value(value):
+    """
+    Encode an attribute value the way OTLP/JSON does (64-bit integers as strings).
+    """
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _plain_value(value):
+    """
+    Decode an OTLP/JSON attribute value.
+    """
+    if "intValue" in value:
+        return int(value["intValue"])
+    for key in ("boolValue", "doubleValue", "stringValue"):
+        if key in value:
+            return value[key]
+    return None
+
+
+class JSONLSpanExporter:
+    """
+    Appends finished spans to a file, one OTLP/JSON span object per line.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize the JSONLSpanExporter.
+
+        Args:
+            path (str): File the spans are appended to
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", buffering=1, encoding="utf-8")
+        atexit.register(self.close)
+
+    def export(self, record):
+        line = json.dumps(record, separators=(",", ":"))
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class Tracer:
+    """
+    Records how long each stage of a conversational turn takes.
+
+    A turn is one trace: its ID is the trace ID, and every span started while it is
+    active (in this thread, or in a thread the work was handed to via bind()) carries
+    the session and turn IDs. Without an exporter tracing is off and span() costs
+    next to nothing.
+    """
+
+    def __init__(self, exporter=None, session_id=None):
+        """
+        Initialize the Tracer.
+
+        Args:
+            exporter (JSONLSpanExporter, optional): Where finished spans go. None disables tracing.
+            session_id (str, optional): Session for turns that do not name one, e.g. the local jukebox.
+                Defaults to a new ID per process.
+        """
+        self.exporter = exporter
+        self.session_id = session_id or _new_id(8)
+
+    @property
+    def enabled(self):
+        return self.exporter is not None
+
+    @contextmanager
+    def turn(self, session_id=None):
+        """
+        Run one conversational turn as a trace with a root "turn" span.
+
+        Args:
+            session_id (str, optional): The session the turn belongs to. Defaults to the tracer's session.
+
+        Yields:
+            str: The turn ID, or None if tracing is off
+        """
+        if not self.enabled:
+            yield None
+            return
+        token = _current.set((session_id or self.session_id, _new_id(16), None))
+        try:
+            with self.span("turn"):
+                yield _current.get()[1]
+        finally:
+            _current.reset(token)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Time a stage. The span is marked as an error if the block raises.
+
+        Args:
+            name (str): Stage name, e.g. "call_llm"
+            **attributes: Extra attributes, e.g. model="..." or bytes=1234
+        """
+        if not self.enabled:
+            yield
+            return
+        session_id, turn_id, parent_id = _current.get()
+        span_id = _new_id(8)
+        token = _current.set((session_id, turn_id, span_id))
+        start = time.time_ns()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            end = time.time_ns()
+            _current.reset(token)
+            self._export(name, session_id, turn_id, span_id, parent_id, start, end, error, attributes)
+
+    def _export(self, name, session_id, turn_id, span_id, parent_id, start, end, error, attributes):
+        if session_id is not None:
+            attributes["session.id"] = session_id
+        if turn_id is not None:
+            attributes["turn.id"] = turn_id
+        record = {
+            # Work outside any turn (e.g. background database writes) gets a trace of its own
+            "traceId": turn_id or _new_id(16),
+            "spanId": span_id,
+            "parentSpanId": parent_id or "",
+            "name": name,
+            "kind": SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": str(start),
+            "endTimeUnixNano": str(end),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()],
+            "status": {"code": STATUS_ERROR, "message": error} if error else {"code": STATUS_OK},
+        }
+        try:
+            self.exporter.export(record)
+        except Exception as e:
+            print(f"Error exporting span '{name}': {e}")
+
+
+# The process-wide tracer
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    """
+    Get the process-wide Tracer. Spans are appended to JUKEBOX_TRACE_FILE;
+    tracing is off if it is not set.
+
+    Returns:
+        Tracer: The shared tracer
+    """
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                path = os.getenv("JUKEBOX_TRACE_FILE")
+                _tracer = Tracer(JSONLSpanExporter(path) if path else None)
+    return _tracer
+
+
+def span(name, **attributes):
+    """
+    Time a stage with the process-wide tracer. See Tracer.span.
+    """
+    return get_tracer().span(name, **attributes)
+
+
+def turn(session_id=None):
+    """
+    Run a conversational turn as a trace with the process-wide tracer. See Tracer.turn.
+    """
+    return get_tracer().turn(session_id)
+
+
+def traced(name):
+    """
+    Decorator that runs every call of a function as a span.
+
+    Args:
+        name (str): Stage name of the span
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            tracer = get_tracer()
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with tracer.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind(func, *args, **kwargs):
+    """
+    Wrap a call so it runs in the caller's trace context, e.g. before handing it to a thread pool.
+
+    Args:
+        func (callable): The function to call
+        *args: Positional arguments for the function
+        **kwargs: Keyword arguments for the function
+
+    Returns:
+        callable: A function taking no arguments
+    """
+    return functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+
+
+def summarize(paths, session_id=None):
+    """
+    Compute latency percentiles per stage from span files.
+
+    Args:
+        paths (list): JSONL span files written by JSONLSpanExporter
+        session_id (str, optional): Only count spans of this session
+
+    Returns:
+        dict: Stage name -> {"count", "errors", "p50_ms", "p95_ms", "p99_ms", "max_ms"}
+    """
+    import numpy as np
+
+    durations = {}
+    errors = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # A line cut short by a crash
+                if session_id is not None:
+                    attributes = {item["key"]: _plain_value(item["value"]) for item in record.get("attributes", [])}
+                    if attributes.get("session.id") != session_id:
+                        continue
+                name = record["name"]
+                elapsed_ms = (int(record["endTimeUnixNano"]) - int(record["startTimeUnixNano"])) / 1e6
+                durations.setdefault(name, []).append(elapsed_ms)
+                if record.get("status", {}).get("code") == STATUS_ERROR:
+                    errors[name] = errors.get(name, 0) + 1
+
+    summary = {}
+    for name, values in durations.items():
+        values = np.array(values)
+        summary[name] = {
+            "count": len(values),
+            "errors": errors.get(name, 0),
+            "p50_ms": float(np.percentile(values, 50)),
+            "p95_ms": float(np.percentile(values, 95)),
+            "p99_ms": float(np.percentile(values, 99)),
+            "max_ms": float(values.max()),
+        }
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize jukebox turn traces: latency percentiles per stage.")
+    parser.add_argument("paths", nargs="*", help="Span files (default: JUKEBOX_TRACE_FILE)")
+    parser.add_argument("--session", help="Only include spans of this session ID")
+    args = parser.parse_args()
+
+    paths = args.paths or [os.getenv("JUKEBOX_TRACE_FILE", "jukebox_traces.jsonl")]
+    summary = summarize(paths, args.session)
+    if not summary:
+        print("No spans found.")
+    else:
+        print(f"{'stage':<34} {'count':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        # Slowest stages first, so the turn (and whatever dominates it) is on top
+        for name, stats in sorted(summary.items(), key=lambda item: -item[1]["p95_ms"]):
+            print(f"{name:<34} {stats['count']:>7} {stats['errors']:>7} {stats['p50_ms']:>9.0f} "
+                  f"{stats['p95_ms']:>9.0f} {stats['p99_ms']:>9.0f} {stats['max_ms']:>9.0f}")